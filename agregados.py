@@ -0,0 +1,380 @@
+import altair as alt
+import branca.colormap as cm
+import folium
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from espacial import SANTIAGO
+
+# --- Cubo de agregados ---
+# Recuentos, sumas y mínimos de distancia y tiempo por Provincia × Concello ×
+# Tipo de centro × TITULARIDADE × tramo de distancia (o de tiempo). Se
+# construye una vez por conjunto de datos y se amplía con anadir() cuando
+# llegan centros nuevos, sin recorrer los ya agregados. Las consultas solo
+# leen los arrays del cubo, de tamaño independiente del número de centros.
+#
+# Los tramos son intervalos (límite anterior, límite]: un máximo que coincide
+# con un límite (60 minutos, 25 km...) es exacto; otro cualquiera se redondea
+# al límite inferior. Un máximo por encima del último límite incluye el tramo
+# final (más de 200 km o 180 min) completo. Las medianas se interpolan dentro
+# del tramo.
+LIMITES_DISTANCIA_KM = np.arange(0.0, 205.0, 5.0)
+LIMITES_TIEMPO_MIN = np.arange(0.0, 185.0, 5.0)
+
+# Dimensiones del cubo además del grupo (Provincia, Concello)
+DIMENSION_TIPO = 'Tipo de centro'
+DIMENSION_TITULARIDADE = 'TITULARIDADE'
+
+# Medidas: columna del DataFrame y límites de sus tramos
+MEDIDAS = {
+    'distancia': ('Distancia_Santiago_km', LIMITES_DISTANCIA_KM),
+    'tiempo': ('Tiempo_Santiago_min', LIMITES_TIEMPO_MIN),
+}
+
+# Etiqueta de los valores nulos de las dimensiones
+SIN_DATO = "(sin dato)"
+
+# Filas que se agregan de cada vez al construir el cubo
+TAMANO_LOTE = 100_000
+
+
+class Vocabulario:
+    """
+    Asigna un código entero estable a cada valor de una dimensión.
+    """
+
+    def __init__(self):
+        self.valores = []
+        self.codigos = {}
+
+    def __len__(self):
+        return len(self.valores)
+
+    def codigo(self, valor):
+        if valor not in self.codigos:
+            self.codigos[valor] = len(self.valores)
+            self.valores.append(valor)
+        return self.codigos[valor]
+
+    def codificar(self, serie):
+        """
+        Códigos de los valores de una Series. Solo se buscan en el diccionario
+        las categorías distintas, no cada fila.
+        """
+        categorias = serie.astype('category').cat
+        traduccion = np.array([self.codigo(str(c)) for c in categorias.categories] + [self.codigo(SIN_DATO)], dtype=np.int64)
+        # Los nulos (código -1) toman el último valor de la traducción
+        return traduccion[categorias.codes.to_numpy()]
+
+
+class CuboAgregados:
+    """
+    Agregados de los centros por grupo (Provincia, Concello), tipo de centro,
+    titularidade y tramo de cada medida.
+
+    Para cada medida se guardan arrays [grupo, tipo, titularidade, tramo] con
+    el número de centros, la suma y el mínimo de la medida.
+    """
+
+    def __init__(self):
+        self.provincias = Vocabulario()
+        self.concellos = Vocabulario()
+        self.tipos = Vocabulario()
+        self.titularidades = Vocabulario()
+        # Grupo (provincia, concello) → índice en el primer eje de los arrays
+        self.grupos = Vocabulario()
+        self.n = 0
+        # Suma de coordenadas por grupo, para situar el grupo en el mapa
+        self.suma_lat = np.zeros(0)
+        self.suma_lon = np.zeros(0)
+        self.centros_grupo = np.zeros(0, dtype=np.int64)
+        self.recuento = {}
+        self.suma = {}
+        self.minimo = {}
+        # Mayor valor de cada medida, para interpolar en el tramo final
+        self.maximo = {medida: -np.inf for medida in MEDIDAS}
+        for medida, (_, limites) in MEDIDAS.items():
+            forma = (0, 0, 0, len(limites) + 1)
+            self.recuento[medida] = np.zeros(forma, dtype=np.int64)
+            self.suma[medida] = np.zeros(forma)
+            self.minimo[medida] = np.full(forma, np.inf)
+        self._acumulados = {}
+
+    @classmethod
+    def desde_dataframe(cls, df, tamano_lote=TAMANO_LOTE):
+        """
+        Construye el cubo añadiendo los centros de df por lotes.
+        """
+        cubo = cls()
+        for inicio in range(0, len(df), tamano_lote):
+            cubo.anadir(df.iloc[inicio:inicio + tamano_lote])
+        return cubo
+
+    def _ampliar(self):
+        # Agranda los arrays si han aparecido grupos, tipos o titularidades nuevos
+        forma = (len(self.grupos), len(self.tipos), len(self.titularidades))
+        for medida in MEDIDAS:
+            actual = self.recuento[medida].shape[:3]
+            if actual == forma:
+                continue
+            relleno = [(0, nuevo - viejo) for nuevo, viejo in zip(forma, actual)] + [(0, 0)]
+            self.recuento[medida] = np.pad(self.recuento[medida], relleno)
+            self.suma[medida] = np.pad(self.suma[medida], relleno)
+            self.minimo[medida] = np.pad(self.minimo[medida], relleno, constant_values=np.inf)
+        extra = len(self.grupos) - len(self.centros_grupo)
+        if extra:
+            self.suma_lat = np.pad(self.suma_lat, (0, extra))
+            self.suma_lon = np.pad(self.suma_lon, (0, extra))
+            self.centros_grupo = np.pad(self.centros_grupo, (0, extra))
+
+    def anadir(self, df):
+        """
+        Añade los centros de df (un DataFrame limpio, ver datos.limpiar_centros)
+        a los agregados.
+        """
+        if df.empty:
+            return self
+        provincia = self.provincias.codificar(df['Provincia'])
+        concello = self.concellos.codificar(df['Concello'])
+        tipo = self.tipos.codificar(df[DIMENSION_TIPO])
+        titularidade = self.titularidades.codificar(df[DIMENSION_TITULARIDADE])
+
+        # Índice de grupo de cada par (provincia, concello) distinto
+        pares, inversa = np.unique(np.stack([provincia, concello], axis=1), axis=0, return_inverse=True)
+        grupo = np.array([self.grupos.codigo((int(p), int(c))) for p, c in pares], dtype=np.int64)[inversa.ravel()]
+        self._ampliar()
+
+        np.add.at(self.suma_lat, grupo, df['latitude'].to_numpy(dtype='float64'))
+        np.add.at(self.suma_lon, grupo, df['longitude'].to_numpy(dtype='float64'))
+        np.add.at(self.centros_grupo, grupo, 1)
+
+        for medida, (columna, limites) in MEDIDAS.items():
+            valores = df[columna].to_numpy(dtype='float64')
+            validos = ~np.isnan(valores)
+            valores = valores[validos]
+            if len(valores):
+                self.maximo[medida] = max(self.maximo[medida], float(valores.max()))
+            tramo = np.searchsorted(limites, valores, side='left')
+            indice = (grupo[validos], tipo[validos], titularidade[validos], tramo)
+            np.add.at(self.recuento[medida], indice, 1)
+            np.add.at(self.suma[medida], indice, valores)
+            np.minimum.at(self.minimo[medida], indice, valores)
+
+        self.n += len(df)
+        self._acumulados = {}
+        return self
+
+    def _acumulado(self, medida):
+        # Recuentos, sumas y mínimos acumulados a lo largo de los tramos: el
+        # valor del tramo k resume todos los centros con la medida ≤ límite k
+        if medida not in self._acumulados:
+            self._acumulados[medida] = (
+                np.cumsum(self.recuento[medida], axis=3),
+                np.cumsum(self.suma[medida], axis=3),
+                np.minimum.accumulate(self.minimo[medida], axis=3),
+            )
+        return self._acumulados[medida]
+
+    def _seleccion(self, vocabulario, valores):
+        if valores is None:
+            return slice(None)
+        return [vocabulario.codigos[v] for v in valores if v in vocabulario.codigos]
+
+    def tramo(self, medida, maximo):
+        """
+        Último tramo incluido con la medida ≤ maximo (None para todos). Por
+        encima del último límite es el tramo final, sin límite superior.
+        """
+        limites = MEDIDAS[medida][1]
+        if maximo is None or maximo > limites[-1]:
+            return len(limites)
+        return int(np.searchsorted(limites, maximo, side='right')) - 1
+
+    def grupos_df(self):
+        """
+        DataFrame con la Provincia, el Concello y las coordenadas medias de cada grupo.
+        """
+        pares = np.array(self.grupos.valores, dtype=np.int64).reshape(-1, 2)
+        centros = np.maximum(self.centros_grupo, 1)
+        return pd.DataFrame({
+            'Provincia': [self.provincias.valores[p] for p in pares[:, 0]],
+            'Concello': [self.concellos.valores[c] for c in pares[:, 1]],
+            'latitude': self.suma_lat / centros,
+            'longitude': self.suma_lon / centros,
+        })
+
+    def resumen(self, medida, maximo=None, por='Provincia', tipos=None, titularidades=None, desglose=None):
+        """
+        Número de centros, mínimo, media y mediana (aproximada) de la medida,
+        para los centros con la medida ≤ maximo de los tipos y titularidades
+        indicados (None para todos), por 'Provincia' o 'Concello'.
+
+        Con desglose=DIMENSION_TIPO o DIMENSION_TITULARIDADE se devuelve además
+        una fila por cada valor de esa dimensión.
+        """
+        k = self.tramo(medida, maximo)
+        columnas = ['n', 'minimo', 'media', 'mediana']
+        if k < 0 or self.n == 0:
+            return pd.DataFrame(columns=columnas)
+        sel_tipo = self._seleccion(self.tipos, tipos)
+        sel_tit = self._seleccion(self.titularidades, titularidades)
+
+        def seleccionar(array):
+            # [grupo, tipo, titularidade, ...] con los tipos y titularidades pedidos
+            return array[:, sel_tipo][:, :, sel_tit]
+
+        recuento, suma, minimo = (seleccionar(a)[..., k] for a in self._acumulado(medida))
+        # Recuentos por tramo (no acumulados) hasta el tramo k, para la mediana
+        por_tramo = seleccionar(self.recuento[medida])[..., :k + 1]
+
+        # Cada valor del desglose es un índice del eje 1 (tipo) o 2 (titularidade)
+        if desglose == DIMENSION_TIPO:
+            eje, vocabulario, seleccion = 1, self.tipos, sel_tipo
+        elif desglose == DIMENSION_TITULARIDADE:
+            eje, vocabulario, seleccion = 2, self.titularidades, sel_tit
+        else:
+            eje = None
+        if eje is None:
+            partes = [(None, lambda array: array)]
+        else:
+            codigos = np.arange(len(vocabulario))[seleccion]
+            partes = [
+                (vocabulario.valores[c], lambda array, j=j: np.take(array, [j], axis=eje))
+                for j, c in enumerate(codigos)
+            ]
+
+        # Cada grupo (provincia, concello) pertenece a una fila del resultado
+        fila, etiquetas = pd.factorize(self.grupos_df()[por], sort=True)
+        limites = MEDIDAS[medida][1]
+        resultados = []
+        for etiqueta, parte in partes:
+            n = np.bincount(fila, weights=parte(recuento).sum(axis=(1, 2)), minlength=len(etiquetas))
+            total = np.bincount(fila, weights=parte(suma).sum(axis=(1, 2)), minlength=len(etiquetas))
+            minimos = np.full(len(etiquetas), np.inf)
+            np.minimum.at(minimos, fila, parte(minimo).min(axis=(1, 2), initial=np.inf))
+            tramos = np.zeros((len(etiquetas), k + 1))
+            np.add.at(tramos, fila, parte(por_tramo).sum(axis=(1, 2)))
+            with np.errstate(invalid='ignore', divide='ignore'):
+                r = pd.DataFrame({
+                    'n': n.astype(np.int64),
+                    'minimo': minimos,
+                    'media': total / n,
+                    'mediana': _mediana_tramos(tramos, limites, minimos, self.maximo[medida]),
+                }, index=pd.Index(etiquetas, name=por))
+            r = r[r['n'] > 0]
+            if etiqueta is not None:
+                r[desglose] = etiqueta
+            resultados.append(r)
+
+        resultado = pd.concat(resultados).reset_index()
+        resultado['minimo'] = resultado['minimo'].replace(np.inf, np.nan)
+        return resultado.set_index([por] + ([desglose] if desglose else []))[columnas]
+
+    def distribucion(self, medida, por='Provincia', tipos=None, titularidades=None):
+        """
+        Número de centros por tramo de la medida y por 'Provincia' o 'Concello'.
+        Devuelve un DataFrame con las columnas por, 'desde', 'hasta' y 'n'.
+        """
+        limites = MEDIDAS[medida][1]
+        recuento = self.recuento[medida][:, self._seleccion(self.tipos, tipos)][:, :, self._seleccion(self.titularidades, titularidades)]
+        tramos = pd.DataFrame(recuento.sum(axis=(1, 2)))
+        tramos[por] = self.grupos_df()[por]
+        tramos = tramos.groupby(por).sum()
+        largo = tramos.reset_index().melt(id_vars=por, var_name='tramo', value_name='n')
+        largo = largo[largo['n'] > 0]
+        tramo = largo['tramo'].to_numpy(dtype=np.int64)
+        largo['desde'] = np.concatenate([[-np.inf], limites])[tramo]
+        largo['hasta'] = np.concatenate([limites, [np.inf]])[tramo]
+        return largo[[por, 'desde', 'hasta', 'n']].reset_index(drop=True)
+
+
+def _mediana_tramos(recuentos, limites, minimos, maximo=-np.inf):
+    """
+    Mediana aproximada de cada fila de recuentos por tramo, interpolando
+    linealmente dentro del tramo que contiene la mitad de los centros. El
+    tramo final va del último límite a maximo.
+    """
+    if recuentos.size == 0:
+        return np.full(len(recuentos), np.nan)
+    acumulado = np.cumsum(recuentos, axis=1)
+    total = acumulado[:, -1]
+    mitad = total / 2
+    k = np.argmax(acumulado >= mitad[:, None], axis=1)
+    filas = np.arange(len(recuentos))
+    anteriores = np.where(k > 0, acumulado[filas, np.maximum(k - 1, 0)], 0)
+    en_tramo = recuentos[filas, k]
+    bordes = np.concatenate([[limites[0]], limites])
+    desde = np.maximum(bordes[k], np.nan_to_num(minimos, posinf=bordes[k]))
+    hasta = np.concatenate([limites, [max(limites[-1], maximo)]])[k]
+    hasta = np.maximum(hasta, desde)
+    fraccion = np.where(en_tramo > 0, (mitad - anteriores) / np.maximum(en_tramo, 1), 0)
+    return np.where(total > 0, desde + fraccion * (hasta - desde), np.nan)
+
+
+@st.cache_resource(show_spinner="Calculando los agregados...", max_entries=8)
+def cubo_agregados(clave, _df):
+    """
+    Cubo de agregados de un conjunto de datos, calculado una sola vez.
+    """
+    return CuboAgregados.desde_dataframe(_df)
+
+
+# --- Gráficos y capas a partir del cubo ---
+def grafico_resumen(resumen, por, desglose, max_grupos=25):
+    """
+    Barras apiladas con el número de centros de cada grupo por valor del
+    desglose. Solo se muestran los max_grupos grupos con más centros.
+    """
+    datos = resumen.reset_index()
+    principales = datos.groupby(por)['n'].sum().nlargest(max_grupos).index
+    datos = datos[datos[por].isin(principales)]
+    return alt.Chart(datos).mark_bar().encode(
+        x=alt.X(f'{por}:N', sort='-y', title=por),
+        y=alt.Y('sum(n):Q', title="Centros"),
+        color=alt.Color(f'{desglose}:N', title=desglose),
+        tooltip=[por, desglose, 'n', alt.Tooltip('minimo:Q', format='.1f'), alt.Tooltip('mediana:Q', format='.1f')],
+    )
+
+
+def grafico_distribucion(distribucion, por, unidad):
+    """
+    Histograma del número de centros por tramo, con una serie por grupo.
+    """
+    datos = distribucion[np.isfinite(distribucion['hasta'])]
+    return alt.Chart(datos).mark_bar(opacity=0.8).encode(
+        x=alt.X('hasta:Q', bin=alt.Bin(binned=True), title=f"Hasta ({unidad})"),
+        x2='desde:Q',
+        y=alt.Y('n:Q', stack=True, title="Centros"),
+        color=alt.Color(f'{por}:N', title=por),
+        tooltip=[por, 'desde', 'hasta', 'n'],
+    )
+
+
+def mapa_coropletas(cubo, resumen):
+    """
+    Mapa con un círculo por concello, situado en la media de sus centros y
+    coloreado según el número de centros del resumen (por 'Concello').
+    """
+    grupos = cubo.grupos_df().groupby('Concello')[['latitude', 'longitude']].mean()
+    recuentos = resumen['n'].groupby(level=0).sum() if not resumen.empty else pd.Series(dtype='int64')
+    centro = grupos[['latitude', 'longitude']].mean().fillna(pd.Series(SANTIAGO, index=['latitude', 'longitude']))
+    m = folium.Map(location=centro.tolist(), zoom_start=8)
+    if recuentos.empty:
+        return m
+
+    escala = cm.linear.YlOrRd_09.scale(0, max(int(recuentos.max()), 1))
+    escala.caption = "Centros por concello"
+    capa = folium.FeatureGroup(name="Centros por concello")
+    for concello, n in recuentos.items():
+        if concello not in grupos.index:
+            continue
+        lat, lon = grupos.loc[concello]
+        folium.CircleMarker(
+            location=[lat, lon], radius=6 + 3 * np.log1p(n), weight=1, color='#555',
+            fill=True, fill_color=escala(n), fill_opacity=0.8,
+            tooltip=f"<b>{concello}</b><br>{n} centros",
+        ).add_to(capa)
+    capa.add_to(m)
+    escala.add_to(m)
+    return m
@@ -0,0 +1,428 @@
+import argparse
+import json
+import math
+import sys
+import traceback
+from collections import namedtuple
+from functools import cached_property
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from calidad import InformeCalidad
+from datos import COLUMNAS_TABLA, DATOS_EJEMPLO, con_clave, es_snapshot, leer_snapshot, limpiar_centros, limpiar_por_bloques
+from espacial import IndiceEspacial
+from filtros import IndiceFiltros, posiciones_filtro
+
+# --- Consultas de centros sin la interfaz de Streamlit ---
+# ServicioCentros carga un conjunto de datos una sola vez, construye los
+# mismos índices que las páginas y responde consultas como esta:
+#
+#   {"max_distancia": 50, "max_tiempo": 45,
+#    "filtro": {"campo": "provincia", "en": ["Lugo"]},     (árbol de filtros.py)
+#    "origen": {"lat": 42.88, "lon": -8.54, "radio_km": 25},  (o "k": 10)
+#    "columnas": ["Código", "Nome"], "limite": 100}
+#
+# Todas las claves son opcionales. Los datos y los índices son de solo
+# lectura, así que varias consultas se pueden responder a la vez desde
+# distintos hilos. La respuesta se serializa como JSON, GeoJSON o Arrow:
+#
+#   python api.py servir --datos centros.csv --puerto 8000
+#   curl 'localhost:8000/centros?max_distancia=50&formato=geojson'
+#   curl -d '{"consultas": [{"max_tiempo": 30}, {"max_tiempo": 60}]}' localhost:8000/consultas
+#   python api.py consultar --datos centros.csv '{"max_distancia": 50}'
+#   python api.py consultar --datos centros.csv --formato arrow < consultas.jsonl > centros.arrow
+#
+# `python benchmark.py --api` mide cuántas consultas por segundo se responden.
+CLAVES_CONSULTA = {'max_distancia', 'max_tiempo', 'filtro', 'origen', 'columnas', 'limite'}
+FORMATOS = {
+    'json': 'application/json',
+    'geojson': 'application/geo+json',
+    'arrow': 'application/vnd.apache.arrow.stream',
+}
+# Columnas de cada centro que se devuelven si la consulta no indica otras
+COLUMNAS_RESPUESTA = COLUMNAS_TABLA + ['latitude', 'longitude']
+# Número máximo de consultas en un mismo lote
+MAX_CONSULTAS_LOTE = 1000
+
+
+# Centros que responden a una consulta: el total que la cumple, las
+# posiciones (en self.df) de los que se devuelven, sus distancias al origen
+# (o None) y las columnas pedidas
+Resultado = namedtuple('Resultado', ['n', 'posiciones', 'distancias', 'columnas'])
+
+
+class ServicioCentros:
+    """
+    Conjunto de datos de centros limpio, con sus índices, que responde
+    consultas de solo lectura.
+    """
+
+    def __init__(self, df, informe=None):
+        self.df = df
+        self.informe = informe if informe is not None else InformeCalidad()
+        self.indice = IndiceFiltros(df)
+        self.indice_espacial = IndiceEspacial(df)
+
+    @classmethod
+    def desde_ruta(cls, ruta=None):
+        """
+        Carga un CSV (por bloques) o un snapshot de centros. Sin ruta, usa los
+        datos de ejemplo.
+        """
+        if ruta is None:
+            df, informe = limpiar_centros(pd.DataFrame(DATOS_EJEMPLO).astype({'Código': str}))
+            return cls(con_clave(df, 'ejemplo'), informe)
+        if es_snapshot(ruta):
+            return cls(con_clave(leer_snapshot(ruta, ruta), ruta))
+        df, informe = limpiar_por_bloques(ruta)
+        return cls(con_clave(df, ruta), informe)
+
+    def posiciones(self, consulta):
+        """
+        Posiciones de los centros que cumplen la consulta y, si tiene origen,
+        sus distancias a él en km (si no, None). Con origen, los centros se
+        ordenan por cercanía; si no, por su posición en los datos. Lanza
+        ValueError si la consulta no es válida.
+        """
+        if not isinstance(consulta, dict):
+            raise ValueError(f"Una consulta debe ser un objeto JSON: {consulta!r}")
+        desconocidas = set(consulta) - CLAVES_CONSULTA
+        if desconocidas:
+            raise ValueError(f"Claves de consulta desconocidas: {sorted(desconocidas)}")
+
+        posiciones = self.indice.filtrar(
+            max_distancia=_numero(consulta, 'max_distancia'), max_tiempo=_numero(consulta, 'max_tiempo')
+        )
+        if consulta.get('filtro'):
+            if not isinstance(consulta['filtro'], dict):
+                raise ValueError("'filtro' debe ser un árbol de filtro (objeto JSON)")
+            por_filtro = posiciones_filtro(self.df, consulta['filtro'], self.indice)
+            posiciones = np.intersect1d(posiciones, por_filtro, assume_unique=True)
+
+        origen = consulta.get('origen')
+        if not origen:
+            return posiciones, None
+        if not isinstance(origen, dict) or 'lat' not in origen or 'lon' not in origen:
+            raise ValueError("'origen' necesita 'lat' y 'lon'")
+        lat, lon = _numero(origen, 'lat'), _numero(origen, 'lon')
+        filtrados = self.indice.mascara(posiciones)
+        if origen.get('k') is not None:
+            # Los k más cercanos de entre los que cumplen los filtros
+            cercanos, distancias = self.indice_espacial.mas_cercanos(lat, lon, int(_numero(origen, 'k')), mascara=filtrados)
+        elif origen.get('radio_km') is not None:
+            cercanos, distancias = self.indice_espacial.en_radio(lat, lon, _numero(origen, 'radio_km'))
+        else:
+            raise ValueError("'origen' necesita 'radio_km' o 'k'")
+        # Como en app.py: los centros cercanos que además cumplen los filtros
+        en_filtros = filtrados[cercanos]
+        return cercanos[en_filtros], distancias[en_filtros]
+
+    def seleccionar(self, consulta):
+        """
+        Resultado de una consulta: aplica posiciones(), el 'limite' y
+        comprueba las 'columnas' pedidas.
+        """
+        posiciones, distancias = self.posiciones(consulta)
+        n = len(posiciones)
+        limite = _numero(consulta, 'limite')
+        if limite is not None:
+            if limite < 0:
+                raise ValueError("'limite' no puede ser negativo")
+            posiciones = posiciones[:int(limite)]
+            distancias = distancias[:int(limite)] if distancias is not None else None
+        if distancias is not None:
+            distancias = distancias.round(1)
+
+        columnas = consulta.get('columnas') or COLUMNAS_RESPUESTA
+        if not isinstance(columnas, list) or not all(isinstance(columna, str) for columna in columnas):
+            raise ValueError("'columnas' debe ser una lista de nombres de columna")
+        faltan = [columna for columna in columnas if columna not in self.df.columns]
+        if faltan:
+            raise ValueError(f"Columnas desconocidas: {faltan}")
+        return Resultado(n, posiciones, distancias, columnas)
+
+    def consultar(self, consulta):
+        """
+        Responde una consulta. Devuelve una tupla (n, df) con el número total
+        de centros que la cumplen y el DataFrame con las columnas pedidas de
+        los primeros 'limite' centros.
+        """
+        resultado = self.seleccionar(consulta)
+        df = self.df[resultado.columnas].take(resultado.posiciones)
+        if resultado.distancias is not None:
+            df = df.assign(Distancia_origen_km=resultado.distancias)
+        return resultado.n, df
+
+    def responder(self, consultas, formato='json'):
+        """
+        Serializa las respuestas a una lista de consultas en el formato dado
+        (ver FORMATOS). Devuelve los bytes de la respuesta.
+
+        En JSON y GeoJSON la respuesta es {"resultados": [...]}, con un objeto
+        por consulta que incluye "n", el total de centros que la cumplen. En
+        Arrow es una sola tabla con la columna 'consulta' (posición de la
+        consulta en la lista) delante de las demás.
+        """
+        if not isinstance(formato, str) or formato not in FORMATOS:
+            raise ValueError(f"Formato desconocido: {formato!r}")
+        if len(consultas) > MAX_CONSULTAS_LOTE:
+            raise ValueError(f"Como mucho {MAX_CONSULTAS_LOTE} consultas por lote")
+        resultados = [self.seleccionar(consulta) for consulta in consultas]
+        if formato == 'arrow':
+            return a_ipc(self._tabla_arrow(resultados))
+        serializar = self._json if formato == 'json' else self._geojson
+        return b'{"resultados":[' + b','.join(serializar(resultado) for resultado in resultados) + b']}'
+
+    # --- Serialización ---
+    # Los datos no cambian, así que cada centro se serializa una sola vez por
+    # formato (con las columnas por defecto) y una respuesta solo concatena
+    # los fragmentos de sus centros. El fragmento queda abierto para añadir
+    # la distancia al origen. Con otras columnas se serializan solo las filas
+    # de la respuesta, tomadas de la tabla Arrow.
+    @cached_property
+    def _fragmentos_json(self):
+        lineas = self.df[COLUMNAS_RESPUESTA].to_json(orient='records', lines=True, force_ascii=False, double_precision=15)
+        return [linea.encode('utf-8')[:-1] for linea in lineas.splitlines()]
+
+    @cached_property
+    def _fragmentos_geojson(self):
+        propiedades = self.df[COLUMNAS_RESPUESTA].drop(columns=['latitude', 'longitude'])
+        lineas = propiedades.to_json(orient='records', lines=True, force_ascii=False, double_precision=15).splitlines()
+        coordenadas = zip(self.df['longitude'].tolist(), self.df['latitude'].tolist())
+        return [
+            b'{"type":"Feature","geometry":{"type":"Point","coordinates":[%r,%r]},"properties":%s'
+            % (lon, lat, linea.encode('utf-8')[:-1])
+            for (lon, lat), linea in zip(coordenadas, lineas)
+        ]
+
+    @cached_property
+    def _tabla(self):
+        return pa.Table.from_pandas(self.df, preserve_index=False).replace_schema_metadata(None)
+
+    @staticmethod
+    def _unir(fragmentos, resultado, cierre):
+        if resultado.distancias is None:
+            return b','.join(fragmentos[posicion] + cierre for posicion in resultado.posiciones)
+        return b','.join(
+            b'%s,"Distancia_origen_km":%r%s' % (fragmentos[posicion], distancia, cierre)
+            for posicion, distancia in zip(resultado.posiciones.tolist(), resultado.distancias.tolist())
+        )
+
+    def _filas(self, resultado):
+        filas = self._tabla.select(resultado.columnas).take(resultado.posiciones).to_pylist()
+        if resultado.distancias is not None:
+            for fila, distancia in zip(filas, resultado.distancias.tolist()):
+                fila['Distancia_origen_km'] = distancia
+        return filas
+
+    def _json(self, resultado):
+        if resultado.columnas is not COLUMNAS_RESPUESTA:
+            return a_json(resultado.n, self._filas(resultado))
+        return b'{"n":%d,"centros":[%s]}' % (resultado.n, self._unir(self._fragmentos_json, resultado, b'}'))
+
+    def _geojson(self, resultado):
+        if resultado.columnas is not COLUMNAS_RESPUESTA:
+            return a_geojson(resultado.n, self._filas(resultado))
+        features = self._unir(self._fragmentos_geojson, resultado, b'}}')
+        return b'{"type":"FeatureCollection","n":%d,"features":[%s]}' % (resultado.n, features)
+
+    def _tabla_arrow(self, resultados):
+        tablas = []
+        for i, resultado in enumerate(resultados):
+            tabla = self._tabla.select(resultado.columnas).take(resultado.posiciones)
+            if resultado.distancias is not None:
+                tabla = tabla.append_column('Distancia_origen_km', pa.array(resultado.distancias))
+            tablas.append(tabla.add_column(0, 'consulta', pa.array(np.full(len(tabla), i, dtype=np.int32))))
+        # Las columnas que solo tienen algunas consultas (como la distancia al origen) quedan nulas en las demás
+        return pa.concat_tables(tablas, promote_options='permissive')
+
+
+def _numero(consulta, clave):
+    valor = consulta.get(clave)
+    if valor is None:
+        return None
+    try:
+        numero = float(valor)
+    except (TypeError, ValueError):
+        raise ValueError(f"'{clave}' debe ser un número: {valor!r}") from None
+    if not math.isfinite(numero):
+        raise ValueError(f"'{clave}' debe ser un número finito: {valor!r}")
+    return numero
+
+
+# --- Formatos de respuesta ---
+def a_json(n, filas):
+    """
+    {"n": total, "centros": [un objeto por centro]} en bytes, a partir de una
+    lista de diccionarios (uno por centro).
+    """
+    return json.dumps({'n': n, 'centros': filas}, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def a_geojson(n, filas):
+    """
+    FeatureCollection GeoJSON con un punto por centro y el resto de columnas
+    como propiedades, más el miembro "n" con el total de centros.
+    """
+    features = []
+    for fila in filas:
+        propiedades = dict(fila)
+        lat, lon = propiedades.pop('latitude', None), propiedades.pop('longitude', None)
+        geometria = {'type': 'Point', 'coordinates': [lon, lat]} if lat is not None and lon is not None else None
+        features.append({'type': 'Feature', 'geometry': geometria, 'properties': propiedades})
+    return json.dumps({'type': 'FeatureCollection', 'n': n, 'features': features}, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def a_ipc(tabla):
+    """
+    Una tabla Arrow como stream IPC en bytes.
+    """
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, tabla.schema) as escritor:
+        escritor.write_table(tabla)
+    return sink.getvalue().to_pybytes()
+
+
+# --- Servidor HTTP ---
+# GET  /salud                      número de centros y resumen de la calidad de los datos
+# GET  /centros?max_distancia=50   una consulta con los parámetros en la URL
+#                                  ('filtro' y 'origen' como JSON, 'columnas' separadas por comas)
+# POST /centros                    una consulta en el cuerpo (JSON)
+# POST /consultas                  un lote: {"consultas": [...], "formato": "geojson"}
+# El formato se elige con 'formato' (json por defecto). Cada conexión se
+# atiende en un hilo y se mantiene abierta entre peticiones (HTTP/1.1).
+class ManejadorCentros(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Las cabeceras y el cuerpo se escriben por separado: sin esto, Nagle y el
+    # ACK retardado añaden ~40 ms a cada respuesta en una conexión persistente
+    disable_nagle_algorithm = True
+    servicio = None
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path == '/salud':
+            informe = self.servicio.informe
+            self._responder(200, json.dumps({
+                'centros': len(self.servicio.df),
+                'calidad': informe.resumen()[['regla', 'filas']].to_dict(orient='records'),
+            }).encode('utf-8'), FORMATOS['json'])
+        elif url.path == '/centros':
+            parametros = {clave: valores[-1] for clave, valores in parse_qs(url.query).items()}
+            formato = parametros.pop('formato', 'json')
+            self._consultar(lambda: [consulta_desde_parametros(parametros)], formato)
+        else:
+            self._error(404, f"Ruta desconocida: {url.path}")
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        try:
+            longitud = int(self.headers.get('Content-Length', 0))
+            cuerpo = json.loads(self.rfile.read(longitud) or b'{}')
+        except ValueError as error:
+            self._error(400, f"El cuerpo no es un JSON válido: {error}")
+            return
+        if not isinstance(cuerpo, dict):
+            self._error(400, "El cuerpo debe ser un objeto JSON")
+        elif url.path == '/centros':
+            formato = cuerpo.pop('formato', 'json')
+            self._consultar(lambda: [cuerpo], formato)
+        elif url.path == '/consultas':
+            self._consultar(lambda: _lista_consultas(cuerpo.get('consultas')), cuerpo.get('formato', 'json'), lote=True)
+        else:
+            self._error(404, f"Ruta desconocida: {url.path}")
+
+    def _consultar(self, leer_consultas, formato, lote=False):
+        try:
+            cuerpo = self.servicio.responder(leer_consultas(), formato)
+        except ValueError as error:
+            self._error(400, str(error))
+            return
+        except Exception as error:
+            # Un error inesperado responde 500 en lugar de cortar la conexión
+            traceback.print_exc()
+            self._error(500, f"Error interno: {type(error).__name__}")
+            return
+        if not lote and formato != 'arrow':
+            # Una consulta suelta devuelve su resultado, sin la lista del lote
+            cuerpo = cuerpo[len(b'{"resultados":['):-len(b']}')]
+        self._responder(200, cuerpo, FORMATOS[formato])
+
+    def _error(self, estado, mensaje):
+        self._responder(estado, json.dumps({'error': mensaje}, ensure_ascii=False).encode('utf-8'), FORMATOS['json'])
+
+    def _responder(self, estado, cuerpo, tipo):
+        self.send_response(estado)
+        self.send_header('Content-Type', tipo)
+        self.send_header('Content-Length', str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def log_message(self, formato, *argumentos):
+        # Sin una línea en stderr por petición: con muchas consultas domina el tiempo
+        pass
+
+
+def _lista_consultas(consultas):
+    if not isinstance(consultas, list) or not all(isinstance(consulta, dict) for consulta in consultas):
+        raise ValueError("'consultas' debe ser una lista de objetos")
+    return consultas
+
+
+def consulta_desde_parametros(parametros):
+    """
+    Convierte los parámetros de una URL (textos) en una consulta.
+    """
+    consulta = dict(parametros)
+    for clave in ('filtro', 'origen'):
+        if clave in consulta:
+            try:
+                consulta[clave] = json.loads(consulta[clave])
+            except ValueError:
+                raise ValueError(f"'{clave}' debe ser un JSON válido") from None
+    if 'columnas' in consulta:
+        consulta['columnas'] = consulta['columnas'].split(',')
+    return consulta
+
+
+def crear_servidor(servicio, puerto=8000, host=''):
+    """
+    Servidor HTTP (sin arrancar) que responde con el servicio dado. Con
+    puerto 0 el sistema elige uno libre (servidor.server_address[1]).
+    """
+    manejador = type('Manejador', (ManejadorCentros,), {'servicio': servicio})
+    servidor = ThreadingHTTPServer((host, puerto), manejador)
+    servidor.daemon_threads = True
+    return servidor
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Consultas de centros sin la interfaz de Streamlit.")
+    parser.add_argument('--datos', help="CSV o snapshot de centros. Por defecto, los datos de ejemplo")
+    ordenes = parser.add_subparsers(dest='orden', required=True)
+    servir = ordenes.add_parser('servir', help="Arranca el servidor HTTP")
+    servir.add_argument('--puerto', type=int, default=8000)
+    servir.add_argument('--host', default='')
+    consultar = ordenes.add_parser('consultar', help="Responde consultas JSON (argumentos, o una por línea en stdin) y escribe la respuesta en stdout")
+    consultar.add_argument('consultas', nargs='*')
+    consultar.add_argument('--formato', choices=list(FORMATOS), default='json')
+    args = parser.parse_args()
+
+    servicio = ServicioCentros.desde_ruta(args.datos)
+    if args.orden == 'servir':
+        servidor = crear_servidor(servicio, args.puerto, args.host)
+        print(f"{len(servicio.df)} centros. Escuchando en http://{args.host or 'localhost'}:{servidor.server_address[1]}")
+        servidor.serve_forever()
+    else:
+        textos = args.consultas or [linea for linea in sys.stdin if linea.strip()]
+        try:
+            sys.stdout.buffer.write(servicio.responder([json.loads(texto) for texto in textos], args.formato))
+        except ValueError as error:
+            sys.exit(f"Consulta no válida: {error}")
+
+
+if __name__ == '__main__':
+    main()
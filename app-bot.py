@@ -1,10 +1,12 @@
 import streamlit as st
-import pandas as pd
-import folium
-from streamlit_folium import st_folium
-import google.generativeai as genai
+from metricas import Traza, mostrar_panel, registro_metricas
 import json
 import os
+import time
+
+# Como en app.py, los módulos pesados se importan después de la cabecera, en
+# la etapa 'importaciones', y google.generativeai solo cuando una consulta
+# necesita al modelo (ver chatbot.modelo_gemini).
 
 # Título de la aplicación
 st.set_page_config(
@@ -14,6 +16,9 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+# Tiempos de las etapas de esta ejecución (ver metricas.py)
+traza = Traza("app-bot", registro_metricas())
+
 st.title("🗺️ Centros Educativos en Galicia")
 
 # --- Resumen al principio de la app ---
@@ -21,132 +26,94 @@ st.markdown(
     """
     Bienvenido/a al visualizador de centros educativos en Galicia. Aquí podrás
     ver centros en un mapa y en una tabla. **Usa el chat en la barra lateral para
-    filtrar los centros por distancia o tiempo de viaje a Santiago de Compostela.**
+    filtrar los centros por distancia o tiempo de viaje a Santiago de Compostela,
+    concello, provincia, tipo de centro o titularidad.**
 
     Ejemplos de preguntas:
     * "Muestra los centros a 50 km de Santiago."
     * "Quiero ver los centros a 45 minutos de Santiago."
+    * "Centros públicos de Lugo u Ourense a menos de 60 minutos."
     """
 )
 
-# Configuración de la API de Gemini
+with traza.etapa('importaciones'):
+    from calidad import mostrar_informe
+    from datos import COLUMNAS_TABLA, cargar_archivo, cargar_ejemplo, cargar_snapshot, clave_datos
+    from chatbot import (ClienteLLM, MAX_LLAMADAS_SIMULTANEAS, REINTENTOS_LLM, TIMEOUT_LLM_SEGUNDOS,
+                         cache_consultas, consultar_http, filtros_locales, modelo_gemini)
+
 # --- Configuración de la API de Gemini ---
+# El modelo se crea una sola vez por proceso, con la primera consulta que lo necesita
 API_KEY = '' # Reemplaza con tu clave
-genai.configure(api_key=API_KEY)
-model = genai.GenerativeModel('gemini-2.0-flash')
+
+# Servidor alternativo al que enviar las consultas (p. ej. modelo_falso.py)
+# y política de las llamadas al modelo
+LLM_URL = os.environ.get("LLM_URL")
+LLM_TIMEOUT = float(os.environ.get("LLM_TIMEOUT", TIMEOUT_LLM_SEGUNDOS))
+LLM_CONCURRENCIA = int(os.environ.get("LLM_CONCURRENCIA", MAX_LLAMADAS_SIMULTANEAS))
+LLM_REINTENTOS = int(os.environ.get("LLM_REINTENTOS", REINTENTOS_LLM))
 
 # --- Carga de datos ---
-uploaded_file = st.file_uploader("Sube tu archivo CSV de centros", type="csv")
-df = pd.DataFrame()
+# Además de CSV se aceptan snapshots columnares generados con `python datos.py`
+uploaded_file = st.file_uploader("Sube tu archivo CSV de centros", type=["csv", "arrow", "feather", "parquet"])
+
+# Snapshot por defecto en el servidor (si está configurado)
+ruta_snapshot = os.environ.get("CENTROS_SNAPSHOT")
 
 if uploaded_file is not None:
     try:
-        df = pd.read_csv(uploaded_file, sep=',') # Asume que el separador es ','
+        # La lectura y limpieza se cachean por el hash del contenido del archivo,
+        # por lo que solo se repiten cuando se sube un archivo distinto.
+        # Los CSV muy grandes se leen por bloques, mostrando el progreso
+        with traza.etapa('importaciones'):
+            from mapa import VistaPreviaCarga
+        vista_previa = VistaPreviaCarga(st.empty())
+        with traza.etapa('carga'):
+            df, informe = cargar_archivo(uploaded_file, vista_previa)
+        vista_previa.terminar()
         st.success("Archivo CSV cargado exitosamente.")
 
-        original_rows = len(df)
-
-        # Convertir 'Distancia_Santiago_km' y 'Tiempo_Santiago_min' a numérico,
-        # forzando los valores no numéricos (como 'ERROR') a NaN.
-        df['Distancia_Santiago_km'] = pd.to_numeric(df['Distancia_Santiago_km'], errors='coerce')
-        df['Tiempo_Santiago_min'] = pd.to_numeric(df['Tiempo_Santiago_min'], errors='coerce')
-
-        # --- FIX: Convert COORDENADA_X and COORDENADA_Y to numeric ---
-        # Convertir 'COORDENADA_X' y 'COORDENADA_Y' a numérico,
-        # forzando los valores no numéricos a NaN.
-        df['COORDENADA_X'] = pd.to_numeric(df['COORDENADA_X'], errors='coerce')
-        df['COORDENADA_Y'] = pd.to_numeric(df['COORDENADA_Y'], errors='coerce')
-        # --- END FIX ---
-
-        # --- NEW FIX: Correct swapped COORDENADA_X and COORDENADA_Y ---
-        # Identificar filas donde COORDENADA_X parece ser una longitud (>90 o <-90)
-        # y COORDENADA_Y parece ser una latitud (entre -90 y 90).
-        # Esto indica que las coordenadas podrían estar intercambiadas.
-        swapped_mask = (df['COORDENADA_X'] < 0) & (df['COORDENADA_Y'] > 0)
-
-        # Aplicar el intercambio para las filas identificadas
-        # Se usa una variable temporal para el intercambio seguro de columnas
-        temp_x = df.loc[swapped_mask, 'COORDENADA_X'].copy()
-        df.loc[swapped_mask, 'COORDENADA_X'] = df.loc[swapped_mask, 'COORDENADA_Y']
-        df.loc[swapped_mask, 'COORDENADA_Y'] = temp_x
-
-        if swapped_mask.any():
-            st.info(f"Se han corregido {swapped_mask.sum()} pares de coordenadas (COORDENADA_X y COORDENADA_Y) que parecían estar intercambiadas.")
-        # --- END NEW FIX ---
-
-        # Eliminar filas donde 'Distancia_Santiago_km', 'Tiempo_Santiago_min',
-        # 'COORDENADA_X' o 'COORDENADA_Y' son NaN
-        df.dropna(subset=['Distancia_Santiago_km', 'Tiempo_Santiago_min', 'COORDENADA_X', 'COORDENADA_Y'], inplace=True)
-
-        rows_after_cleaning = len(df)
-        if original_rows > rows_after_cleaning:
-            st.warning(f"Se han omitido {original_rows - rows_after_cleaning} filas debido a valores erróneos (como 'ERROR' o coordenadas inválidas) en las columnas de distancia, tiempo o coordenadas.")
+        mostrar_informe(informe)
 
     except Exception as e:
         st.error(f"Error al leer el archivo CSV: {e}. Asegúrate de que el formato sea correcto (ej. separador ',').")
         st.stop()
+elif ruta_snapshot and os.path.exists(ruta_snapshot):
+    # El snapshot se mapea en memoria y se carga una sola vez por proceso
+    with traza.etapa('carga'):
+        df = cargar_snapshot(ruta_snapshot)
 else:
     # Datos de ejemplo si no se carga ningún archivo
     st.info("No se ha cargado ningún archivo CSV. Se muestran datos de ejemplo.")
-    data = {
-        'Código': [1, 2, 3, 4, 5, 6, 7, 8, 9, 10],
-        'Nome': ['Centro A', 'Centro B', 'Centro C', 'Centro D', 'Centro E', 'Centro F', 'Centro G', 'Centro H', 'Centro I', 'Centro J'],
-        'Enderezo': ['Calle Falsa 1', 'Avenida Real 2', 'Plaza Mayor 3', 'Rua do Sol 4', 'Calle Luna 5', 'Rua Estrela 6', 'Via Láctea 7', 'Paseo Marítimo 8', 'Ronda Exterior 9', 'Camiño Novo 10'],
-        'Concello': ['Santiago', 'Santiago', 'A Coruña', 'Vigo', 'Santiago', 'Pontevedra', 'Lugo', 'Ourense', 'Ferrol', 'Vigo'],
-        'Provincia': ['A Coruña', 'A Coruña', 'A Coruña', 'Pontevedra', 'A Coruña', 'Pontevedra', 'Lugo', 'Ourense', 'A Coruña', 'Pontevedra'],
-        'Cód. postal': ['15701', '15702', '15001', '36201', '15703', '36001', '27001', '32001', '15401', '36202'],
-        'Teléfono': ['981111111', '981222222', '981333333', '986444444', '981555555', '986666666', '982777777', '988888888', '981999999', '986000000'],
-        'Tipo de centro': ['Colegio', 'Instituto', 'Colegio', 'Guardería', 'Colegio', 'Instituto', 'Colegio', 'Instituto', 'Guardería', 'Colegio'],
-        'COORDENADA_X': [42.8782, 42.8790, 43.3623, -8.7226, 42.8750, 42.4336, 43.0128, 42.3364, 43.4839, 42.2400], # Latitud (D4 y E4 intercambiadas para prueba)
-        'COORDENADA_Y': [-8.5448, -8.5500, -8.4115, 42.2328, -8.5400, -8.6477, -7.5566, -7.8640, -8.2320, -8.7200], # Longitud
-        'TITULARIDADE': ['Pública', 'Privada', 'Pública', 'Privada', 'Pública', 'Privada', 'Pública', 'Privada', 'Pública', 'Privada'],
-        'ENSINO_CONCERTADO': ['No', 'Sí', 'No', 'No', 'Sí', 'Sí', 'No', 'Sí', 'No', 'Sí'],
-        'DEPENDENTE': ['Sí', 'No', 'Sí', 'No', 'Sí', 'No', 'Sí', 'No', 'Sí', 'No'],
-        'Distancia_Santiago_km': [0.5, 1.2, 60.0, 'ERROR', 0.8, 70.0, 100.0, 120.0, 75.0, 88.0], # Incluido 'ERROR' para prueba
-        'Tiempo_Santiago_min': [2, 5, 45, 70, 3, 'ERROR', 80, 95, 60, 68] # Incluido 'ERROR' para prueba
-    }
-    df = pd.DataFrame(data)
-
-    original_rows = len(df)
-    df['Distancia_Santiago_km'] = pd.to_numeric(df['Distancia_Santiago_km'], errors='coerce')
-    df['Tiempo_Santiago_min'] = pd.to_numeric(df['Tiempo_Santiago_min'], errors='coerce')
-    
-    # --- FIX: Convert COORDENADA_X and COORDENADA_Y to numeric for example data ---
-    df['COORDENADA_X'] = pd.to_numeric(df['COORDENADA_X'], errors='coerce')
-    df['COORDENADA_Y'] = pd.to_numeric(df['COORDENADA_Y'], errors='coerce')
-    # --- END FIX ---
-
-    # --- NEW FIX: Correct swapped COORDENADA_X and COORDENADA_Y for example data ---
-    swapped_mask = (df['COORDENADA_X'].abs() > 90) & (df['COORDENADA_Y'].abs() <= 90)
-    temp_x = df.loc[swapped_mask, 'COORDENADA_X'].copy()
-    df.loc[swapped_mask, 'COORDENADA_X'] = df.loc[swapped_mask, 'COORDENADA_Y']
-    df.loc[swapped_mask, 'COORDENADA_Y'] = temp_x
-    if swapped_mask.any():
-        st.info(f"Se han corregido {swapped_mask.sum()} pares de coordenadas (COORDENADA_X y COORDENADA_Y) en los datos de ejemplo que parecían estar intercambiadas.")
-    # --- END NEW FIX ---
-
-    df.dropna(subset=['Distancia_Santiago_km', 'Tiempo_Santiago_min', 'COORDENADA_X', 'COORDENADA_Y'], inplace=True)
-    rows_after_cleaning = len(df)
-    if original_rows > rows_after_cleaning:
-        st.warning(f"Se han omitido {original_rows - rows_after_cleaning} filas de los datos de ejemplo debido a valores erróneos (como 'ERROR' o coordenadas inválidas) en las columnas de distancia, tiempo o coordenadas.")
+    with traza.etapa('carga'):
+        df, informe = cargar_ejemplo()
+
+    mostrar_informe(informe, " en los datos de ejemplo")
 
 # Verificar si df está vacío después de la carga/limpieza
 if df.empty:
     st.error("No se han podido cargar datos válidos de centros. Por favor, sube un archivo CSV con el formato correcto y asegúrate de que las columnas de coordenadas son numéricas.")
     st.stop() # Detiene la ejecución de la aplicación si no hay datos válidos
 
-# Renombrar columnas para que Folium las entienda (espera 'latitude' y 'longitude')
-df = df.rename(columns={'COORDENADA_X': 'latitude', 'COORDENADA_Y': 'longitude'})
+traza.anotar('datos_visibles_segundos', traza.transcurrido())
+
+with traza.etapa('importaciones'):
+    from mapa import MODOS, mostrar_mapa
+    from filtros import describir_filtro, filtro_desde_respuesta, indice_filtros, posiciones_filtro
 
 # --- Sidebar para el chat ---
 st.sidebar.header("Chatbot de Filtros")
 
+# Modo de representación de los centros en el mapa
+modo_mapa = st.sidebar.selectbox("Representación en el mapa", MODOS)
 
-# Inicializar el historial de chat y el dataframe filtrado en session_state
+
+# Inicializar el historial de chat y el filtro activo en session_state.
+# La sesión solo guarda el árbol del filtro (ver filtros.py), no una copia de los datos.
 if "messages" not in st.session_state:
     st.session_state.messages = []
-if "df_filtrado" not in st.session_state:
-    st.session_state.df_filtrado = df.copy()
+if "filtro" not in st.session_state:
+    st.session_state.filtro = {}
 
 
 # Muestra mensajes del historial
@@ -155,41 +122,75 @@ for message in st.session_state.messages:
         st.markdown(message["content"])
 
 # --- Lógica de filtrado con Gemini ---
-def get_filters_from_gemini(query):
+def prompt_filtros(query):
     """
-    Utiliza Gemini para extraer los valores de filtro de la consulta del usuario.
+    Construye el prompt para que Gemini extraiga los valores de filtro de la consulta.
     """
-    # El prompt para la API de Gemini
-    prompt_with_schema = f"""
-    Eres un asistente experto en analizar peticiones sobre filtros de datos. Tu tarea es extraer de la siguiente consulta el valor numérico y la unidad de medida (kilómetros o minutos) para filtrar un conjunto de datos.
-    Tu respuesta DEBE ser ÚNICAMENTE un objeto JSON que contenga las claves "valor" (un número entero) y "unidad" (un string que puede ser "km" o "minutos").
-    Si la consulta no contiene información de distancia o tiempo, devuelve un JSON vacío: {{}}.
+    return f"""
+    Eres un asistente experto en analizar peticiones sobre filtros de datos de centros educativos. Tu tarea es traducir la siguiente consulta a un filtro.
+    Tu respuesta DEBE ser ÚNICAMENTE un objeto JSON con la clave "filtro", cuyo valor es un árbol formado por estos nodos:
+    - Rango: {{"campo": "distancia" o "tiempo", "min": número, "max": número}} (distancia en km y tiempo en minutos a Santiago; "min" y "max" son opcionales, pero al menos uno es obligatorio).
+    - Lista de valores: {{"campo": "concello", "provincia", "tipo de centro", "titularidade", "concertado" o "dependente", "en": [valores]}}.
+    - Combinaciones: {{"y": [nodos]}}, {{"o": [nodos]}}, {{"no": nodo}}.
+    Si la consulta no contiene ningún criterio de filtro, devuelve un JSON vacío: {{}}.
     NO DEBES incluir ningún otro texto, ni explicaciones, ni etiquetas de código, solo el objeto JSON.
 
-    Ejemplo de salida para: "Quiero ver los centros a 50 km de Santiago." -> {{"valor": 50, "unidad": "km"}}
-    Ejemplo de salida para: "Quiero ver los centros a 100 kilometros." -> {{"valor": 100, "unidad": "km"}}
-    Ejemplo de salida para: "Muestra los centros a 40 minutos." -> {{"valor": 40, "unidad": "minutos"}}
-    Ejemplo de salida para: "Centros a 20 minutos de Santiago." -> {{"valor": 20, "unidad": "minutos"}}
-    Ejemplo de salida para: "Dime centros a 20 kilometros de Santiago." -> {{"valor": 20, "unidad": "km"}}
+    Ejemplo de salida para: "Quiero ver los centros a 50 km de Santiago." -> {{"filtro": {{"campo": "distancia", "max": 50}}}}
+    Ejemplo de salida para: "Muestra los centros a 40 minutos." -> {{"filtro": {{"campo": "tiempo", "max": 40}}}}
+    Ejemplo de salida para: "Centros públicos de Lugo u Ourense a menos de 60 minutos." -> {{"filtro": {{"y": [{{"campo": "titularidade", "en": ["Pública"]}}, {{"campo": "provincia", "en": ["Lugo", "Ourense"]}}, {{"campo": "tiempo", "max": 60}}]}}}}
+    Ejemplo de salida para: "IES entre 20 y 50 km que no estén en Vigo." -> {{"filtro": {{"y": [{{"campo": "tipo de centro", "en": ["IES"]}}, {{"campo": "distancia", "min": 20, "max": 50}}, {{"no": {{"campo": "concello", "en": ["Vigo"]}}}}]}}}}
     Ejemplo de salida para: "Simplemente quiero ver los centros." -> {{}}
     Ejemplo de salida para: "Filtra por 100." -> {{}}
 
     Consulta: "{query}"
     """
-    
-    try:
-        response = model.generate_content(prompt_with_schema)
-        # Asegurarse de que la respuesta no está vacía y es un JSON válido
-        if response and response.text:
-            filters = json.loads(response.text.strip())
-            return filters
-    except Exception as e:
-        print(f"Error al llamar a la API de Gemini o parsear JSON: {e}")
-        return {}
-    return {}
 
-# Inicializar un DataFrame filtrado por defecto
-df_filtrado = df.copy()
+def get_filters_from_gemini(query):
+    """
+    Utiliza Gemini para extraer los valores de filtro de la consulta del usuario.
+    Si LLM_URL está definida, la consulta se envía a ese servidor (por ejemplo,
+    modelo_falso.py) en lugar de a Gemini. Lanza una excepción si la llamada o
+    el parseo del JSON fallan.
+
+    Es una función normal y no una corrutina: ClienteLLM la ejecuta en su pool
+    de hilos, y la llamada ocupa su plaza hasta que termina aunque se agote el
+    tiempo máximo.
+    """
+    prompt_with_schema = prompt_filtros(query)
+    if LLM_URL:
+        texto = consultar_http(LLM_URL, prompt_with_schema, LLM_TIMEOUT)
+    else:
+        response = modelo_gemini(API_KEY).generate_content(prompt_with_schema)
+        texto = response.text if response else ""
+    # Asegurarse de que la respuesta no está vacía y es un JSON válido
+    return json.loads(texto.strip()) if texto else {}
+
+@st.cache_resource
+def cliente_llm():
+    """
+    Cliente de Gemini compartido por todas las sesiones: limita las llamadas
+    simultáneas, aplica el tiempo máximo y reintenta los fallos.
+    """
+    return ClienteLLM(get_filters_from_gemini, timeout=LLM_TIMEOUT, concurrencia=LLM_CONCURRENCIA, reintentos=LLM_REINTENTOS,
+                      registro=registro_metricas())
+
+def aplicar_filtros(filters):
+    """
+    Muestra la respuesta del asistente y guarda el filtro en la sesión.
+    """
+    with st.sidebar.chat_message("assistant"):
+        try:
+            filtro = filtro_desde_respuesta(filters)
+        except ValueError as e:
+            print(f"Filtro no válido en la respuesta de Gemini: {e}")
+            st.markdown("No he podido entender tu petición. Por favor, especifica la distancia en 'km', el tiempo en 'minutos', o el concello, provincia, tipo o titularidad de los centros.")
+            return
+
+        if filtro:
+            st.markdown(f"**Aplicando filtro:** Mostrando centros {describir_filtro(filtro)}.")
+            st.session_state.filtro = filtro
+        else:
+            st.markdown("No he encontrado filtros válidos en tu mensaje. Por favor, intenta una pregunta como 'Quiero los centros a 50 km'.")
 
 # Aceptar la entrada del usuario en el chat
 if prompt := st.sidebar.chat_input("Escribe tu filtro (ej. 'a 50 km')"):
@@ -200,63 +201,81 @@ if prompt := st.sidebar.chat_input("Escribe tu filtro (ej. 'a 50 km')"):
     with st.sidebar.chat_message("user"):
         st.markdown(prompt)
 
-   
-    filters = get_filters_from_gemini(prompt)
-
-    with st.sidebar.chat_message("assistant"):
-        if filters and "valor" in filters and "unidad" in filters:
-            valor = filters['valor']
-            unidad = filters['unidad']
-
-            if unidad == "km":
-                st.markdown(f"**Aplicando filtro:** Mostrando centros a un máximo de **{valor} km** de Santiago.")
-                st.session_state.df_filtrado = df[df['Distancia_Santiago_km'] <= valor]
-            elif unidad == "minutos":
-                st.markdown(f"**Aplicando filtro:** Mostrando centros a un máximo de **{valor} minutos** de Santiago.")
-                st.session_state.df_filtrado = df[df['Tiempo_Santiago_min'] <= valor]
-            else:
-                st.markdown("No he podido entender tu petición. Por favor, especifica la distancia en 'km' o el tiempo en 'minutos'.")
-        else:
-            st.markdown("No he encontrado filtros válidos en tu mensaje. Por favor, intenta una pregunta como 'Quiero los centros a 50 km'.")
-else:
-    # Si no hay prompt activo, usar el dataframe del estado de sesión
-    pass
+    # La respuesta de una consulta anterior que aún no ha llegado ya no sirve:
+    # si se aplicara después, sustituiría al filtro de esta consulta
+    if "consulta_pendiente" in st.session_state:
+        st.session_state.pop("consulta_pendiente").cancel()
+        st.session_state.pop("consulta_inicio", None)
+
+    # Las consultas sencillas ("a 50 km", "a 40 minutos") se resuelven con el
+    # parser local y las repetidas con la caché compartida, sin llamar a Gemini
+    with traza.etapa('chat_local'):
+        filters = filtros_locales(prompt, cache_consultas())
+    if filters is not None:
+        aplicar_filtros(filters)
+    else:
+        # Gemini responde en segundo plano; mientras tanto se muestran todos
+        # los centros y la página se actualiza cuando llega el filtro
+        st.session_state.filtro = {}
+        st.session_state.consulta_pendiente = cliente_llm().enviar(prompt, cache_consultas(), validar=filtro_desde_respuesta)
+        st.session_state.consulta_inicio = time.perf_counter()
+        with st.sidebar.chat_message("assistant"):
+            st.markdown("Consultando a Gemini... Mientras tanto se muestran todos los centros.")
+elif "consulta_pendiente" in st.session_state and st.session_state.consulta_pendiente.done():
+    # Ha llegado la respuesta de Gemini a la última consulta
+    futuro = st.session_state.pop("consulta_pendiente")
+    # Tiempo desde que se envió la consulta hasta que se aplica la respuesta
+    traza.anotar('llm_segundos', time.perf_counter() - st.session_state.pop("consulta_inicio", time.perf_counter()))
+    try:
+        filters = futuro.result()
+    except Exception as e:
+        print(f"Error al llamar a la API de Gemini o parsear JSON: {e}")
+        filters = {}
+    aplicar_filtros(filters)
+
+if "consulta_pendiente" in st.session_state:
+    # Comprueba periódicamente si ha llegado la respuesta, sin bloquear la página
+    @st.fragment(run_every=0.5)
+    def esperar_respuesta():
+        if st.session_state.consulta_pendiente.done():
+            st.rerun()
+    esperar_respuesta()
+
+# Aplicar el filtro activo: el árbol se compila una vez en una máscara
+# vectorizada, y los límites simples de distancia o tiempo usan el índice
+with traza.etapa('filtros'):
+    indice = indice_filtros(clave_datos(df), df)
+    posiciones = posiciones_filtro(df, st.session_state.filtro, indice)
+df_filtrado = df.iloc[posiciones] if len(posiciones) < len(df) else df
+
+traza.anotar('filas', len(df))
+traza.anotar('filas_filtradas', len(df_filtrado))
 
 # Muestra el número de centros encontrados
-st.subheader(f"Centros encontrados: {len(st.session_state.df_filtrado)}")
+st.subheader(f"Centros encontrados: {len(df_filtrado)}")
 
 # --- Mostrar el mapa con Folium y Tooltips ---
-if not st.session_state.df_filtrado.empty:
-    map_center_lat = st.session_state.df_filtrado['latitude'].mean()
-    map_center_lon = st.session_state.df_filtrado['longitude'].mean()
-    m = folium.Map(location=[map_center_lat, map_center_lon], zoom_start=8)
-    for idx, row in st.session_state.df_filtrado.iterrows():
-        tooltip_html = f"""
-        <b>{row['Nome']}</b><br>
-        Distancia: {row['Distancia_Santiago_km']:.1f} km<br>
-        Tiempo: {row['Tiempo_Santiago_min']:.0f} min
-        """
-        folium.Marker(
-            location=[row['latitude'], row['longitude']],
-            tooltip=tooltip_html,
-        ).add_to(m)
-    st_folium(m, width=700, height=500)
-else:
+if df_filtrado.empty:
     st.warning("No hay centros que cumplan los criterios de filtro para mostrar en el mapa.")
-    m = folium.Map(location=[42.8782, -8.5448], zoom_start=8)
-    st_folium(m, width=700, height=500)
+mostrar_mapa(df, posiciones, modo_mapa, clave_datos(df), width=700, height=500, traza=traza)
 
 # --- Mostrar la tabla con los centros filtrados ---
 st.subheader("Detalles de los Centros Filtrados")
-if not st.session_state.df_filtrado.empty:
-    columnas_tabla = [
-        'Código', 'Nome', 'Enderezo', 'Concello', 'Provincia',
-        'Distancia_Santiago_km', 'Tiempo_Santiago_min', 'Tipo de centro',
-        'TITULARIDADE', 'ENSINO_CONCERTADO', 'DEPENDENTE'
-    ]
-    st.dataframe(st.session_state.df_filtrado[columnas_tabla], use_container_width=True)
+if not df_filtrado.empty:
+    with traza.etapa('tabla'):
+        st.dataframe(df_filtrado[COLUMNAS_TABLA], use_container_width=True)
 else:
     st.info("La tabla se actualizará cuando haya centros que cumplan los filtros.")
 
 st.markdown("---")
 st.markdown("Desarrollado con Streamlit y la API de Gemini.")
+
+# Cerrar la traza de esta ejecución: exportar las métricas (con la tasa de
+# aciertos de la caché de consultas) y, si está activado, mostrar el panel
+cache = cache_consultas()
+registro_metricas().fijar('centros_cache_consultas_aciertos', cache.aciertos)
+registro_metricas().fijar('centros_cache_consultas_fallos', cache.fallos)
+registro_metricas().fijar('centros_cache_consultas_tasa_aciertos', cache.tasa_aciertos())
+traza.anotar('cache_tasa_aciertos', round(cache.tasa_aciertos(), 3))
+traza.terminar()
+mostrar_panel(traza)
@@ -1,8 +1,15 @@
 import streamlit as st
-import pandas as pd
-import io
-import folium # Importamos folium para crear mapas más personalizados
-from streamlit_folium import st_folium # Importamos para mostrar mapas de folium en Streamlit
+import os
+from metricas import Traza, mostrar_panel, registro_metricas # Tiempos de cada etapa y exportación de métricas
+
+# Antes de la cabecera solo se importa lo imprescindible. Los demás módulos se
+# importan en la etapa 'importaciones', justo antes de usarse: pandas y
+# pyarrow (datos) para cargar los datos, folium (mapa) después de mostrarlos y
+# altair y streamlit_folium (agregados) para el resumen del final. En un
+# arranque en frío la cabecera y los datos de ejemplo aparecen sin esperar a
+# folium ni a altair; en las siguientes ejecuciones los módulos ya están en
+# sys.modules y los imports no cuestan nada. `python benchmark.py --arranque`
+# mide el arranque.
 
 # Título de la aplicación
 st.set_page_config(
@@ -12,6 +19,9 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+# Tiempos de las etapas de esta ejecución (ver metricas.py)
+traza = Traza("app", registro_metricas())
+
 st.title("🗺️ Centros Educativos en Galicia")
 st.markdown(
     """
@@ -21,118 +31,80 @@ st.markdown(
     """
 )
 
+with traza.etapa('importaciones'):
+    from datos import COLUMNAS_TABLA, cargar_archivo, cargar_ejemplo, cargar_snapshot, clave_datos # Carga y limpieza cacheada de los datos de centros
+    from calidad import mostrar_informe # Avisos e informe por fila de las reglas de calidad de los datos
+
 # --- Carga de datos ---
-uploaded_file = st.file_uploader("Sube tu archivo CSV de centros", type="csv")
+# Además de CSV se aceptan snapshots columnares generados con `python datos.py`
+uploaded_file = st.file_uploader("Sube tu archivo CSV de centros", type=["csv", "arrow", "feather", "parquet"])
 
-df = pd.DataFrame() # Inicializamos df como un DataFrame vacío
+# Snapshot por defecto en el servidor (si está configurado)
+ruta_snapshot = os.environ.get("CENTROS_SNAPSHOT")
 
 if uploaded_file is not None:
     try:
-        df = pd.read_csv(uploaded_file, sep=',') # Asume que el separador es ','
+        # La lectura y limpieza se cachean por el hash del contenido del archivo,
+        # por lo que solo se repiten cuando se sube un archivo distinto.
+        # Los CSV muy grandes se leen por bloques, mostrando el progreso
+        with traza.etapa('importaciones'):
+            from mapa import VistaPreviaCarga # Vista previa del mapa durante la carga
+        vista_previa = VistaPreviaCarga(st.empty())
+        with traza.etapa('carga'):
+            df, informe = cargar_archivo(uploaded_file, vista_previa)
+        vista_previa.terminar()
         st.success("Archivo CSV cargado exitosamente.")
 
-        original_rows = len(df)
-
-        # Convertir 'Distancia_Santiago_km' y 'Tiempo_Santiago_min' a numérico,
-        # forzando los valores no numéricos (como 'ERROR') a NaN.
-        df['Distancia_Santiago_km'] = pd.to_numeric(df['Distancia_Santiago_km'], errors='coerce')
-        df['Tiempo_Santiago_min'] = pd.to_numeric(df['Tiempo_Santiago_min'], errors='coerce')
-
-        # --- FIX: Convert COORDENADA_X and COORDENADA_Y to numeric ---
-        # Convertir 'COORDENADA_X' y 'COORDENADA_Y' a numérico,
-        # forzando los valores no numéricos a NaN.
-        df['COORDENADA_X'] = pd.to_numeric(df['COORDENADA_X'], errors='coerce')
-        df['COORDENADA_Y'] = pd.to_numeric(df['COORDENADA_Y'], errors='coerce')
-        # --- END FIX ---
-
-        # --- NEW FIX: Correct swapped COORDENADA_X and COORDENADA_Y ---
-        # Identificar filas donde COORDENADA_X parece ser una longitud (>90 o <-90)
-        # y COORDENADA_Y parece ser una latitud (entre -90 y 90).
-        # Esto indica que las coordenadas podrían estar intercambiadas.
-        swapped_mask = (df['COORDENADA_X'] < 0) & (df['COORDENADA_Y'] > 0)
-
-        # Aplicar el intercambio para las filas identificadas
-        # Se usa una variable temporal para el intercambio seguro de columnas
-        temp_x = df.loc[swapped_mask, 'COORDENADA_X'].copy()
-        df.loc[swapped_mask, 'COORDENADA_X'] = df.loc[swapped_mask, 'COORDENADA_Y']
-        df.loc[swapped_mask, 'COORDENADA_Y'] = temp_x
-
-        if swapped_mask.any():
-            st.info(f"Se han corregido {swapped_mask.sum()} pares de coordenadas (COORDENADA_X y COORDENADA_Y) que parecían estar intercambiadas.")
-        # --- END NEW FIX ---
-
-        # Eliminar filas donde 'Distancia_Santiago_km', 'Tiempo_Santiago_min',
-        # 'COORDENADA_X' o 'COORDENADA_Y' son NaN
-        df.dropna(subset=['Distancia_Santiago_km', 'Tiempo_Santiago_min', 'COORDENADA_X', 'COORDENADA_Y'], inplace=True)
-
-        rows_after_cleaning = len(df)
-        if original_rows > rows_after_cleaning:
-            st.warning(f"Se han omitido {original_rows - rows_after_cleaning} filas debido a valores erróneos (como 'ERROR' o coordenadas inválidas) en las columnas de distancia, tiempo o coordenadas.")
+        mostrar_informe(informe)
 
     except Exception as e:
         st.error(f"Error al leer el archivo CSV: {e}. Asegúrate de que el formato sea correcto (ej. separador ',').")
         st.stop()
+elif ruta_snapshot and os.path.exists(ruta_snapshot):
+    # El snapshot se mapea en memoria y se carga una sola vez por proceso
+    with traza.etapa('carga'):
+        df = cargar_snapshot(ruta_snapshot)
 else:
     # Datos de ejemplo si no se carga ningún archivo
     st.info("No se ha cargado ningún archivo CSV. Se muestran datos de ejemplo.")
-    data = {
-        'Código': [1, 2, 3, 4, 5, 6, 7, 8, 9, 10],
-        'Nome': ['Centro A', 'Centro B', 'Centro C', 'Centro D', 'Centro E', 'Centro F', 'Centro G', 'Centro H', 'Centro I', 'Centro J'],
-        'Enderezo': ['Calle Falsa 1', 'Avenida Real 2', 'Plaza Mayor 3', 'Rua do Sol 4', 'Calle Luna 5', 'Rua Estrela 6', 'Via Láctea 7', 'Paseo Marítimo 8', 'Ronda Exterior 9', 'Camiño Novo 10'],
-        'Concello': ['Santiago', 'Santiago', 'A Coruña', 'Vigo', 'Santiago', 'Pontevedra', 'Lugo', 'Ourense', 'Ferrol', 'Vigo'],
-        'Provincia': ['A Coruña', 'A Coruña', 'A Coruña', 'Pontevedra', 'A Coruña', 'Pontevedra', 'Lugo', 'Ourense', 'A Coruña', 'Pontevedra'],
-        'Cód. postal': ['15701', '15702', '15001', '36201', '15703', '36001', '27001', '32001', '15401', '36202'],
-        'Teléfono': ['981111111', '981222222', '981333333', '986444444', '981555555', '986666666', '982777777', '988888888', '981999999', '986000000'],
-        'Tipo de centro': ['Colegio', 'Instituto', 'Colegio', 'Guardería', 'Colegio', 'Instituto', 'Colegio', 'Instituto', 'Guardería', 'Colegio'],
-        'COORDENADA_X': [42.8782, 42.8790, 43.3623, -8.7226, 42.8750, 42.4336, 43.0128, 42.3364, 43.4839, 42.2400], # Latitud (D4 y E4 intercambiadas para prueba)
-        'COORDENADA_Y': [-8.5448, -8.5500, -8.4115, 42.2328, -8.5400, -8.6477, -7.5566, -7.8640, -8.2320, -8.7200], # Longitud
-        'TITULARIDADE': ['Pública', 'Privada', 'Pública', 'Privada', 'Pública', 'Privada', 'Pública', 'Privada', 'Pública', 'Privada'],
-        'ENSINO_CONCERTADO': ['No', 'Sí', 'No', 'No', 'Sí', 'Sí', 'No', 'Sí', 'No', 'Sí'],
-        'DEPENDENTE': ['Sí', 'No', 'Sí', 'No', 'Sí', 'No', 'Sí', 'No', 'Sí', 'No'],
-        'Distancia_Santiago_km': [0.5, 1.2, 60.0, 'ERROR', 0.8, 70.0, 100.0, 120.0, 75.0, 88.0], # Incluido 'ERROR' para prueba
-        'Tiempo_Santiago_min': [2, 5, 45, 70, 3, 'ERROR', 80, 95, 60, 68] # Incluido 'ERROR' para prueba
-    }
-    df = pd.DataFrame(data)
-
-    original_rows = len(df)
-    df['Distancia_Santiago_km'] = pd.to_numeric(df['Distancia_Santiago_km'], errors='coerce')
-    df['Tiempo_Santiago_min'] = pd.to_numeric(df['Tiempo_Santiago_min'], errors='coerce')
-    
-    # --- FIX: Convert COORDENADA_X and COORDENADA_Y to numeric for example data ---
-    df['COORDENADA_X'] = pd.to_numeric(df['COORDENADA_X'], errors='coerce')
-    df['COORDENADA_Y'] = pd.to_numeric(df['COORDENADA_Y'], errors='coerce')
-    # --- END FIX ---
-
-    # --- NEW FIX: Correct swapped COORDENADA_X and COORDENADA_Y for example data ---
-    swapped_mask = (df['COORDENADA_X'].abs() > 90) & (df['COORDENADA_Y'].abs() <= 90)
-    temp_x = df.loc[swapped_mask, 'COORDENADA_X'].copy()
-    df.loc[swapped_mask, 'COORDENADA_X'] = df.loc[swapped_mask, 'COORDENADA_Y']
-    df.loc[swapped_mask, 'COORDENADA_Y'] = temp_x
-    if swapped_mask.any():
-        st.info(f"Se han corregido {swapped_mask.sum()} pares de coordenadas (COORDENADA_X y COORDENADA_Y) en los datos de ejemplo que parecían estar intercambiadas.")
-    # --- END NEW FIX ---
-
-    df.dropna(subset=['Distancia_Santiago_km', 'Tiempo_Santiago_min', 'COORDENADA_X', 'COORDENADA_Y'], inplace=True)
-    rows_after_cleaning = len(df)
-    if original_rows > rows_after_cleaning:
-        st.warning(f"Se han omitido {original_rows - rows_after_cleaning} filas de los datos de ejemplo debido a valores erróneos (como 'ERROR' o coordenadas inválidas) en las columnas de distancia, tiempo o coordenadas.")
+    with traza.etapa('carga'):
+        df, informe = cargar_ejemplo()
+
+    mostrar_informe(informe, " en los datos de ejemplo")
 
 # Verificar si df está vacío después de la carga/limpieza
 if df.empty:
     st.error("No se han podido cargar datos válidos de centros. Por favor, sube un archivo CSV con el formato correcto y asegúrate de que las columnas de coordenadas son numéricas.")
     st.stop() # Detiene la ejecución de la aplicación si no hay datos válidos
 
-# Renombrar columnas para que Folium las entienda (espera 'latitude' y 'longitude')
-df = df.rename(columns={'COORDENADA_X': 'latitude', 'COORDENADA_Y': 'longitude'})
+traza.anotar('datos_visibles_segundos', traza.transcurrido())
+
+with traza.etapa('importaciones'):
+    from mapa import AGRUPACIONES, MODO_VISTA, MODOS, mostrar_mapa # Construcción vectorizada de las capas del mapa
+    from filtros import indice_filtros # Índice ordenado para los filtros de distancia y tiempo
+    from espacial import centroides_concello, indice_espacial # Índice espacial para búsquedas desde cualquier punto
+    from tiempos import cargar_matriz, datos_desde_origen # Matriz precalculada de distancias y tiempos desde otros orígenes
 
 # --- Sidebar para los filtros ---
 st.sidebar.header("Filtros")
 
+# Origen de las distancias y tiempos: Santiago (columnas del CSV) o cualquiera
+# de los orígenes de una matriz precalculada con `python tiempos.py`. El
+# selector solo se muestra si la matriz contiene alguno de los centros cargados
+origen_tiempos = "Santiago"
+ruta_matriz = os.environ.get("CENTROS_MATRIZ_TIEMPOS")
+if ruta_matriz and os.path.isdir(ruta_matriz) and cargar_matriz(ruta_matriz).contiene(df['Código']):
+    origen_tiempos = st.sidebar.selectbox("Origen de distancias y tiempos", ["Santiago"] + cargar_matriz(ruta_matriz).nombres())
+    if origen_tiempos != "Santiago":
+        # Las columnas de distancia y tiempo pasan a ser las del origen elegido
+        with traza.etapa('matriz'):
+            df = datos_desde_origen(clave_datos(df), ruta_matriz, origen_tiempos, df)
+
 # Slider para la distancia
 # Asegurarse de que max_distancia sea un float y no un valor nulo
 max_distancia = float(df['Distancia_Santiago_km'].max()) if not df['Distancia_Santiago_km'].empty else 100.0
 min_distancia_slider = st.sidebar.slider(
-    "Distancia máxima a Santiago (km)",
+    f"Distancia máxima a {origen_tiempos} (km)",
     min_value=0.0,
     max_value=max_distancia,
     value=max_distancia,
@@ -143,68 +115,136 @@ min_distancia_slider = st.sidebar.slider(
 # Asegurarse de que max_tiempo sea un float y no un valor nulo
 max_tiempo = float(df['Tiempo_Santiago_min'].max()) if not df['Tiempo_Santiago_min'].empty else 100.0
 min_tiempo_slider = st.sidebar.slider(
-    "Tiempo máximo a Santiago (min)",
+    f"Tiempo máximo a {origen_tiempos} (min)",
     min_value=0.0,
     max_value=max_tiempo,
     value=max_tiempo,
     step=1.0
 )
 
+# --- Búsqueda desde un origen cualquiera ---
+st.sidebar.header("Buscar desde otro punto")
+usar_origen = st.sidebar.checkbox("Filtrar por cercanía a un punto")
+if usar_origen:
+    tipo_origen = st.sidebar.radio("Origen", ["Concello", "Coordenadas"], horizontal=True)
+    if tipo_origen == "Concello":
+        centroides = centroides_concello(clave_datos(df), df)
+        concello_origen = st.sidebar.selectbox("Concello de origen", centroides.index.tolist())
+        origen_lat, origen_lon = centroides.loc[concello_origen, ['latitude', 'longitude']]
+        etiqueta_origen = concello_origen
+    else:
+        origen_lat = st.sidebar.number_input("Latitud", value=42.8782, format="%.4f")
+        origen_lon = st.sidebar.number_input("Longitud", value=-8.5448, format="%.4f")
+        etiqueta_origen = f"{origen_lat:.4f}, {origen_lon:.4f}"
+
+    tipo_busqueda = st.sidebar.radio("Búsqueda", ["Radio (km)", "Más cercanos"], horizontal=True)
+    if tipo_busqueda == "Radio (km)":
+        radio_km = st.sidebar.slider("Radio desde el origen (km, en línea recta)", min_value=1.0, max_value=200.0, value=25.0, step=1.0)
+    else:
+        k_cercanos = st.sidebar.number_input("Número de centros más cercanos", min_value=1, max_value=len(df), value=min(10, len(df)))
+
+# Modo de representación de los centros en el mapa
+modo_mapa = st.sidebar.selectbox(
+    "Representación en el mapa",
+    MODOS,
+    help="Con muchos centros, el cluster o los círculos mantienen el mapa fluido. "
+         "En la zona visible solo se envían los centros que se ven, agregados con poco zoom."
+)
+agrupacion_mapa = AGRUPACIONES[0]
+if modo_mapa == MODO_VISTA:
+    agrupacion_mapa = st.sidebar.radio("Agrupar con poco zoom por", AGRUPACIONES, horizontal=True)
+
 # --- Aplicar filtros ---
-df_filtrado = df[
-    (df['Distancia_Santiago_km'] <= min_distancia_slider) &
-    (df['Tiempo_Santiago_min'] <= min_tiempo_slider)
-]
+# El índice se construye una vez por conjunto de datos; cada cambio de los
+# sliders solo hace dos búsquedas binarias y devuelve posiciones de fila
+with traza.etapa('filtros'):
+    indice = indice_filtros(clave_datos(df), df)
+    posiciones = indice.filtrar(max_distancia=min_distancia_slider, max_tiempo=min_tiempo_slider)
+
+if usar_origen:
+    # El índice espacial solo calcula distancias para las celdas cercanas al origen
+    with traza.etapa('origen'):
+        indice_esp = indice_espacial(clave_datos(df), df)
+        filtrados = indice.mascara(posiciones)
+        if tipo_busqueda == "Radio (km)":
+            posiciones_origen, distancias_origen = indice_esp.en_radio(origen_lat, origen_lon, radio_km)
+        else:
+            # Los k más cercanos de entre los que cumplen los filtros
+            posiciones_origen, distancias_origen = indice_esp.mas_cercanos(origen_lat, origen_lon, k_cercanos, mascara=filtrados)
+
+    # Combinar con los filtros de distancia y tiempo, ordenando por cercanía al origen
+    en_filtros = filtrados[posiciones_origen]
+    posiciones = posiciones_origen[en_filtros]
+    df_filtrado = df.iloc[posiciones].assign(Distancia_origen_km=distancias_origen[en_filtros].round(1))
+else:
+    df_filtrado = df.iloc[posiciones] if len(posiciones) < len(df) else df
 
+traza.anotar('filas', len(df))
+traza.anotar('filas_filtradas', len(df_filtrado))
 st.subheader(f"Centros encontrados: {len(df_filtrado)}")
 
 # --- Mostrar el mapa con Folium y Tooltips ---
-if not df_filtrado.empty:
-    # Centrar el mapa en la media de las coordenadas de los centros filtrados
-    # Si no hay centros filtrados, se centrará en Santiago por defecto
-    map_center_lat = df_filtrado['latitude'].mean()
-    map_center_lon = df_filtrado['longitude'].mean()
-    
-    # Inicializar el mapa de Folium
-    m = folium.Map(location=[map_center_lat, map_center_lon], zoom_start=8)
-
-    # Añadir marcadores para cada centro filtrado con tooltip
-    for idx, row in df_filtrado.iterrows():
-        # Contenido HTML para el tooltip
-        tooltip_html = f"""
-        <b>{row['Nome']}</b><br>
-        Distancia: {row['Distancia_Santiago_km']:.1f} km<br>
-        Tiempo: {row['Tiempo_Santiago_min']:.0f} min
-        """
-        
-        folium.Marker(
-            location=[row['latitude'], row['longitude']],
-            tooltip=tooltip_html, # Esto es para el hover
-            # Opcional: Puedes añadir un popup para el click si lo deseas
-            # popup=folium.Popup(tooltip_html, max_width=300)
-        ).add_to(m)
-    
-    # Mostrar el mapa de Folium en Streamlit
-    st_folium(m, width=700, height=500) # Ajusta el ancho y alto según necesites
-else:
+# Los centros se añaden al mapa en una sola capa construida a partir de las
+# columnas (ver mapa.py), según el modo elegido en la barra lateral
+if df_filtrado.empty:
     st.warning("No hay centros que cumplan los criterios de filtro seleccionados para mostrar en el mapa.")
-    # Si no hay centros filtrados, muestra un mapa centrado en Santiago
-    m = folium.Map(location=[42.8782, -8.5448], zoom_start=8) # Centro de Santiago
-    st_folium(m, width=700, height=500)
+origen = (origen_lat, origen_lon, f"Origen: {etiqueta_origen}") if usar_origen else None
+# El mapa solo se reconstruye si cambian los centros filtrados, el modo o la zona visible
+mostrar_mapa(df, posiciones, modo_mapa, clave_datos(df), agrupacion_mapa, origen, width=700, height=500, traza=traza) # Ajusta el ancho y alto según necesites
 
 
 # --- Mostrar la tabla con los centros filtrados ---
 st.subheader("Detalles de los Centros Filtrados")
 if not df_filtrado.empty:
     # Mostrar solo las columnas relevantes para la tabla
-    columnas_tabla = [
-        'Código', 'Nome', 'Enderezo', 'Concello', 'Provincia',
-        'Distancia_Santiago_km', 'Tiempo_Santiago_min', 'Tipo de centro',
-        'TITULARIDADE', 'ENSINO_CONCERTADO', 'DEPENDENTE'
-    ]
-    st.dataframe(df_filtrado[columnas_tabla], use_container_width=True)
+    columnas_tabla = list(COLUMNAS_TABLA)
+    if usar_origen:
+        columnas_tabla.insert(5, 'Distancia_origen_km')
+    with traza.etapa('tabla'):
+        st.dataframe(df_filtrado[columnas_tabla], use_container_width=True)
 else:
     st.info("La tabla se actualizará cuando haya centros que cumplan los filtros.")
 
+# --- Resumen por zonas ---
+# Los recuentos salen del cubo de agregados (ver agregados.py), calculado una
+# vez por conjunto de datos: cada consulta lee unos pocos arrays pequeños en
+# lugar de agrupar todos los centros
+st.subheader("Resumen por zonas")
+with traza.etapa('importaciones'):
+    from agregados import DIMENSION_TIPO, DIMENSION_TITULARIDADE, MEDIDAS, cubo_agregados, grafico_distribucion, grafico_resumen, mapa_coropletas # Agregados precalculados por zona, tipo y titularidad
+    from streamlit_folium import st_folium # Para mostrar mapas de folium en Streamlit
+with traza.etapa('resumen'):
+    cubo = cubo_agregados(clave_datos(df), df)
+    col_medida, col_por, col_desglose = st.columns(3)
+    medida_resumen = col_medida.radio("Límite", ["Tiempo", "Distancia"], horizontal=True)
+    por_resumen = col_por.selectbox("Agrupar por", ["Provincia", "Concello"])
+    desglose_resumen = col_desglose.selectbox("Desglosar por", [DIMENSION_TITULARIDADE, DIMENSION_TIPO])
+
+    medida = 'tiempo' if medida_resumen == "Tiempo" else 'distancia'
+    unidad = 'min' if medida == 'tiempo' else 'km'
+    maximo = min_tiempo_slider if medida == 'tiempo' else min_distancia_slider
+    # El cubo agrupa en tramos de 5: el límite del slider se redondea hacia
+    # abajo, salvo por encima del último tramo, que se incluye completo
+    tramo = cubo.tramo(medida, maximo)
+    limites = MEDIDAS[medida][1]
+    if tramo < len(limites):
+        st.caption(f"Centros a un máximo de {limites[tramo]:g} {unidad} de {origen_tiempos} (límite del slider redondeado a tramos de 5 {unidad}).")
+    else:
+        st.caption(f"Centros a un máximo de {maximo:g} {unidad} de {origen_tiempos} (por encima de {limites[-1]:g} {unidad} se cuentan todos los centros).")
+
+    resumen = cubo.resumen(medida, maximo, por_resumen, desglose=desglose_resumen)
+    if resumen.empty:
+        st.info("No hay centros dentro de ese límite.")
+    else:
+        st.altair_chart(grafico_resumen(resumen, por_resumen, desglose_resumen), width='stretch')
+        st.altair_chart(grafico_distribucion(cubo.distribucion(medida), 'Provincia', unidad), width='stretch')
+        st.dataframe(resumen.round(1), width='stretch')
+        st_folium(mapa_coropletas(cubo, cubo.resumen(medida, maximo, 'Concello')), key="mapa_resumen", width=700, height=450, returned_objects=[])
+
 st.markdown("---")
 st.markdown("Desarrollado por solucións informáticas Tella e Streamlit.")
+
+# Cerrar la traza de esta ejecución: exportar las métricas y, si está
+# activado, mostrar el panel de depuración
+traza.terminar()
+mostrar_panel(traza)
@@ -0,0 +1,400 @@
+import argparse
+import cProfile
+import http.client
+import io
+import json
+import os
+import pstats
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from streamlit.dataframe_util import convert_pandas_df_to_arrow_bytes
+
+from agregados import CuboAgregados
+from api import ServicioCentros, crear_servidor
+from calidad import intercambiadas
+from datos import COLUMNAS_TABLA, leer_csv, limpiar_centros, limpiar_por_bloques
+from filtros import IndiceFiltros, compilar_filtro
+from mapa import MODO_AUTOMATICO, MODO_CIRCULOS, crear_mapa
+
+# --- Benchmark del flujo carga → filtro → mapa ---
+# Mide cada etapa por separado con conjuntos sintéticos de distintos tamaños,
+# generados a partir de centros.csv, para que las regresiones se vean como
+# números:
+#
+#   python benchmark.py                               # 250, 10k, 100k y 1M centros
+#   python benchmark.py --tamanos 250 10000 --json base.json
+#   python benchmark.py --comparar base.json          # falla si alguna etapa empeora
+#   python benchmark.py --tamanos 100000 --perfil mapa
+#   python benchmark.py --tamanos --arranque          # solo el arranque de las páginas
+#   python benchmark.py --tamanos --api               # solo las consultas de api.py
+TAMANOS = [250, 10_000, 100_000, 1_000_000]
+CSV_BASE = 'centros.csv'
+
+# Proporción de filas sintéticas con coordenadas intercambiadas y con 'ERROR'
+PROPORCION_INTERCAMBIADAS = 0.02
+PROPORCION_ERRORES = 0.01
+
+# Límites de los filtros medidos: aproximadamente la mitad de los centros
+MAX_DISTANCIA_KM = 100.0
+MAX_TIEMPO_MIN = 90.0
+FILTRO_ARBOL = {"y": [
+    {"campo": "distancia", "max": MAX_DISTANCIA_KM},
+    {"o": [{"campo": "titularidade", "igual": "Pública"}, {"campo": "tipo", "en": ["IES", "CEIP"]}]},
+]}
+
+# Por encima de este factor respecto a la referencia (--comparar) una etapa
+# se considera una regresión
+UMBRAL_REGRESION = 1.25
+
+
+def generar_csv(n, base=CSV_BASE, semilla=0):
+    """
+    Genera el CSV (bytes) de n centros sintéticos con el esquema de base:
+    filas muestreadas con reemplazo, coordenadas desplazadas unos cientos de
+    metros, códigos únicos y una parte de filas intercambiadas o con 'ERROR'.
+    """
+    rng = np.random.default_rng(semilla)
+    original = leer_csv(base)
+    df = original.iloc[rng.integers(0, len(original), n)].reset_index(drop=True)
+    df['Código'] = (np.arange(n) + 10_000_000).astype(str)
+
+    x = df['COORDENADA_X'].to_numpy() + rng.normal(0, 0.02, n)
+    y = df['COORDENADA_Y'].to_numpy() + rng.normal(0, 0.02, n)
+    intercambiadas = rng.random(n) < PROPORCION_INTERCAMBIADAS
+    df['COORDENADA_X'] = np.where(intercambiadas, y, x)
+    df['COORDENADA_Y'] = np.where(intercambiadas, x, y)
+    df.loc[rng.random(n) < PROPORCION_ERRORES, 'Distancia_Santiago_km'] = np.nan
+
+    return df.to_csv(index=False, na_rep='ERROR').encode('utf-8')
+
+
+# --- Etapas ---
+# Cada etapa recibe el diccionario de entradas preparado por preparar_entradas
+# y ejecuta una sola parte del flujo de las aplicaciones.
+def etapa_leer(entradas):
+    return leer_csv(io.BytesIO(entradas['csv']))
+
+
+def etapa_intercambio(entradas):
+    return intercambiadas(entradas['x'], entradas['y'])
+
+
+def etapa_limpiar(entradas):
+    return limpiar_centros(entradas['crudo'])
+
+
+def etapa_por_bloques(entradas):
+    # Lectura y limpieza juntas, como en la carga de CSV grandes
+    return limpiar_por_bloques(io.BytesIO(entradas['csv']))
+
+
+def etapa_indice(entradas):
+    return IndiceFiltros(entradas['df'])
+
+
+def etapa_filtrar(entradas):
+    return entradas['indice'].filtrar(max_distancia=MAX_DISTANCIA_KM, max_tiempo=MAX_TIEMPO_MIN)
+
+
+def etapa_filtro_arbol(entradas):
+    return np.flatnonzero(compilar_filtro(FILTRO_ARBOL)(entradas['df']))
+
+
+def etapa_cubo(entradas):
+    return CuboAgregados.desde_dataframe(entradas['df'])
+
+
+def etapa_resumen(entradas):
+    return entradas['cubo'].resumen('tiempo', MAX_TIEMPO_MIN, 'Provincia', desglose='TITULARIDADE')
+
+
+def etapa_mapa(entradas):
+    return crear_mapa(entradas['filtrado'], MODO_AUTOMATICO)
+
+
+def etapa_mapa_circulos(entradas):
+    return crear_mapa(entradas['filtrado'], MODO_CIRCULOS)
+
+
+def etapa_html(entradas):
+    return entradas['mapa'].get_root().render()
+
+
+def etapa_tabla(entradas):
+    # La misma serialización a Arrow que hace st.dataframe
+    return convert_pandas_df_to_arrow_bytes(entradas['filtrado'][COLUMNAS_TABLA])
+
+
+ETAPAS = {
+    'leer_csv': etapa_leer,
+    'intercambio': etapa_intercambio,
+    'limpiar': etapa_limpiar,
+    'por_bloques': etapa_por_bloques,
+    'indice': etapa_indice,
+    'filtrar': etapa_filtrar,
+    'filtro_arbol': etapa_filtro_arbol,
+    'cubo': etapa_cubo,
+    'resumen': etapa_resumen,
+    'mapa': etapa_mapa,
+    'mapa_circulos': etapa_mapa_circulos,
+    'html': etapa_html,
+    'tabla': etapa_tabla,
+}
+
+
+def preparar_entradas(csv):
+    """
+    Ejecuta el flujo una vez para obtener la entrada de cada etapa.
+    """
+    crudo = leer_csv(io.BytesIO(csv))
+    df, _ = limpiar_centros(crudo)
+    indice = IndiceFiltros(df)
+    filtrado = df.iloc[indice.filtrar(max_distancia=MAX_DISTANCIA_KM, max_tiempo=MAX_TIEMPO_MIN)]
+    return {
+        'csv': csv,
+        'crudo': crudo,
+        'x': crudo['COORDENADA_X'].to_numpy(dtype='float64'),
+        'y': crudo['COORDENADA_Y'].to_numpy(dtype='float64'),
+        'df': df,
+        'indice': indice,
+        'cubo': CuboAgregados.desde_dataframe(df),
+        'filtrado': filtrado,
+        'mapa': crear_mapa(filtrado, MODO_AUTOMATICO),
+    }
+
+
+# --- Arranque de las páginas ---
+# Cada medida se hace en un intérprete nuevo, en el que ningún módulo está
+# importado todavía, como en el primer acceso tras arrancar el servidor:
+#   <página>:primera      primera ejecución completa del script (AppTest)
+#   <página>:datos        hasta que la cabecera y los datos están en la página
+#   <página>:importaciones  imports diferidos durante la primera ejecución
+#   <página>:reejecucion  segunda ejecución, con todo ya importado y cacheado
+#   import:<módulo>       import de cada dependencia pesada con streamlit ya cargado
+PAGINAS = ['app.py', 'app-bot.py']
+MODULOS_PESADOS = ['pandas', 'pyarrow', 'folium', 'streamlit_folium', 'altair', 'google.generativeai']
+
+_EJECUTAR_PAGINA = """
+import json, sys, time
+from streamlit.testing.v1 import AppTest
+pagina = AppTest.from_file(sys.argv[1], default_timeout=120)
+tiempos = []
+for _ in range(2):
+    inicio = time.perf_counter()
+    pagina.run()
+    tiempos.append(time.perf_counter() - inicio)
+print(json.dumps(tiempos))
+"""
+
+_IMPORTAR_MODULO = """
+import importlib, sys, time
+import streamlit
+inicio = time.perf_counter()
+importlib.import_module(sys.argv[1])
+print(time.perf_counter() - inicio)
+"""
+
+
+def _en_interprete_nuevo(codigo, *argumentos, entorno=None):
+    salida = subprocess.run(
+        [sys.executable, '-c', codigo, *argumentos], capture_output=True, text=True, check=True,
+        env={**os.environ, **(entorno or {})},
+    )
+    return json.loads(salida.stdout.strip().splitlines()[-1])
+
+
+def medir_pagina(pagina):
+    """
+    Ejecuta dos veces la página en un intérprete nuevo y devuelve los tiempos
+    de arranque (ver PAGINAS) a partir de su traza de métricas.
+    """
+    with tempfile.TemporaryDirectory() as directorio:
+        ruta = os.path.join(directorio, 'metricas.jsonl')
+        primera, segunda = _en_interprete_nuevo(_EJECUTAR_PAGINA, os.path.abspath(pagina), entorno={'CENTROS_METRICAS_JSONL': ruta})
+        with open(ruta, encoding='utf-8') as f:
+            traza = json.loads(f.readline())
+    return {
+        f'{pagina}:primera': primera,
+        f'{pagina}:datos': traza.get('datos_visibles_segundos', 0.0),
+        f'{pagina}:importaciones': traza['etapas'].get('importaciones', 0.0),
+        f'{pagina}:reejecucion': segunda,
+    }
+
+
+def medir_arranque(repeticiones):
+    """
+    Mediana de los tiempos de arranque de PAGINAS y del import de
+    MODULOS_PESADOS. Los módulos que no están instalados se omiten.
+    """
+    medidas = {}
+    for _ in range(repeticiones):
+        for pagina in PAGINAS:
+            for nombre, segundos in medir_pagina(pagina).items():
+                medidas.setdefault(nombre, []).append(segundos)
+        for modulo in MODULOS_PESADOS:
+            try:
+                segundos = _en_interprete_nuevo(_IMPORTAR_MODULO, modulo)
+            except subprocess.CalledProcessError:
+                continue
+            medidas.setdefault(f'import:{modulo}', []).append(segundos)
+    return {nombre: statistics.median(valores) for nombre, valores in medidas.items()}
+
+
+# --- Consultas de api.py sobre el CSV base ---
+# Mezcla de consultas que se repite en cada medida: límites simples, árbol de
+# filtro, radio y k más cercanos alrededor de varias ciudades.
+CONSULTAS_API = [
+    consulta
+    for lat, lon in [(42.88, -8.54), (43.36, -8.41), (42.24, -8.72), (43.01, -7.56), (42.34, -7.86)]
+    for consulta in (
+        {'max_distancia': MAX_DISTANCIA_KM},
+        {'max_tiempo': MAX_TIEMPO_MIN, 'filtro': FILTRO_ARBOL, 'limite': 50},
+        {'origen': {'lat': lat, 'lon': lon, 'radio_km': 30}, 'max_tiempo': MAX_TIEMPO_MIN},
+        {'origen': {'lat': lat, 'lon': lon, 'k': 10}, 'columnas': ['Código', 'Nome', 'latitude', 'longitude']},
+    )
+]
+CONSULTAS_POR_MEDIDA = 200
+HILOS_HTTP = [1, 4, 16]
+
+
+def _peticiones_http(puerto, consultas):
+    conexion = http.client.HTTPConnection('127.0.0.1', puerto)
+    try:
+        for consulta in consultas:
+            conexion.request('POST', '/centros', body=json.dumps(consulta), headers={'Content-Type': 'application/json'})
+            respuesta = conexion.getresponse()
+            respuesta.read()
+            if respuesta.status != 200:
+                raise RuntimeError(f"HTTP {respuesta.status} para {consulta}")
+    finally:
+        conexion.close()
+
+
+def medir_api(base, repeticiones):
+    """
+    Segundos por consulta (mediana) de ServicioCentros sobre el CSV base:
+    en proceso con cada formato, en lotes de CONSULTAS_POR_MEDIDA y por HTTP
+    con distinto número de clientes concurrentes (conexiones persistentes).
+    """
+    servicio = ServicioCentros.desde_ruta(base)
+    consultas = [CONSULTAS_API[i % len(CONSULTAS_API)] for i in range(CONSULTAS_POR_MEDIDA)]
+    medidas = {}
+
+    def por_consulta(nombre, funcion):
+        medidas[f'api:{nombre}'] = medir(lambda _: funcion(), None, repeticiones) / len(consultas)
+
+    for formato in ('json', 'geojson', 'arrow'):
+        por_consulta(formato, lambda: [servicio.responder([consulta], formato) for consulta in consultas])
+    por_consulta('lote', lambda: servicio.responder(consultas))
+
+    servidor = crear_servidor(servicio, 0, '127.0.0.1')
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    try:
+        puerto = servidor.server_address[1]
+        for hilos in HILOS_HTTP:
+            repartidas = [consultas[i::hilos] for i in range(hilos)]
+            with ThreadPoolExecutor(hilos) as clientes:
+                por_consulta(f'http:{hilos}', lambda: list(clientes.map(lambda parte: _peticiones_http(puerto, parte), repartidas)))
+    finally:
+        servidor.shutdown()
+        servidor.server_close()
+    return medidas
+
+
+def medir(funcion, entradas, repeticiones):
+    """
+    Ejecuta funcion(entradas) varias veces y devuelve la mediana en segundos.
+    """
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion(entradas)
+        tiempos.append(time.perf_counter() - inicio)
+    return statistics.median(tiempos)
+
+
+def perfilar(funcion, entradas, lineas=20):
+    """
+    Ejecuta funcion(entradas) con cProfile y muestra las funciones más costosas.
+    """
+    perfil = cProfile.Profile()
+    perfil.runcall(funcion, entradas)
+    pstats.Stats(perfil, stream=sys.stdout).sort_stats('cumulative').print_stats(lineas)
+
+
+def regresiones(resultados, referencia, umbral=UMBRAL_REGRESION):
+    """
+    Lista de (tamaño, etapa, referencia, actual) de las etapas que tardan más
+    de umbral veces lo que tardaban en la referencia.
+    """
+    return [
+        (tamano, etapa, referencia[tamano][etapa], segundos)
+        for tamano, etapas in resultados.items()
+        for etapa, segundos in etapas.items()
+        if etapa in referencia.get(tamano, {}) and segundos > umbral * referencia[tamano][etapa]
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mide cada etapa del flujo de centros con datos sintéticos.")
+    parser.add_argument('--tamanos', type=int, nargs='*', default=TAMANOS, help="Número de centros de cada conjunto")
+    parser.add_argument('--etapas', nargs='+', choices=list(ETAPAS), default=list(ETAPAS))
+    parser.add_argument('--repeticiones', type=int, default=3)
+    parser.add_argument('--base', default=CSV_BASE, help="CSV del que se toma el esquema y los valores")
+    parser.add_argument('--json', help="Guarda aquí los resultados (segundos por tamaño y etapa)")
+    parser.add_argument('--comparar', help="JSON de una ejecución anterior; termina con error si hay regresiones")
+    parser.add_argument('--umbral', type=float, default=UMBRAL_REGRESION)
+    parser.add_argument('--perfil', choices=list(ETAPAS), help="Muestra el perfil de esta etapa con el último tamaño")
+    parser.add_argument('--arranque', action='store_true', help="Mide también el arranque en frío de las páginas")
+    parser.add_argument('--api', action='store_true', help="Mide también las consultas por segundo de api.py con el CSV base")
+    args = parser.parse_args()
+
+    resultados = {}
+    for n in args.tamanos:
+        entradas = preparar_entradas(generar_csv(n, args.base))
+        resultados[str(n)] = {etapa: medir(ETAPAS[etapa], entradas, args.repeticiones) for etapa in args.etapas}
+
+    if args.tamanos:
+        print(f"{'etapa':<14}" + ''.join(f"{n:>12}" for n in args.tamanos) + "   (ms, mediana)")
+        for etapa in args.etapas:
+            print(f"{etapa:<14}" + ''.join(f"{resultados[str(n)][etapa] * 1000:>12.2f}" for n in args.tamanos))
+
+    if args.arranque:
+        resultados['arranque'] = medir_arranque(args.repeticiones)
+        print(f"\n{'arranque':<28}{'ms, mediana':>12}")
+        for nombre, segundos in resultados['arranque'].items():
+            print(f"{nombre:<28}{segundos * 1000:>12.2f}")
+
+    if args.api:
+        resultados['api'] = medir_api(args.base, args.repeticiones)
+        print(f"\n{'api':<28}{'ms/consulta':>12}{'consultas/s':>14}")
+        for nombre, segundos in resultados['api'].items():
+            print(f"{nombre:<28}{segundos * 1000:>12.3f}{1 / segundos:>14.0f}")
+
+    if args.perfil and args.tamanos:
+        perfilar(ETAPAS[args.perfil], entradas)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(resultados, f, indent=2)
+
+    if args.comparar:
+        with open(args.comparar, encoding='utf-8') as f:
+            referencia = json.load(f)
+        peores = regresiones(resultados, referencia, args.umbral)
+        for tamano, etapa, antes, ahora in peores:
+            donde = {'arranque': "en el arranque", 'api': "en las consultas"}.get(tamano, f"con {tamano} centros")
+            print(f"REGRESIÓN {etapa} {donde}: {antes * 1000:.2f} ms → {ahora * 1000:.2f} ms")
+        if peores:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
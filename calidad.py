@@ -0,0 +1,376 @@
+from collections import namedtuple
+from functools import cached_property
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import streamlit as st
+
+from espacial import SANTIAGO, haversine_km
+
+# --- Reglas de calidad de los datos ---
+# Cada regla es una declaración: un nombre, una acción y una función que
+# recibe las columnas del CSV como arrays de numpy y devuelve la máscara de
+# las filas afectadas. Las reglas de tipo CORREGIR tienen además una función
+# que corrige esas filas en los arrays. validar_centros convierte las columnas
+# una sola vez y aplica todas las reglas en orden sobre los mismos arrays, de
+# modo que cada regla ve las correcciones de las anteriores (la detección de
+# coordenadas intercambiadas, por ejemplo, se hace después de reproyectar las
+# coordenadas UTM).
+#
+# El resultado de cada fila se guarda en un entero con un bit por regla, a
+# partir del que se construye el informe por fila (InformeCalidad).
+CORREGIR = 'corregir'
+ELIMINAR = 'eliminar'
+AVISAR = 'avisar'
+
+# Caja (lat_min, lat_max, lon_min, lon_max) en la que deben estar los centros,
+# con un margen de unos kilómetros sobre los límites de Galicia
+CAJA_GALICIA = (41.75, 43.85, -9.40, -6.65)
+
+# Coordenadas UTM: valores absolutos por encima de este umbral son metros, no
+# grados. Se reproyectan desde el huso 29 norte (ETRS89, que a esta escala
+# coincide con WGS84), el de casi toda Galicia.
+UMBRAL_UTM = 1000
+HUSO_UTM = 29
+
+# La distancia por carretera a Santiago no puede ser menor que la distancia en
+# línea recta ni mucho mayor que ella. Fuera de
+# [línea recta × FACTOR_DISTANCIA_MIN - MARGEN, línea recta × FACTOR_DISTANCIA_MAX + MARGEN]
+# la distancia o las coordenadas del centro son sospechosas.
+FACTOR_DISTANCIA_MIN = 0.95
+FACTOR_DISTANCIA_MAX = 3.0
+MARGEN_DISTANCIA_KM = 5.0
+
+Regla = namedtuple('Regla', ['nombre', 'accion', 'descripcion', 'comprobar', 'corregir'], defaults=[None])
+
+
+def en_caja(lat, lon, caja=CAJA_GALICIA):
+    """
+    Máscara de los puntos (arrays de grados) dentro de la caja.
+    """
+    lat_min, lat_max, lon_min, lon_max = caja
+    return (lat >= lat_min) & (lat <= lat_max) & (lon >= lon_min) & (lon <= lon_max)
+
+
+def utm_a_wgs84(este, norte, huso=HUSO_UTM):
+    """
+    Convierte coordenadas UTM del hemisferio norte (metros) a latitud y
+    longitud en grados con la transversa de Mercator inversa sobre el
+    elipsoide WGS84 (series de Snyder, error submétrico). Acepta arrays.
+    """
+    a = 6378137.0
+    f = 1 / 298.257223563
+    k0 = 0.9996
+    e2 = f * (2 - f)
+    ep2 = e2 / (1 - e2)
+    e1 = (1 - np.sqrt(1 - e2)) / (1 + np.sqrt(1 - e2))
+
+    x = np.asarray(este, dtype='float64') - 500000.0
+    mu = np.asarray(norte, dtype='float64') / k0 / (a * (1 - e2 / 4 - 3 * e2 ** 2 / 64 - 5 * e2 ** 3 / 256))
+    phi1 = (mu + (3 * e1 / 2 - 27 * e1 ** 3 / 32) * np.sin(2 * mu)
+            + (21 * e1 ** 2 / 16 - 55 * e1 ** 4 / 32) * np.sin(4 * mu)
+            + (151 * e1 ** 3 / 96) * np.sin(6 * mu)
+            + (1097 * e1 ** 4 / 512) * np.sin(8 * mu))
+
+    sen, cos, tan = np.sin(phi1), np.cos(phi1), np.tan(phi1)
+    n1 = a / np.sqrt(1 - e2 * sen ** 2)
+    r1 = a * (1 - e2) / (1 - e2 * sen ** 2) ** 1.5
+    t1 = tan ** 2
+    c1 = ep2 * cos ** 2
+    d = x / (n1 * k0)
+
+    lat = phi1 - (n1 * tan / r1) * (
+        d ** 2 / 2
+        - (5 + 3 * t1 + 10 * c1 - 4 * c1 ** 2 - 9 * ep2) * d ** 4 / 24
+        + (61 + 90 * t1 + 298 * c1 + 45 * t1 ** 2 - 252 * ep2 - 3 * c1 ** 2) * d ** 6 / 720
+    )
+    lon = (
+        d
+        - (1 + 2 * t1 + c1) * d ** 3 / 6
+        + (5 - 2 * c1 + 28 * t1 - 3 * c1 ** 2 + 8 * ep2 + 24 * t1 ** 2) * d ** 5 / 120
+    ) / cos
+    return np.degrees(lat), np.degrees(lon) + (huso - 1) * 6 - 180 + 3
+
+
+# --- Funciones de las reglas ---
+# Reciben el diccionario de columnas de validar_centros: un array float64 por
+# columna numérica del CSV, 'Código' (si existe, factorizado a enteros), 'obligatorias' (columnas
+# que no pueden ser nulas) y 'eliminar' (filas ya marcadas para eliminar).
+def _es_utm(c):
+    return (np.abs(c['COORDENADA_X']) > UMBRAL_UTM) & (np.abs(c['COORDENADA_Y']) > UMBRAL_UTM)
+
+
+def _reproyectar_utm(c, mascara):
+    x, y = c['COORDENADA_X'][mascara], c['COORDENADA_Y'][mascara]
+    # En Galicia el norte (millones de metros) siempre es mayor que el este,
+    # así que el orden de las columnas no importa
+    lat, lon = utm_a_wgs84(np.minimum(x, y), np.maximum(x, y))
+    c['COORDENADA_X'][mascara] = lat
+    c['COORDENADA_Y'][mascara] = lon
+
+
+def intercambiadas(x, y):
+    """
+    Máscara de los pares (x, y) que parecen intercambiados: los que solo
+    caen en CAJA_GALICIA al darles la vuelta y, fuera de la caja, aquellos
+    cuya x no puede ser una latitud pero y sí o, como en la regla anterior
+    por signos, con x negativa e y positiva (en Galicia la latitud es
+    positiva y la longitud negativa).
+    """
+    return (en_caja(y, x) & ~en_caja(x, y)) | ((np.abs(x) > 90) & (np.abs(y) <= 90)) | ((x < 0) & (y > 0))
+
+
+def _intercambiadas(c):
+    return intercambiadas(c['COORDENADA_X'], c['COORDENADA_Y'])
+
+
+def _intercambiar(c, mascara):
+    x, y = c['COORDENADA_X'], c['COORDENADA_Y']
+    x[mascara], y[mascara] = y[mascara], x[mascara]
+
+
+def _nulos(c):
+    mascara = np.zeros(len(c['COORDENADA_X']), dtype=bool)
+    for columna in c['obligatorias']:
+        mascara |= np.isnan(c[columna])
+    return mascara
+
+
+def _coordenadas_imposibles(c):
+    return (np.abs(c['COORDENADA_X']) > 90) | (np.abs(c['COORDENADA_Y']) > 180)
+
+
+def _fuera_de_galicia(c):
+    x, y = c['COORDENADA_X'], c['COORDENADA_Y']
+    return ~en_caja(x, y) & ~np.isnan(x) & ~np.isnan(y) & ~c['eliminar']
+
+
+def claves_codigo(serie):
+    """
+    Un entero por fila que identifica su código. Los códigos de centro son
+    números, y convertirlos es mucho más rápido que factorizar el texto; la
+    longitud se añade para distinguir '0123' de '123'. Los códigos que no son
+    números se factorizan. Los códigos vacíos son -1.
+    """
+    try:
+        texto = pa.array(serie)
+        numeros = pc.cast(texto, pa.int64())
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+        return pd.factorize(serie)[0]
+    if numeros.null_count or not pa.types.is_string(texto.type) and not pa.types.is_large_string(texto.type):
+        return pd.factorize(serie)[0]
+    numeros = numeros.to_numpy()
+    if len(numeros) and np.abs(numeros).max() >= 1 << 58:
+        return pd.factorize(serie)[0]
+    return numeros * 32 + pc.utf8_length(texto).to_numpy()
+
+
+def _codigo_duplicado(c):
+    mascara = np.zeros(len(c['COORDENADA_X']), dtype=bool)
+    if 'Código' in c:
+        # Se conserva la primera aparición de entre las filas que no se
+        # eliminan. Los códigos vacíos no cuentan como repetidos
+        validas = ~c['eliminar'] & (c['Código'] != -1)
+        mascara[validas] = pd.Series(c['Código'][validas]).duplicated().to_numpy()
+    return mascara
+
+
+def _distancia_incoherente(c):
+    recta = haversine_km(SANTIAGO[0], SANTIAGO[1], c['COORDENADA_X'], c['COORDENADA_Y'])
+    distancia = c['Distancia_Santiago_km']
+    with np.errstate(invalid='ignore'):
+        return (
+            (distancia < recta * FACTOR_DISTANCIA_MIN - MARGEN_DISTANCIA_KM)
+            | (distancia > recta * FACTOR_DISTANCIA_MAX + MARGEN_DISTANCIA_KM)
+        ) & ~c['eliminar']
+
+
+REGLAS = [
+    Regla('coordenadas_utm', CORREGIR, f"Coordenadas en UTM (huso {HUSO_UTM}) reproyectadas a latitud y longitud", _es_utm, _reproyectar_utm),
+    Regla('coordenadas_intercambiadas', CORREGIR, "COORDENADA_X y COORDENADA_Y intercambiadas", _intercambiadas, _intercambiar),
+    Regla('valores_nulos', ELIMINAR, "Distancia, tiempo o coordenadas vacías o no numéricas (como 'ERROR')", _nulos),
+    Regla('coordenadas_imposibles', ELIMINAR, "Coordenadas fuera del rango de una latitud o longitud", _coordenadas_imposibles),
+    Regla('fuera_de_galicia', AVISAR, "Coordenadas fuera de Galicia", _fuera_de_galicia),
+    Regla('codigo_duplicado', AVISAR, "Código ya usado en una fila anterior", _codigo_duplicado),
+    Regla('distancia_incoherente', AVISAR, "Distancia a Santiago incoherente con la distancia en línea recta", _distancia_incoherente),
+]
+BITS = {regla.nombre: np.uint16(1 << i) for i, regla in enumerate(REGLAS)}
+
+
+def a_float(serie):
+    """
+    Copia escribible de la columna como array float64, con NaN en los valores
+    no numéricos (como 'ERROR'). Las columnas de texto se convierten con
+    pyarrow, mucho más rápido que pd.to_numeric, salvo que algún valor no se
+    pueda convertir.
+    """
+    if serie.dtype != 'float64':
+        try:
+            return np.array(pc.cast(pa.array(serie), pa.float64()).to_numpy(zero_copy_only=False), dtype='float64')
+        except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+            serie = pd.to_numeric(serie, errors='coerce')
+    return serie.to_numpy(dtype='float64', copy=True)
+
+
+def validar_centros(df, obligatorias, columnas_numericas):
+    """
+    Aplica REGLAS a un DataFrame con las columnas del CSV en una sola pasada
+    sobre sus columnas.
+
+    Devuelve una tupla (df, eliminar, informe): el DataFrame con las columnas
+    numéricas convertidas a float64 y las coordenadas corregidas (sin quitar
+    filas), la máscara de las filas a eliminar y el InformeCalidad.
+    """
+    c = {columna: a_float(df[columna]) for columna in columnas_numericas}
+    if 'Código' in df.columns:
+        c['Código'] = claves_codigo(df['Código'])
+    c['obligatorias'] = obligatorias
+    c['eliminar'] = np.zeros(len(df), dtype=bool)
+
+    marcas = np.zeros(len(df), dtype=np.uint16)
+    for regla in REGLAS:
+        mascara = regla.comprobar(c)
+        if not mascara.any():
+            continue
+        marcas[mascara] |= BITS[regla.nombre]
+        if regla.accion == CORREGIR:
+            regla.corregir(c, mascara)
+        elif regla.accion == ELIMINAR:
+            c['eliminar'] |= mascara
+
+    df = df.assign(**{columna: c[columna] for columna in columnas_numericas})
+    return df, c['eliminar'], InformeCalidad.desde_marcas(df, marcas)
+
+
+class InformeCalidad:
+    """
+    Incidencias de la validación por fila: un DataFrame indexado por la
+    posición de la fila en el archivo original, con su 'Código' y las
+    'marcas' (un bit por regla de REGLAS), solo para las filas con alguna
+    incidencia. mal_formadas cuenta las filas que ni siquiera se pudieron
+    leer (ver datos.leer_csv_por_bloques).
+    """
+
+    def __init__(self, filas=None, mal_formadas=0):
+        if filas is None:
+            filas = pd.DataFrame({'Código': pd.Series(dtype=str), 'marcas': pd.Series(dtype=np.uint16)})
+        self.filas = filas
+        self.mal_formadas = mal_formadas
+
+    @classmethod
+    def desde_marcas(cls, df, marcas):
+        afectadas = np.flatnonzero(marcas)
+        codigos = df['Código'].iloc[afectadas].to_numpy() if 'Código' in df.columns else None
+        return cls(pd.DataFrame({'Código': codigos, 'marcas': marcas[afectadas]}, index=df.index[afectadas]))
+
+    @classmethod
+    def combinar(cls, informes, mal_formadas=0):
+        """
+        Une los informes de varios bloques de un mismo archivo.
+        """
+        informes = list(informes)
+        filas = [informe.filas for informe in informes if len(informe.filas)]
+        return cls(
+            pd.concat(filas) if filas else None,
+            mal_formadas + sum(informe.mal_formadas for informe in informes),
+        )
+
+    def marcar(self, indices, codigos, nombre):
+        """
+        Añade la regla a las filas indicadas (posiciones en el archivo original).
+        """
+        if not len(indices):
+            return
+        self.__dict__.pop('detalle', None)
+        nuevas = pd.DataFrame({'Código': codigos, 'marcas': BITS[nombre]}, index=indices)
+        filas = pd.concat([self.filas, nuevas])
+        self.filas = filas.groupby(level=0, sort=True).agg({'Código': 'first', 'marcas': np.bitwise_or.reduce})
+        self.filas['marcas'] = self.filas['marcas'].astype(np.uint16)
+
+    def recuento(self, nombre):
+        return int(((self.filas['marcas'].to_numpy() & BITS[nombre]) != 0).sum())
+
+    @property
+    def intercambiadas(self):
+        return self.recuento('coordenadas_intercambiadas')
+
+    @property
+    def reproyectadas(self):
+        return self.recuento('coordenadas_utm')
+
+    @property
+    def omitidas(self):
+        bits = np.uint16(sum(int(BITS[r.nombre]) for r in REGLAS if r.accion == ELIMINAR))
+        return int(((self.filas['marcas'].to_numpy() & bits) != 0).sum()) + self.mal_formadas
+
+    def resumen(self):
+        """
+        Número de filas afectadas por cada regla que se ha cumplido alguna vez.
+        """
+        filas = [
+            {'regla': r.nombre, 'descripción': r.descripcion, 'acción': r.accion, 'filas': self.recuento(r.nombre)}
+            for r in REGLAS
+        ]
+        if self.mal_formadas:
+            filas.append({'regla': 'fila_mal_formada', 'descripción': "Número de campos distinto de la cabecera",
+                          'acción': ELIMINAR, 'filas': self.mal_formadas})
+        resumen = pd.DataFrame(filas, columns=['regla', 'descripción', 'acción', 'filas'])
+        return resumen[resumen['filas'] > 0].reset_index(drop=True)
+
+    @cached_property
+    def detalle(self):
+        """
+        Una fila por centro con incidencias: su posición en el archivo, el
+        código, las reglas cumplidas y si se ha eliminado.
+        """
+        marcas = self.filas['marcas'].to_numpy()
+        # Pocas combinaciones distintas: se traducen una vez cada una
+        unicas, inversa = np.unique(marcas, return_inverse=True)
+        textos = np.array([', '.join(r.nombre for r in REGLAS if m & BITS[r.nombre]) for m in unicas], dtype=object)
+        bits_eliminar = sum(int(BITS[r.nombre]) for r in REGLAS if r.accion == ELIMINAR)
+        return pd.DataFrame({
+            'fila': self.filas.index.to_numpy(),
+            'Código': self.filas['Código'].to_numpy(),
+            'incidencias': textos[inversa] if len(marcas) else np.array([], dtype=object),
+            'eliminada': (marcas & bits_eliminar) != 0,
+        })
+
+    def a_csv(self):
+        return self.detalle.to_csv(index=False).encode('utf-8')
+
+    def a_tabla_arrow(self):
+        """
+        Tabla Arrow con las filas del informe, para guardarlo junto al snapshot.
+        """
+        tabla = pa.Table.from_pandas(self.filas.astype({'Código': str}), preserve_index=True)
+        return tabla.replace_schema_metadata({**tabla.schema.metadata, b'mal_formadas': str(self.mal_formadas).encode()})
+
+    @classmethod
+    def desde_tabla_arrow(cls, tabla):
+        filas = tabla.to_pandas()
+        filas['marcas'] = filas['marcas'].astype(np.uint16)
+        return cls(filas, int((tabla.schema.metadata or {}).get(b'mal_formadas', b'0')))
+
+
+def mostrar_informe(informe, origen=""):
+    """
+    Muestra las correcciones, las filas omitidas y los avisos de la
+    validación, con el informe por fila en un desplegable. origen completa
+    los mensajes (p. ej. " en los datos de ejemplo").
+    """
+    if informe.reproyectadas:
+        st.info(f"Se han reproyectado {informe.reproyectadas} pares de coordenadas{origen} que estaban en UTM (huso {HUSO_UTM}).")
+    if informe.intercambiadas:
+        st.info(f"Se han corregido {informe.intercambiadas} pares de coordenadas (COORDENADA_X y COORDENADA_Y){origen} que parecían estar intercambiadas.")
+    if informe.omitidas:
+        st.warning(f"Se han omitido {informe.omitidas} filas{origen} debido a valores erróneos (como 'ERROR' o coordenadas inválidas) en las columnas de distancia, tiempo o coordenadas.")
+    avisos = [f"{r.descripcion} ({informe.recuento(r.nombre)})" for r in REGLAS if r.accion == AVISAR and informe.recuento(r.nombre)]
+    if avisos:
+        st.warning(f"Centros que conviene revisar{origen}: " + "; ".join(avisos) + ".")
+    if len(informe.filas):
+        with st.expander("Informe de calidad de los datos"):
+            st.dataframe(informe.resumen(), hide_index=True)
+            st.dataframe(informe.detalle, hide_index=True)
+            st.download_button("Descargar informe (CSV)", informe.a_csv, file_name="informe_calidad.csv", mime="text/csv", on_click="ignore")
@@ -0,0 +1,260 @@
+import asyncio
+import json
+import random
+import re
+import threading
+import time
+import unicodedata
+import urllib.request
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import streamlit as st
+
+# --- Parser local de consultas ---
+# Reconoce las consultas que son solo una medida, como "a 50 km", "a menos de
+# 40 minutos" o "Muestra los centros a 50 km de Santiago.", sin llamar al
+# modelo. Si queda cualquier otra palabra ("más de", "entre", "no", un
+# concello, otro origen...) la consulta se deja al modelo.
+VERBOS_CONSULTA = r'(?:muestra(?:me)?|mostrar|ensena(?:me)?|quiero(?:\s+ver)?|ver|dame|busca|filtra)'
+PATRON_MEDIDA = re.compile(
+    r'^(?:' + VERBOS_CONSULTA + r'\s+)?(?:(?:los\s+)?centros\s+)?'
+    r'(?:a\s+)?(?:menos\s+de\s+)?(\d+(?:[.,]\d+)?)\s*'
+    r'(?:(km|kms|kilometros?|quilometros?)|(min|mins|minutos?)|(h|horas?))'
+    r'(?:\s+de\s+santiago(?:\s+de\s+compostela)?)?$'
+)
+
+# Tamaño y caducidad por defecto de la caché de consultas
+MAX_CONSULTAS_CACHE = 1024
+TTL_CACHE_SEGUNDOS = 3600
+
+# Política por defecto de las llamadas al modelo
+TIMEOUT_LLM_SEGUNDOS = 15
+MAX_LLAMADAS_SIMULTANEAS = 4
+REINTENTOS_LLM = 2
+ESPERA_REINTENTO_SEGUNDOS = 0.5
+
+# Modelo de Gemini que traduce las consultas a filtros
+MODELO_GEMINI = 'gemini-2.0-flash'
+
+
+def normalizar_consulta(query):
+    """
+    Pasa la consulta a minúsculas, sin tildes, sin signos de puntuación y con
+    los espacios colapsados, de forma que variantes triviales compartan clave.
+    """
+    texto = unicodedata.normalize('NFKD', query.lower())
+    texto = ''.join(c for c in texto if not unicodedata.combining(c))
+    texto = re.sub(r'[^\w\s.,]', ' ', texto)
+    texto = re.sub(r'(?<!\d)[.,]|[.,](?!\d)', ' ', texto)
+    return ' '.join(texto.split())
+
+
+def _numero(texto):
+    valor = float(texto.replace(',', '.'))
+    return int(valor) if valor.is_integer() else valor
+
+
+def parsear_consulta(query):
+    """
+    Extrae el filtro de una consulta sencilla sin llamar al modelo.
+
+    Devuelve un diccionario con las claves "valor" y "unidad" (como el modelo),
+    o None si la consulta no es únicamente una distancia o un tiempo máximos.
+    """
+    encontrada = PATRON_MEDIDA.match(normalizar_consulta(query))
+    if encontrada is None:
+        return None
+    numero, km, minutos, horas = encontrada.groups()
+    if km:
+        return {"valor": _numero(numero), "unidad": "km"}
+    if minutos:
+        return {"valor": _numero(numero), "unidad": "minutos"}
+    return {"valor": _numero(str(float(numero.replace(',', '.')) * 60)), "unidad": "minutos"}
+
+
+class CacheTTL:
+    """
+    Caché LRU con caducidad, segura para usar desde varios hilos (sesiones).
+    Lleva la cuenta de aciertos y fallos.
+    """
+
+    def __init__(self, max_entradas=MAX_CONSULTAS_CACHE, ttl=TTL_CACHE_SEGUNDOS):
+        self.max_entradas = max_entradas
+        self.ttl = ttl
+        self.entradas = OrderedDict()
+        self.lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+
+    def get(self, clave):
+        with self.lock:
+            entrada = self.entradas.get(clave)
+            if entrada is None or entrada[0] < time.monotonic():
+                if entrada is not None:
+                    del self.entradas[clave]
+                self.fallos += 1
+                return None
+            self.entradas.move_to_end(clave)
+            self.aciertos += 1
+            return entrada[1]
+
+    def set(self, clave, valor):
+        with self.lock:
+            self.entradas[clave] = (time.monotonic() + self.ttl, valor)
+            self.entradas.move_to_end(clave)
+            while len(self.entradas) > self.max_entradas:
+                self.entradas.popitem(last=False)
+
+    def tasa_aciertos(self):
+        total = self.aciertos + self.fallos
+        return self.aciertos / total if total else 0.0
+
+
+@st.cache_resource
+def cache_consultas():
+    """
+    Caché de consultas compartida por todas las sesiones del proceso.
+    """
+    return CacheTTL()
+
+
+def filtros_locales(query, cache):
+    """
+    Intenta resolver la consulta sin el modelo: primero con el parser local y
+    después con la caché de consultas normalizadas. Devuelve None si ninguno
+    de los dos la resuelve.
+    """
+    filtros = parsear_consulta(query)
+    if filtros is not None:
+        return filtros
+    return cache.get(normalizar_consulta(query))
+
+
+def _es_valida(respuesta, validar):
+    if validar is None:
+        return True
+    try:
+        validar(respuesta)
+    except ValueError:
+        return False
+    return True
+
+
+# --- Llamadas asíncronas al modelo ---
+class ClienteLLM:
+    """
+    Cliente del modelo compartido por todas las sesiones del proceso.
+
+    Las llamadas se ejecutan en un bucle asyncio propio, en un hilo aparte, de
+    forma que la ejecución del script de Streamlit no se bloquea esperando al
+    modelo. Cada llamada tiene un tiempo máximo, se reintenta con espera
+    exponencial si falla, y un semáforo limita las llamadas simultáneas de
+    todas las sesiones.
+
+    consultar_modelo(query) puede ser una corrutina o una función normal, y
+    se ejecuta en un pool de hilos propio, de tantos hilos como llamadas
+    simultáneas; las corrutinas, con asyncio.run, que espera también a los
+    hilos que abran (p. ej. con asyncio.to_thread). Un hilo no se puede
+    interrumpir: si su llamada supera el tiempo máximo, sigue ocupando su
+    plaza del semáforo hasta que termina, de modo que el límite se cumple
+    también con un modelo lento. Si se pasa un registro de métricas (ver
+    metricas.py), se anotan la duración de cada llamada y los errores.
+    """
+
+    def __init__(self, consultar_modelo, timeout=TIMEOUT_LLM_SEGUNDOS, concurrencia=MAX_LLAMADAS_SIMULTANEAS,
+                 reintentos=REINTENTOS_LLM, espera=ESPERA_REINTENTO_SEGUNDOS, registro=None):
+        self.consultar_modelo = consultar_modelo
+        self.registro = registro
+        self.timeout = timeout
+        self.reintentos = reintentos
+        self.espera = espera
+        self.loop = asyncio.new_event_loop()
+        self.semaforo = asyncio.Semaphore(concurrencia)
+        self.hilos = ThreadPoolExecutor(max_workers=concurrencia, thread_name_prefix="cliente-llm-llamada")
+        threading.Thread(target=self.loop.run_forever, name="cliente-llm", daemon=True).start()
+
+    def _ejecutar(self, query):
+        if asyncio.iscoroutinefunction(self.consultar_modelo):
+            return asyncio.run(self.consultar_modelo(query))
+        return self.consultar_modelo(query)
+
+    async def _llamada(self, query):
+        """
+        Una llamada al modelo con una plaza del semáforo, que se libera cuando
+        la llamada termina de verdad y no al agotarse el tiempo máximo.
+        """
+        await self.semaforo.acquire()
+        inicio = time.perf_counter()
+        tarea = asyncio.wrap_future(self.hilos.submit(self._ejecutar, query))
+        tarea.add_done_callback(self._liberar)
+        respuesta = await asyncio.wait_for(asyncio.shield(tarea), self.timeout)
+        if self.registro is not None:
+            self.registro.observar('centros_llm_llamada_segundos', time.perf_counter() - inicio)
+        return respuesta
+
+    def _liberar(self, tarea):
+        self.semaforo.release()
+        # Marca como leída la excepción de una llamada que ya nadie espera
+        if not tarea.cancelled():
+            tarea.exception()
+
+    async def consultar(self, query):
+        """
+        Llama al modelo respetando el límite de concurrencia, el tiempo máximo
+        y los reintentos. Lanza la última excepción si todos los intentos fallan.
+        """
+        for intento in range(self.reintentos + 1):
+            try:
+                return await self._llamada(query)
+            except Exception as error:
+                if self.registro is not None:
+                    self.registro.incrementar('centros_llm_errores_total', tipo=type(error).__name__)
+                if intento == self.reintentos:
+                    raise
+            # Espera exponencial con algo de aleatoriedad, sin ocupar el semáforo
+            await asyncio.sleep(self.espera * 2 ** intento * random.uniform(1, 1.5))
+
+    async def _consultar_y_guardar(self, query, cache, validar):
+        respuesta = await self.consultar(query)
+        if cache is not None and _es_valida(respuesta, validar):
+            cache.set(normalizar_consulta(query), respuesta)
+        return respuesta
+
+    def enviar(self, query, cache=None, validar=None):
+        """
+        Lanza la consulta en segundo plano y devuelve un concurrent.futures.Future
+        con los filtros. Si se indica una caché, la respuesta se guarda en ella
+        salvo que validar(respuesta) lance ValueError, antes de que el futuro
+        termine.
+        """
+        return asyncio.run_coroutine_threadsafe(self._consultar_y_guardar(query, cache, validar), self.loop)
+
+
+@st.cache_resource(show_spinner=False)
+def modelo_gemini(api_key, nombre=MODELO_GEMINI):
+    """
+    Modelo de Gemini compartido por todas las sesiones del proceso.
+
+    google.generativeai se importa aquí y no al principio del módulo: su
+    import tarda más que todo el resto de la página y muchas ejecuciones no
+    lo necesitan (consultas resueltas por el parser local o la caché, o
+    enviadas a LLM_URL).
+    """
+    import google.generativeai as genai
+    genai.configure(api_key=api_key)
+    return genai.GenerativeModel(nombre)
+
+
+def consultar_http(url, prompt, timeout=TIMEOUT_LLM_SEGUNDOS):
+    """
+    Envía el prompt a un servidor HTTP compatible con modelo_falso.py
+    (POST {"prompt": ...} → {"text": ...}) y devuelve el texto de la respuesta.
+    """
+    peticion = urllib.request.Request(
+        url,
+        data=json.dumps({"prompt": prompt}).encode('utf-8'),
+        headers={"Content-Type": "application/json"},
+    )
+    with urllib.request.urlopen(peticion, timeout=timeout) as respuesta:
+        return json.loads(respuesta.read().decode('utf-8'))["text"]
@@ -0,0 +1,491 @@
+import csv
+import hashlib
+import io
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pcsv
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+import streamlit as st
+
+from calidad import InformeCalidad, validar_centros
+
+# --- Esquema de los ficheros de centros ---
+# Columnas numéricas que deben convertirse a float. Los valores no numéricos
+# (como 'ERROR') se convierten a NaN.
+COLUMNAS_NUMERICAS = ['Distancia_Santiago_km', 'Tiempo_Santiago_min', 'COORDENADA_X', 'COORDENADA_Y']
+
+# Tipos explícitos para la lectura del CSV. Los códigos postales y teléfonos se
+# leen como texto para no perder ceros a la izquierda.
+DTYPES = {
+    'Código': str,
+    'Cód. postal': str,
+    'Teléfono': str,
+    **{columna: 'float64' for columna in COLUMNAS_NUMERICAS},
+}
+
+# Columnas con pocos valores distintos que se guardan como categorías. En
+# memoria ocupan un código entero por fila en lugar de un texto.
+COLUMNAS_CATEGORICAS = ['Concello', 'Provincia', 'Tipo de centro', 'TITULARIDADE', 'ENSINO_CONCERTADO', 'DEPENDENTE']
+
+# Columnas que se muestran en la tabla de centros filtrados
+COLUMNAS_TABLA = [
+    'Código', 'Nome', 'Enderezo', 'Concello', 'Provincia',
+    'Distancia_Santiago_km', 'Tiempo_Santiago_min', 'Tipo de centro',
+    'TITULARIDADE', 'ENSINO_CONCERTADO', 'DEPENDENTE'
+]
+
+# Columnas que debe tener un snapshot: las de la tabla y las coordenadas ya limpias
+COLUMNAS_SNAPSHOT = COLUMNAS_TABLA + ['latitude', 'longitude']
+
+# Valores que se interpretan como nulos al leer el CSV
+VALORES_NULOS = ['ERROR']
+
+# Datos de ejemplo si no se carga ningún archivo
+DATOS_EJEMPLO = {
+    'Código': [1, 2, 3, 4, 5, 6, 7, 8, 9, 10],
+    'Nome': ['Centro A', 'Centro B', 'Centro C', 'Centro D', 'Centro E', 'Centro F', 'Centro G', 'Centro H', 'Centro I', 'Centro J'],
+    'Enderezo': ['Calle Falsa 1', 'Avenida Real 2', 'Plaza Mayor 3', 'Rua do Sol 4', 'Calle Luna 5', 'Rua Estrela 6', 'Via Láctea 7', 'Paseo Marítimo 8', 'Ronda Exterior 9', 'Camiño Novo 10'],
+    'Concello': ['Santiago', 'Santiago', 'A Coruña', 'Vigo', 'Santiago', 'Pontevedra', 'Lugo', 'Ourense', 'Ferrol', 'Vigo'],
+    'Provincia': ['A Coruña', 'A Coruña', 'A Coruña', 'Pontevedra', 'A Coruña', 'Pontevedra', 'Lugo', 'Ourense', 'A Coruña', 'Pontevedra'],
+    'Cód. postal': ['15701', '15702', '15001', '36201', '15703', '36001', '27001', '32001', '15401', '36202'],
+    'Teléfono': ['981111111', '981222222', '981333333', '986444444', '981555555', '986666666', '982777777', '988888888', '981999999', '986000000'],
+    'Tipo de centro': ['Colegio', 'Instituto', 'Colegio', 'Guardería', 'Colegio', 'Instituto', 'Colegio', 'Instituto', 'Guardería', 'Colegio'],
+    'COORDENADA_X': [42.8782, 42.8790, 43.3623, -8.7226, 42.8750, 42.4336, 43.0128, 42.3364, 43.4839, 42.2400], # Latitud (D4 y E4 intercambiadas para prueba)
+    'COORDENADA_Y': [-8.5448, -8.5500, -8.4115, 42.2328, -8.5400, -8.6477, -7.5566, -7.8640, -8.2320, -8.7200], # Longitud
+    'TITULARIDADE': ['Pública', 'Privada', 'Pública', 'Privada', 'Pública', 'Privada', 'Pública', 'Privada', 'Pública', 'Privada'],
+    'ENSINO_CONCERTADO': ['No', 'Sí', 'No', 'No', 'Sí', 'Sí', 'No', 'Sí', 'No', 'Sí'],
+    'DEPENDENTE': ['Sí', 'No', 'Sí', 'No', 'Sí', 'No', 'Sí', 'No', 'Sí', 'No'],
+    'Distancia_Santiago_km': [0.5, 1.2, 60.0, 'ERROR', 0.8, 70.0, 100.0, 120.0, 75.0, 88.0], # Incluido 'ERROR' para prueba
+    'Tiempo_Santiago_min': [2, 5, 45, 70, 3, 'ERROR', 80, 95, 60, 68] # Incluido 'ERROR' para prueba
+}
+
+
+def hash_contenido(contenido):
+    """
+    Devuelve el hash SHA-256 del contenido de un fichero, usado como clave de caché.
+    """
+    return hashlib.sha256(contenido).hexdigest()
+
+
+def con_clave(df, clave):
+    """
+    Asocia al DataFrame la clave que identifica su contenido. Las estructuras
+    derivadas (índices, agregados...) se cachean por esta clave en lugar de
+    volver a hashear el DataFrame en cada ejecución.
+    """
+    df.attrs['clave'] = clave
+    return df
+
+
+def clave_datos(df):
+    """
+    Devuelve la clave del contenido de un DataFrame cargado con este módulo.
+    """
+    if 'clave' not in df.attrs:
+        df.attrs['clave'] = str(pd.util.hash_pandas_object(df, index=True).sum())
+    return df.attrs['clave']
+
+
+def leer_csv(fuente):
+    """
+    Lee un CSV de centros aplicando los tipos de DTYPES.
+
+    Si alguna columna numérica contiene texto distinto de VALORES_NULOS, se
+    vuelve a leer sin tipos numéricos para que limpiar_centros los convierta
+    con errors='coerce'. Una fila mal formada lanza pd.errors.ParserError;
+    los archivos subidos se leen con limpiar_por_bloques, que las omite.
+    """
+    try:
+        return pd.read_csv(fuente, sep=',', dtype=DTYPES, na_values=VALORES_NULOS)
+    except pd.errors.ParserError:
+        # Filas mal formadas: volver a leer no serviría (ver limpiar_por_bloques)
+        raise
+    except ValueError:
+        if hasattr(fuente, 'seek'):
+            fuente.seek(0)
+        dtypes_texto = {columna: tipo for columna, tipo in DTYPES.items() if columna not in COLUMNAS_NUMERICAS}
+        return pd.read_csv(fuente, sep=',', dtype=dtypes_texto)
+
+
+def limpiar_centros(df, obligatorias=COLUMNAS_NUMERICAS):
+    """
+    Convierte las columnas numéricas, aplica las reglas de calidad de
+    calidad.REGLAS (reproyección de coordenadas UTM, corrección de coordenadas
+    intercambiadas, avisos...) y elimina las filas inválidas.
+
+    Devuelve una tupla (df, informe) con el DataFrame limpio y el
+    InformeCalidad con las incidencias de cada fila. Se eliminan las filas con
+    valores nulos en alguna de las columnas `obligatorias` (por defecto,
+    distancia, tiempo y coordenadas) o con coordenadas imposibles. El
+    DataFrame resultante usa las columnas 'latitude' y 'longitude' en lugar
+    de 'COORDENADA_X' y 'COORDENADA_Y'.
+    """
+    df, eliminar, informe = validar_centros(df, obligatorias, COLUMNAS_NUMERICAS)
+    if eliminar.any():
+        df = df[~eliminar]
+
+    # Renombrar columnas para que Folium las entienda (espera 'latitude' y 'longitude')
+    df = df.rename(columns={'COORDENADA_X': 'latitude', 'COORDENADA_Y': 'longitude'})
+
+    # Columnas de texto repetitivo como categorías
+    df = df.astype({columna: 'category' for columna in COLUMNAS_CATEGORICAS if columna in df.columns})
+
+    return df, informe
+
+
+# --- Carga por bloques ---
+# Los CSV grandes se leen en bloques de TAMANO_BLOQUE bytes con el lector en
+# streaming de pyarrow. Cada bloque se limpia con limpiar_centros y se añade a
+# un AlmacenColumnar (tablas Arrow con las columnas categóricas codificadas
+# como diccionario), de modo que la memoria de trabajo depende del tamaño del
+# bloque y no del archivo. Las filas mal formadas (con un número de campos
+# distinto de la cabecera) se omiten y se cuentan en lugar de abortar la carga,
+# por lo que todos los CSV subidos se leen así, aunque quepan en un bloque.
+TAMANO_BLOQUE = 8 << 20  # 8 MB de CSV por bloque
+# Por encima de este tamaño, los CSV subidos muestran el progreso de cada bloque
+UMBRAL_CARGA_POR_BLOQUES = 32 << 20
+# Tipo Arrow de las columnas categóricas en el AlmacenColumnar
+TIPO_CATEGORIA = pa.dictionary(pa.int32(), pa.string())
+
+
+def leer_csv_por_bloques(fuente, tamano_bloque=TAMANO_BLOQUE):
+    """
+    Lee un CSV de centros (ruta o fichero binario) bloque a bloque.
+
+    Generador de tuplas (df, invalidas) con el DataFrame de cada bloque, con
+    las mismas columnas que leer_csv, y el número de filas mal formadas
+    omitidas desde el bloque anterior. Las columnas numéricas se leen como
+    texto para que un valor no numérico no detenga la lectura: limpiar_centros
+    las convierte con errors='coerce'.
+    """
+    if isinstance(fuente, str):
+        with open(fuente, 'rb') as f:
+            yield from leer_csv_por_bloques(f, tamano_bloque)
+        return
+
+    # Todas las columnas como texto, para que los tipos no dependan del primer bloque
+    cabecera = fuente.readline().decode('utf-8-sig')
+    fuente.seek(0)
+    columnas = next(csv.reader([cabecera]), [])
+
+    invalidas = []
+    lector = pcsv.open_csv(
+        fuente,
+        read_options=pcsv.ReadOptions(block_size=tamano_bloque),
+        parse_options=pcsv.ParseOptions(invalid_row_handler=lambda fila: invalidas.append(fila.number) or 'skip'),
+        convert_options=pcsv.ConvertOptions(
+            column_types={columna: pa.string() for columna in columnas},
+            null_values=VALORES_NULOS + [''],
+            strings_can_be_null=True,
+        ),
+    )
+    leidas = 0
+    for lote in lector:
+        df = lote.to_pandas()
+        # Índice continuo entre bloques, como en una lectura completa
+        df.index = pd.RangeIndex(leidas, leidas + len(df))
+        leidas += len(df)
+        yield df, len(invalidas)
+        invalidas.clear()
+
+
+class AlmacenColumnar:
+    """
+    Centros limpios acumulados bloque a bloque como tablas Arrow.
+
+    Las columnas categóricas se guardan como diccionarios (un código entero
+    por fila), igual que en el DataFrame final.
+    """
+
+    def __init__(self):
+        self.tablas = []
+        self.filas = 0
+        self.informes = []
+
+    def anadir(self, df, informe=None):
+        tabla = pa.Table.from_pandas(
+            df.drop(columns=[c for c in COLUMNAS_CATEGORICAS if c in df.columns]), preserve_index=True
+        )
+        for columna in COLUMNAS_CATEGORICAS:
+            if columna in df.columns:
+                categorias = df[columna].cat
+                codigos = categorias.codes.to_numpy()
+                # Tipo explícito: si el bloque se queda sin filas, sus categorías
+                # vacías darían un diccionario de nulos que no se puede concatenar
+                diccionario = pa.DictionaryArray.from_buffers(
+                    TIPO_CATEGORIA, len(codigos),
+                    pa.array(codigos, type=pa.int32(), mask=codigos < 0).buffers(),
+                    pa.array(categorias.categories.to_numpy(dtype=object), type=pa.string()),
+                )
+                tabla = tabla.append_column(columna, diccionario)
+        self.tablas.append(tabla.replace_schema_metadata(None))
+        self.filas += len(df)
+        if informe is not None:
+            self.informes.append(informe)
+
+    def __len__(self):
+        return self.filas
+
+    @property
+    def omitidas(self):
+        return sum(informe.omitidas for informe in self.informes)
+
+    def a_dataframe(self, columnas=None):
+        """
+        Devuelve los centros acumulados como un DataFrame con el índice y el
+        orden de columnas del CSV. El almacén queda vacío: sus buffers se
+        liberan a medida que se convierten.
+        """
+        if not self.tablas:
+            return pd.DataFrame(columns=columnas)
+        tabla = pa.concat_tables(self.tablas)
+        self.tablas = []
+        df = tabla.to_pandas(split_blocks=True, self_destruct=True)
+        df = df.set_index('__index_level_0__').rename_axis(None)
+        return df[[c for c in columnas if c in df.columns]] if columnas else df
+
+
+def limpiar_por_bloques(fuente, progreso=None, tamano_bloque=TAMANO_BLOQUE):
+    """
+    Lee y limpia un CSV bloque a bloque. Devuelve lo mismo que limpiar_centros.
+
+    Si se indica, progreso(almacen, df) se llama tras limpiar cada bloque con
+    el AlmacenColumnar acumulado y el DataFrame limpio del bloque.
+    """
+    almacen = AlmacenColumnar()
+    columnas = None
+    for bloque, invalidas in leer_csv_por_bloques(fuente, tamano_bloque):
+        df, informe = limpiar_centros(bloque)
+        informe.mal_formadas = invalidas
+        columnas = list(df.columns)
+        almacen.anadir(df, informe)
+        if progreso is not None:
+            progreso(almacen, df)
+    informe = InformeCalidad.combinar(almacen.informes)
+    df = almacen.a_dataframe(columnas)
+
+    # Cada bloque solo ve sus propios códigos: los repetidos entre bloques se
+    # buscan al final sobre el resultado completo. Los códigos vacíos no
+    # cuentan como repetidos, como en la regla de calidad.py
+    if 'Código' in df.columns:
+        repetidos = (df['Código'].notna() & df['Código'].duplicated()).to_numpy()
+        informe.marcar(df.index[repetidos], df['Código'].to_numpy()[repetidos], 'codigo_duplicado')
+    return df, informe
+
+
+# --- Carga cacheada ---
+# Los datos cargados se guardan con st.cache_resource: todas las sesiones del
+# proceso comparten el mismo DataFrame, que por tanto es de SOLO LECTURA (los
+# filtros devuelven posiciones o copias, nunca lo modifican). Así la memoria
+# no crece con el número de usuarios, solo con el número de archivos distintos.
+#
+# Las funciones cacheadas reciben el hash del contenido como clave. El contenido
+# en sí se pasa con un guion bajo para que Streamlit no lo vuelva a hashear, de
+# modo que una nueva ejecución del script solo cuesta una búsqueda en la caché.
+#
+# Si CENTROS_CACHE_DIR apunta a un directorio compartido (p. ej. /dev/shm),
+# cada archivo limpio se guarda además allí como snapshot Arrow. Los demás
+# procesos de un despliegue con varios workers lo mapean en memoria en lugar
+# de volver a procesarlo, y el sistema operativo comparte esas páginas.
+DIRECTORIO_COMPARTIDO = os.environ.get("CENTROS_CACHE_DIR")
+
+# Número de CSV cargados por bloques que se conservan en memoria
+MAX_CARGAS_POR_BLOQUES = 8
+_LOCK_CARGAS = threading.Lock()
+
+
+def _cargar_compartido(clave, procesar):
+    """
+    Devuelve el resultado de procesar() (como limpiar_centros), reutilizando el
+    snapshot compartido de la clave y su informe de calidad si existen y
+    creándolos si no.
+    """
+    if not DIRECTORIO_COMPARTIDO:
+        df, informe = procesar()
+        return con_clave(df, clave), informe
+
+    ruta = os.path.join(DIRECTORIO_COMPARTIDO, f"centros-{clave}.arrow")
+    ruta_informe = os.path.join(DIRECTORIO_COMPARTIDO, f"centros-{clave}.calidad.arrow")
+    if not os.path.exists(ruta):
+        df, informe = procesar()
+        # Escritura atómica: otro proceso nunca ve un snapshot a medias. El
+        # informe se escribe antes, de modo que si existe el snapshot existe él
+        temporal = f"{ruta_informe}.{os.getpid()}.tmp"
+        feather.write_feather(informe.a_tabla_arrow(), temporal, compression='uncompressed')
+        os.replace(temporal, ruta_informe)
+        temporal = f"{ruta}.{os.getpid()}.tmp"
+        guardar_snapshot(df, temporal)
+        os.replace(temporal, ruta)
+
+    df = leer_snapshot(ruta, ruta)
+    informe = InformeCalidad.desde_tabla_arrow(feather.read_table(ruta_informe))
+    return con_clave(df, clave), informe
+
+
+@st.cache_resource(show_spinner="Procesando el archivo CSV...", max_entries=8)
+def cargar_csv(clave, _contenido):
+    """
+    Lee y limpia un CSV de centros, omitiendo las filas mal formadas.
+    Devuelve lo mismo que limpiar_centros.
+    """
+    return _cargar_compartido(clave, lambda: limpiar_por_bloques(io.BytesIO(_contenido)))
+
+
+@st.cache_resource
+def cargas_por_bloques():
+    """
+    Resultados de cargar_csv_por_bloques compartidos por todas las sesiones
+    del proceso (clave → resultado), los más recientes al final.
+    """
+    return OrderedDict()
+
+
+def cargar_csv_por_bloques(clave, contenido, progreso=None):
+    """
+    Como cargar_csv, pero leyendo y limpiando el CSV por bloques. progreso
+    (ver limpiar_por_bloques) solo se llama la primera vez, al procesarlo.
+
+    No usa st.cache_resource porque progreso dibuja en la página, lo que
+    Streamlit no permite dentro de una función cacheada; los resultados se
+    guardan en cargas_por_bloques, con el mismo límite de entradas.
+    """
+    cargas = cargas_por_bloques()
+    with _LOCK_CARGAS:
+        if clave in cargas:
+            cargas.move_to_end(clave)
+            return cargas[clave]
+    resultado = _cargar_compartido(clave, lambda: limpiar_por_bloques(io.BytesIO(contenido), progreso))
+    with _LOCK_CARGAS:
+        cargas[clave] = resultado
+        while len(cargas) > MAX_CARGAS_POR_BLOQUES:
+            cargas.popitem(last=False)
+    return resultado
+
+
+def cargar_archivo(uploaded_file, progreso=None):
+    """
+    Carga un archivo subido con st.file_uploader usando la caché por contenido.
+    Acepta tanto CSV como snapshots columnares (ver más abajo). Los CSV se
+    leen siempre por bloques; en los de más de UMBRAL_CARGA_POR_BLOQUES bytes
+    se llama además a progreso(almacen, df) tras cada bloque.
+    """
+    contenido = uploaded_file.getvalue()
+    if es_snapshot(uploaded_file.name):
+        return cargar_snapshot_bytes(hash_contenido(contenido), uploaded_file.name, contenido)
+    if len(contenido) >= UMBRAL_CARGA_POR_BLOQUES:
+        return cargar_csv_por_bloques(hash_contenido(contenido), contenido, progreso)
+    return cargar_csv(hash_contenido(contenido), contenido)
+
+
+@st.cache_resource(show_spinner=False)
+def cargar_ejemplo():
+    """
+    Devuelve los datos de ejemplo limpios. Devuelve lo mismo que limpiar_centros.
+    """
+    df = pd.DataFrame(DATOS_EJEMPLO).astype({'Código': str})
+    df, informe = limpiar_centros(df)
+    return con_clave(df, 'ejemplo'), informe
+
+
+# --- Snapshots columnares ---
+# Un snapshot guarda el DataFrame ya limpio (coordenadas corregidas en
+# 'latitude'/'longitude' y columnas categóricas) en formato Arrow IPC o Parquet,
+# de forma que cargarlo no requiere volver a parsear ni limpiar el CSV.
+EXTENSIONES_ARROW = ('.arrow', '.feather')
+EXTENSIONES_PARQUET = ('.parquet',)
+EXTENSIONES_SNAPSHOT = EXTENSIONES_ARROW + EXTENSIONES_PARQUET
+
+
+def es_snapshot(nombre):
+    """
+    Indica si un nombre de archivo corresponde a un snapshot columnar.
+    """
+    return os.path.splitext(nombre)[1].lower() in EXTENSIONES_SNAPSHOT
+
+
+def a_tabla_arrow(df):
+    """
+    Convierte un DataFrame limpio en una tabla Arrow conservando su índice.
+    """
+    return pa.Table.from_pandas(df, preserve_index=True)
+
+
+def snapshot_a_bytes(df, formato='arrow'):
+    """
+    Serializa un DataFrame limpio como snapshot ('arrow' o 'parquet').
+    """
+    tabla = a_tabla_arrow(df)
+    sink = pa.BufferOutputStream()
+    if formato == 'parquet':
+        pq.write_table(tabla, sink)
+    else:
+        # Sin compresión para poder mapear el archivo en memoria al leerlo
+        feather.write_feather(tabla, sink, compression='uncompressed')
+    return sink.getvalue().to_pybytes()
+
+
+def guardar_snapshot(df, ruta):
+    """
+    Guarda un DataFrame limpio como snapshot. El formato se deduce de la extensión.
+    """
+    formato = 'parquet' if ruta.lower().endswith(EXTENSIONES_PARQUET) else 'arrow'
+    with open(ruta, 'wb') as f:
+        f.write(snapshot_a_bytes(df, formato))
+
+
+def leer_snapshot(fuente, nombre):
+    """
+    Lee un snapshot desde una ruta o un buffer Arrow y devuelve el DataFrame.
+    Lanza ValueError si le falta alguna de las COLUMNAS_SNAPSHOT.
+
+    Los snapshots Arrow en disco se mapean en memoria, por lo que las columnas
+    numéricas se leen sin copiar el archivo completo a RAM.
+    """
+    if nombre.lower().endswith(EXTENSIONES_PARQUET):
+        tabla = pq.read_table(fuente)
+    elif isinstance(fuente, str):
+        tabla = feather.read_table(fuente, memory_map=True)
+    else:
+        tabla = feather.read_table(fuente)
+    faltan = [columna for columna in COLUMNAS_SNAPSHOT if columna not in tabla.column_names]
+    if faltan:
+        raise ValueError(f"Faltan columnas en el snapshot {nombre}: {faltan}")
+    return tabla.to_pandas(split_blocks=True)
+
+
+@st.cache_resource(show_spinner="Cargando el snapshot...", max_entries=8)
+def cargar_snapshot_bytes(clave, nombre, _contenido):
+    """
+    Carga un snapshot subido. Devuelve lo mismo que limpiar_centros; como el
+    snapshot ya está limpio el informe de calidad está vacío.
+    """
+    return _cargar_compartido(clave, lambda: (leer_snapshot(pa.BufferReader(_contenido), nombre), InformeCalidad()))
+
+
+@st.cache_resource(show_spinner="Cargando el snapshot...")
+def cargar_snapshot(ruta):
+    """
+    Carga un snapshot desde disco una sola vez por proceso.
+    """
+    return con_clave(leer_snapshot(ruta, ruta), ruta)
+
+
+if __name__ == '__main__':
+    # Uso: python datos.py centros.csv centros.arrow
+    # Guarda además el informe de calidad por fila en centros.arrow.calidad.csv
+    if len(sys.argv) != 3:
+        print("Uso: python datos.py <entrada.csv> <salida.arrow|salida.parquet>")
+        sys.exit(1)
+    df, informe = limpiar_por_bloques(sys.argv[1])
+    guardar_snapshot(df, sys.argv[2])
+    print(f"Snapshot guardado en {sys.argv[2]}: {len(df)} centros, {informe.intercambiadas} coordenadas corregidas, {informe.omitidas} filas omitidas.")
+    if len(informe.filas):
+        with open(f"{sys.argv[2]}.calidad.csv", 'wb') as f:
+            f.write(informe.a_csv())
+        print(informe.resumen().to_string(index=False))
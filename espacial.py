@@ -0,0 +1,159 @@
+import numpy as np
+import streamlit as st
+
+# Radio medio de la Tierra en km
+RADIO_TIERRA_KM = 6371.0088
+
+# Centro de Santiago, origen de las distancias y tiempos precalculados del CSV
+SANTIAGO = [42.8782, -8.5448]
+
+# Tamaño por defecto de las celdas de la rejilla, en grados (~11 km de latitud)
+TAMANO_CELDA = 0.1
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """
+    Distancia en línea recta (km) entre puntos en grados. Acepta arrays.
+    """
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * RADIO_TIERRA_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+class IndiceEspacial:
+    """
+    Índice espacial en rejilla sobre las columnas 'latitude' y 'longitude'.
+
+    Los centros se ordenan por la celda de la rejilla en la que caen, de modo
+    que cada fila de celdas de una caja de búsqueda es un tramo contiguo del
+    orden y se localiza con una búsqueda binaria. Solo se calcula la distancia
+    haversine de los centros de las celdas candidatas.
+    """
+
+    def __init__(self, df, tamano_celda=TAMANO_CELDA):
+        self.n = len(df)
+        self.tamano_celda = tamano_celda
+        self.lat = df['latitude'].to_numpy(dtype='float64')
+        self.lon = df['longitude'].to_numpy(dtype='float64')
+
+        if self.n:
+            self.lat0, self.lat1 = self.lat.min(), self.lat.max()
+            self.lon0, self.lon1 = self.lon.min(), self.lon.max()
+            self.filas = int((self.lat1 - self.lat0) // tamano_celda) + 1
+            self.columnas = int((self.lon1 - self.lon0) // tamano_celda) + 1
+        else:
+            self.lat0 = self.lat1 = self.lon0 = self.lon1 = 0.0
+            self.filas = self.columnas = 0
+
+        celdas = self._celda(self.lat, self.lon)
+        self.orden = np.argsort(celdas, kind='stable')
+        self.celdas_ordenadas = celdas[self.orden]
+
+    def _fila_columna(self, lat, lon):
+        fila = np.floor((np.asarray(lat) - self.lat0) / self.tamano_celda).astype(np.int64)
+        columna = np.floor((np.asarray(lon) - self.lon0) / self.tamano_celda).astype(np.int64)
+        return fila, columna
+
+    def _celda(self, lat, lon):
+        fila, columna = self._fila_columna(lat, lon)
+        return fila * self.columnas + columna
+
+    def _candidatos(self, lat, lon, radio_km):
+        """
+        Posiciones de los centros en las celdas que cubren la caja del radio.
+        """
+        # Grados de latitud y longitud que abarca el radio
+        dlat = np.degrees(radio_km / RADIO_TIERRA_KM)
+        coseno = max(np.cos(np.radians(min(abs(lat) + dlat, 89.9))), 1e-6)
+        dlon = min(dlat / coseno, 180.0)
+
+        return self._celdas_caja(lat - dlat, lat + dlat, lon - dlon, lon + dlon)
+
+    def _celdas_caja(self, lat_min, lat_max, lon_min, lon_max):
+        """
+        Posiciones de los centros de las celdas que cubren una caja de coordenadas.
+        """
+        # La caja se recorta a la de los centros antes de pasar a celdas: con
+        # un radio muy grande los índices de celda desbordarían
+        lat_min, lat_max = max(lat_min, self.lat0), min(lat_max, self.lat1)
+        lon_min, lon_max = max(lon_min, self.lon0), min(lon_max, self.lon1)
+        if self.n == 0 or lat_min > lat_max or lon_min > lon_max:
+            return np.empty(0, dtype=np.int64)
+        fila_min, columna_min = self._fila_columna(lat_min, lon_min)
+        fila_max, columna_max = self._fila_columna(lat_max, lon_max)
+        fila_min, fila_max = max(int(fila_min), 0), min(int(fila_max), self.filas - 1)
+        columna_min, columna_max = max(int(columna_min), 0), min(int(columna_max), self.columnas - 1)
+        if fila_min > fila_max or columna_min > columna_max:
+            return np.empty(0, dtype=np.int64)
+
+        # Un tramo contiguo del orden por cada fila de celdas de la caja
+        filas = np.arange(fila_min, fila_max + 1)
+        inicios = np.searchsorted(self.celdas_ordenadas, filas * self.columnas + columna_min, side='left')
+        finales = np.searchsorted(self.celdas_ordenadas, filas * self.columnas + columna_max, side='right')
+        tramos = [self.orden[i:f] for i, f in zip(inicios, finales) if f > i]
+        return np.concatenate(tramos) if tramos else np.empty(0, dtype=np.int64)
+
+    def en_caja(self, lat_min, lat_max, lon_min, lon_max):
+        """
+        Posiciones (ordenadas) de los centros dentro de una caja de coordenadas,
+        por ejemplo la zona visible de un mapa.
+        """
+        candidatos = self._celdas_caja(lat_min, lat_max, lon_min, lon_max)
+        lat, lon = self.lat[candidatos], self.lon[candidatos]
+        dentro = (lat >= lat_min) & (lat <= lat_max) & (lon >= lon_min) & (lon <= lon_max)
+        return np.sort(candidatos[dentro])
+
+    def en_radio(self, lat, lon, radio_km):
+        """
+        Centros a menos de radio_km del punto (lat, lon).
+
+        Devuelve una tupla (posiciones, distancias_km) ordenada por distancia.
+        """
+        candidatos = self._candidatos(lat, lon, radio_km)
+        distancias = haversine_km(lat, lon, self.lat[candidatos], self.lon[candidatos])
+        dentro = distancias <= radio_km
+        candidatos, distancias = candidatos[dentro], distancias[dentro]
+        orden = np.argsort(distancias, kind='stable')
+        return candidatos[orden], distancias[orden]
+
+    def mas_cercanos(self, lat, lon, k, mascara=None):
+        """
+        Los k centros más cercanos al punto (lat, lon). Si se pasa una máscara
+        booleana de longitud n (p. ej. la de los centros que cumplen los
+        filtros), los k más cercanos de entre los marcados en ella.
+
+        Busca en radios crecientes hasta reunir k centros: los k más cercanos
+        dentro de un radio son los k más cercanos del conjunto completo.
+        Devuelve una tupla (posiciones, distancias_km) ordenada por distancia.
+        """
+        k = min(int(k), self.n if mascara is None else int(np.count_nonzero(mascara)))
+        if k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+
+        radio_km = self.tamano_celda * 111.0
+        while True:
+            posiciones, distancias = self.en_radio(lat, lon, radio_km)
+            if mascara is not None:
+                marcados = mascara[posiciones]
+                posiciones, distancias = posiciones[marcados], distancias[marcados]
+            if len(posiciones) >= k or radio_km > np.pi * RADIO_TIERRA_KM:
+                return posiciones[:k], distancias[:k]
+            radio_km *= 2
+
+
+@st.cache_resource(show_spinner=False, max_entries=8)
+def indice_espacial(clave, _df):
+    """
+    Construye el índice espacial de un conjunto de datos una sola vez por
+    proceso. La clave identifica el conjunto de datos (ver datos.clave_datos).
+    """
+    return IndiceEspacial(_df)
+
+
+@st.cache_resource(show_spinner=False, max_entries=8)
+def centroides_concello(clave, _df):
+    """
+    Coordenadas medias de los centros de cada Concello, usadas como origen de
+    las búsquedas. Se calculan una sola vez por conjunto de datos.
+    """
+    return _df.groupby('Concello', observed=True)[['latitude', 'longitude']].mean()
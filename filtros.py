@@ -0,0 +1,258 @@
+import functools
+import json
+import unicodedata
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+
+class IndiceFiltros:
+    """
+    Índice para filtrar centros por distancia y tiempo máximos a Santiago.
+
+    Guarda el orden de las filas por distancia y por tiempo. Un filtro
+    "<= valor" es entonces un prefijo de ese orden que se localiza con una
+    búsqueda binaria, y la combinación de los dos filtros es la intersección
+    de ambos prefijos mediante un bitmap. Los filtros devuelven posiciones de
+    fila (para usar con df.iloc / df.take), nunca copias del DataFrame.
+    """
+
+    def __init__(self, df):
+        self.n = len(df)
+        distancias = df['Distancia_Santiago_km'].to_numpy(dtype='float64')
+        tiempos = df['Tiempo_Santiago_min'].to_numpy(dtype='float64')
+
+        self.orden_distancia = np.argsort(distancias, kind='stable')
+        self.distancias_ordenadas = distancias[self.orden_distancia]
+        self.orden_tiempo = np.argsort(tiempos, kind='stable')
+        self.tiempos_ordenados = tiempos[self.orden_tiempo]
+
+    def _prefijo(self, orden, ordenados, maximo):
+        """
+        Posiciones de las filas con valor <= maximo (None si no hay límite
+        o si el límite incluye todas las filas).
+        """
+        if maximo is None:
+            return None
+        k = np.searchsorted(ordenados, maximo, side='right')
+        # Un prefijo que abarca todas las filas no filtra nada
+        return None if k == self.n else orden[:k]
+
+    def filtrar(self, max_distancia=None, max_tiempo=None):
+        """
+        Devuelve las posiciones (ordenadas) de los centros que cumplen ambos
+        límites. Un límite None no filtra.
+        """
+        por_distancia = self._prefijo(self.orden_distancia, self.distancias_ordenadas, max_distancia)
+        por_tiempo = self._prefijo(self.orden_tiempo, self.tiempos_ordenados, max_tiempo)
+
+        if por_distancia is None and por_tiempo is None:
+            return np.arange(self.n)
+        if por_distancia is None:
+            return np.sort(por_tiempo)
+        if por_tiempo is None:
+            return np.sort(por_distancia)
+
+        # Marcar en el bitmap el prefijo más corto y quedarse con las
+        # posiciones del otro prefijo que estén marcadas
+        corto, largo = sorted((por_distancia, por_tiempo), key=len)
+        if len(corto) == 0:
+            return corto
+        bitmap = np.zeros(self.n, dtype=bool)
+        bitmap[corto] = True
+        return np.sort(largo[bitmap[largo]])
+
+    def mascara(self, posiciones):
+        """
+        Convierte un array de posiciones en una máscara booleana de longitud n.
+        """
+        mascara = np.zeros(self.n, dtype=bool)
+        mascara[posiciones] = True
+        return mascara
+
+
+@st.cache_resource(show_spinner=False, max_entries=8)
+def indice_filtros(clave, _df):
+    """
+    Construye el índice de filtros de un conjunto de datos una sola vez por
+    proceso. La clave identifica el conjunto de datos (ver datos.clave_datos).
+    """
+    return IndiceFiltros(_df)
+
+
+# --- Lenguaje de filtros del chatbot ---
+# Un filtro es un árbol JSON con estos nodos:
+#   {"campo": "distancia" | "tiempo", "min": 10, "max": 50}   rango (min y max opcionales)
+#   {"campo": "provincia", "en": ["Lugo", "Ourense"]}         pertenencia a una lista
+#   {"campo": "titularidade", "igual": "Pública"}             igualdad
+#   {"y": [filtro, ...]}, {"o": [filtro, ...]}, {"no": filtro}
+# El árbol se compila una vez en una función que calcula la máscara booleana
+# de todas las filas con operaciones vectorizadas de NumPy. Las columnas de
+# texto se comparan por sus códigos de categoría, no por los textos.
+CAMPOS_RANGO = {
+    'distancia': ('Distancia_Santiago_km', 'km'),
+    'tiempo': ('Tiempo_Santiago_min', 'minutos'),
+}
+CAMPOS_CATEGORICOS = {
+    'concello': 'Concello',
+    'provincia': 'Provincia',
+    'tipo de centro': 'Tipo de centro',
+    'tipo': 'Tipo de centro',
+    'titularidade': 'TITULARIDADE',
+    'ensino concertado': 'ENSINO_CONCERTADO',
+    'concertado': 'ENSINO_CONCERTADO',
+    'dependente': 'DEPENDENTE',
+}
+
+
+def _normalizar(texto):
+    """
+    Minúsculas, sin tildes y con '_' como espacio, para comparar nombres y valores.
+    """
+    texto = unicodedata.normalize('NFKD', str(texto).lower().replace('_', ' '))
+    return ' '.join(''.join(c for c in texto if not unicodedata.combining(c)).split())
+
+
+def _codigos_categoria(df, columna):
+    serie = df[columna]
+    if not isinstance(serie.dtype, pd.CategoricalDtype):
+        serie = serie.astype('category')
+    return serie.cat.codes.to_numpy(), serie.cat.categories
+
+
+def _limite(nodo, clave, por_defecto):
+    valor = nodo.get(clave)
+    if valor is None:
+        return por_defecto
+    try:
+        return float(valor)
+    except (TypeError, ValueError):
+        raise ValueError(f"'{clave}' debe ser un número: {valor!r}") from None
+
+
+def compilar_filtro(nodo):
+    """
+    Compila un árbol de filtro en una función df -> máscara booleana (np.ndarray).
+    Lanza ValueError si el árbol no es válido.
+    """
+    if not isinstance(nodo, dict):
+        raise ValueError(f"Nodo de filtro no válido: {nodo!r}")
+
+    if 'y' in nodo or 'o' in nodo:
+        operador = 'y' if 'y' in nodo else 'o'
+        hijos = nodo[operador]
+        if not isinstance(hijos, list) or not hijos:
+            raise ValueError(f"'{operador}' necesita una lista de filtros")
+        compilados = [compilar_filtro(hijo) for hijo in hijos]
+        combinar = np.logical_and if operador == 'y' else np.logical_or
+        return lambda df: combinar.reduce([f(df) for f in compilados])
+
+    if 'no' in nodo:
+        compilado = compilar_filtro(nodo['no'])
+        return lambda df: ~compilado(df)
+
+    campo = _normalizar(nodo.get('campo', ''))
+    if campo in CAMPOS_RANGO:
+        columna = CAMPOS_RANGO[campo][0]
+        if nodo.get('min') is None and nodo.get('max') is None:
+            raise ValueError(f"El rango de '{campo}' necesita 'min' o 'max'")
+        minimo, maximo = _limite(nodo, 'min', -np.inf), _limite(nodo, 'max', np.inf)
+
+        def rango(df):
+            valores = df[columna].to_numpy(dtype='float64')
+            return (valores >= minimo) & (valores <= maximo)
+        return rango
+
+    if campo in CAMPOS_CATEGORICOS:
+        columna = CAMPOS_CATEGORICOS[campo]
+        valores = nodo['en'] if 'en' in nodo else [nodo['igual']] if 'igual' in nodo else None
+        if not isinstance(valores, list) or not valores:
+            raise ValueError(f"El filtro de '{campo}' necesita 'en' (lista) o 'igual'")
+        if not all(isinstance(valor, (str, int, float)) for valor in valores):
+            raise ValueError(f"Los valores de '{campo}' deben ser textos o números: {valores!r}")
+        buscados = {_normalizar(valor) for valor in valores}
+
+        def pertenencia(df):
+            codigos, categorias = _codigos_categoria(df, columna)
+            # Solo se comparan los textos de las categorías, no los de cada fila
+            aceptados = np.flatnonzero([_normalizar(c) in buscados for c in categorias])
+            return np.isin(codigos, aceptados)
+        return pertenencia
+
+    raise ValueError(f"Campo de filtro desconocido: {nodo.get('campo')!r}")
+
+
+def describir_filtro(nodo):
+    """
+    Describe un árbol de filtro en lenguaje natural para el chat.
+    """
+    if 'y' in nodo:
+        return ' y '.join(describir_filtro(hijo) for hijo in nodo['y'])
+    if 'o' in nodo:
+        return '(' + ' o '.join(describir_filtro(hijo) for hijo in nodo['o']) + ')'
+    if 'no' in nodo:
+        return f"no ({describir_filtro(nodo['no'])})"
+
+    campo = _normalizar(nodo['campo'])
+    if campo in CAMPOS_RANGO:
+        unidad = CAMPOS_RANGO[campo][1]
+        if nodo.get('min') is not None and nodo.get('max') is not None:
+            return f"a entre **{nodo['min']} y {nodo['max']} {unidad}** de Santiago"
+        if nodo.get('max') is not None:
+            return f"a un máximo de **{nodo['max']} {unidad}** de Santiago"
+        return f"a un mínimo de **{nodo['min']} {unidad}** de Santiago"
+
+    valores = nodo['en'] if 'en' in nodo else [nodo['igual']]
+    return f"con {CAMPOS_CATEGORICOS[campo]} **{' / '.join(map(str, valores))}**"
+
+
+def filtro_desde_respuesta(respuesta):
+    """
+    Convierte la respuesta del extractor de filtros en un árbol de filtro.
+
+    Acepta {"filtro": árbol} y el formato simple {"valor": 50, "unidad": "km"}.
+    Devuelve None si la respuesta no contiene ningún filtro y lanza ValueError
+    si la respuesta no es un objeto JSON o el filtro no es válido.
+    """
+    if not respuesta:
+        return None
+    if not isinstance(respuesta, dict):
+        raise ValueError(f"Respuesta no válida: {respuesta!r}")
+    if 'filtro' in respuesta:
+        nodo = respuesta['filtro']
+        if not nodo:
+            return None
+        compilar_filtro(nodo)
+        return nodo
+    if 'valor' in respuesta and 'unidad' in respuesta:
+        campo = {'km': 'distancia', 'minutos': 'tiempo'}.get(respuesta['unidad']) if isinstance(respuesta['unidad'], str) else None
+        if campo is None:
+            raise ValueError(f"Unidad desconocida: {respuesta['unidad']!r}")
+        nodo = {'campo': campo, 'max': respuesta['valor']}
+        compilar_filtro(nodo)
+        return nodo
+    return None
+
+
+@functools.lru_cache(maxsize=256)
+def _compilar_json(texto):
+    return compilar_filtro(json.loads(texto))
+
+
+def posiciones_filtro(df, nodo, indice=None):
+    """
+    Posiciones de las filas de df que cumplen el árbol de filtro (todas si el
+    árbol está vacío). Cada árbol distinto se compila una sola vez. Si se pasa
+    el IndiceFiltros de df, los límites máximos de distancia o tiempo usan el
+    índice en lugar de recorrer las columnas.
+    """
+    if not nodo:
+        return np.arange(len(df))
+    # Se compila siempre, también para usar el índice: así se valida el árbol
+    compilado = _compilar_json(json.dumps(nodo, sort_keys=True))
+    campo = _normalizar(nodo.get('campo', ''))
+    if indice is not None and campo in CAMPOS_RANGO and nodo.get('min') is None and nodo.get('max') is not None:
+        limite = 'max_distancia' if campo == 'distancia' else 'max_tiempo'
+        return indice.filtrar(**{limite: _limite(nodo, 'max', None)})
+    return np.flatnonzero(compilado(df))
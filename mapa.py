@@ -0,0 +1,464 @@
+import time
+
+import folium
+import numpy as np
+import pandas as pd
+import streamlit as st
+from folium.plugins import FastMarkerCluster
+from streamlit_folium import st_folium
+
+from datos import hash_contenido
+from espacial import SANTIAGO, indice_espacial
+from metricas import medir
+
+# --- Modos de representación de los centros en el mapa ---
+MODO_AUTOMATICO = "Automático"
+MODO_MARCADORES = "Marcadores individuales"
+MODO_CLUSTER = "Agrupados (cluster)"
+MODO_CIRCULOS = "Círculos (canvas)"
+MODO_VISTA = "Solo la zona visible"
+MODOS = [MODO_AUTOMATICO, MODO_MARCADORES, MODO_CLUSTER, MODO_CIRCULOS, MODO_VISTA]
+
+# En modo automático, a partir de este número de centros se dejan de crear
+# marcadores individuales y se usa el cluster
+MAX_MARCADORES_INDIVIDUALES = 500
+
+# Función JavaScript que crea cada marcador del cluster a partir de una fila
+# [latitud, longitud, tooltip] de los datos
+CALLBACK_CLUSTER = """
+function (row) {
+    var marker = L.marker(new L.LatLng(row[0], row[1]));
+    marker.bindTooltip(row[2]);
+    return marker;
+};
+"""
+
+# --- Modo "Solo la zona visible" ---
+# Solo se envían al navegador los centros dentro de los límites que devuelve
+# st_folium. Por debajo de ZOOM_DETALLE, o si hay más de MAX_PUNTOS_VISTA
+# centros visibles, se envían recuentos agregados por celda o por concello.
+ZOOM_DETALLE = 12
+MAX_PUNTOS_VISTA = 1000
+# Tamaño aproximado en píxeles de cada celda de la rejilla de agregación
+PIXELES_CELDA = 64
+AGRUPAR_REJILLA = "Rejilla"
+AGRUPAR_CONCELLO = "Concello"
+AGRUPACIONES = [AGRUPAR_REJILLA, AGRUPAR_CONCELLO]
+
+# --- Vista previa de las cargas por bloques ---
+# Mientras se carga un CSV grande se muestra el recuento y un mapa con una
+# muestra de los centros leídos, actualizado como mucho cada tantos segundos
+INTERVALO_VISTA_PREVIA = 2.0
+MAX_PUNTOS_VISTA_PREVIA = 2000
+PUNTOS_POR_BLOQUE = 200
+
+# Mapas y capas construidos que se conservan en memoria, para todas las sesiones
+MAX_MAPAS_CACHE = 16
+
+
+def tooltips(df):
+    """
+    Genera el HTML del tooltip de cada centro con operaciones de texto vectorizadas.
+    Las distancias y tiempos que faltan se muestran como "?".
+    """
+    distancia = df['Distancia_Santiago_km'].round(1).astype(str).where(df['Distancia_Santiago_km'].notna(), '?')
+    tiempo = df['Tiempo_Santiago_min'].round(0).astype('Int64').astype(str).where(df['Tiempo_Santiago_min'].notna(), '?')
+    return (
+        '<b>' + df['Nome'].astype(str) + '</b><br>'
+        + 'Distancia: ' + distancia + ' km<br>'
+        + 'Tiempo: ' + tiempo + ' min'
+    )
+
+
+def puntos_mapa(df):
+    """
+    (latitud, longitud, tooltip) de cada centro, como tuplas de Python: los
+    datos de las capas sin objetos de folium, que se pueden cachear y
+    compartir entre sesiones porque dibujarlos no los modifica.
+    """
+    return tuple(zip(df['latitude'].tolist(), df['longitude'].tolist(), tooltips(df).tolist()))
+
+
+def capa_marcadores(puntos):
+    """
+    Un folium.Marker por centro. Solo adecuado para pocos centros.
+    """
+    capa = folium.FeatureGroup(name="Centros")
+    for lat, lon, tooltip in puntos:
+        folium.Marker(location=[lat, lon], tooltip=tooltip).add_to(capa)
+    return capa
+
+
+def capa_cluster(puntos):
+    """
+    Todos los centros en un único FastMarkerCluster. Los marcadores se crean
+    en el navegador a partir de un array de datos, sin un objeto Python por centro.
+    """
+    return FastMarkerCluster(list(puntos), callback=CALLBACK_CLUSTER, name="Centros")
+
+
+def capa_circulos(puntos):
+    """
+    Todos los centros como una FeatureCollection GeoJSON dibujada con
+    CircleMarkers sobre canvas, sin un nodo DOM por centro.
+    """
+    features = [
+        {
+            'type': 'Feature',
+            'geometry': {'type': 'Point', 'coordinates': [lon, lat]},
+            'properties': {'tooltip': tooltip},
+        }
+        for lat, lon, tooltip in puntos
+    ]
+    return folium.GeoJson(
+        {'type': 'FeatureCollection', 'features': features},
+        name="Centros",
+        marker=folium.CircleMarker(radius=5, weight=1, fill=True, fill_opacity=0.7),
+        tooltip=folium.GeoJsonTooltip(fields=['tooltip'], labels=False),
+    )
+
+
+def datos_mapa(df_filtrado, modo=MODO_AUTOMATICO):
+    """
+    Lo necesario para dibujar el mapa de los centros filtrados en el modo
+    indicado: una tupla (modo, centro, puntos), con modo None si no hay centros.
+    """
+    if df_filtrado.empty:
+        return None, tuple(SANTIAGO), ()
+
+    if modo == MODO_AUTOMATICO:
+        modo = MODO_MARCADORES if len(df_filtrado) <= MAX_MARCADORES_INDIVIDUALES else MODO_CLUSTER
+
+    # Centrar el mapa en la media de las coordenadas de los centros filtrados
+    centro = (df_filtrado['latitude'].mean(), df_filtrado['longitude'].mean())
+    return modo, centro, puntos_mapa(df_filtrado)
+
+
+def mapa_desde_datos(datos):
+    """
+    Crea un mapa de Folium nuevo a partir del resultado de datos_mapa.
+    """
+    modo, centro, puntos = datos
+    if modo is None:
+        # Si no hay centros filtrados, el mapa se centra en Santiago
+        return folium.Map(location=list(centro), zoom_start=8)
+
+    m = folium.Map(location=list(centro), zoom_start=8, prefer_canvas=(modo == MODO_CIRCULOS))
+    if modo == MODO_CLUSTER:
+        capa_cluster(puntos).add_to(m)
+    elif modo == MODO_CIRCULOS:
+        capa_circulos(puntos).add_to(m)
+    else:
+        capa_marcadores(puntos).add_to(m)
+    return m
+
+
+def crear_mapa(df_filtrado, modo=MODO_AUTOMATICO):
+    """
+    Crea el mapa de Folium con los centros filtrados en el modo indicado.
+    """
+    return mapa_desde_datos(datos_mapa(df_filtrado, modo))
+
+
+def marcar_origen(m, lat, lon, etiqueta):
+    """
+    Añade al mapa (o a una capa) un marcador rojo en el punto de origen de una búsqueda.
+    """
+    folium.Marker(location=[lat, lon], tooltip=etiqueta, icon=folium.Icon(color='red', icon='home')).add_to(m)
+    return m
+
+
+def vista_mapa(respuesta):
+    """
+    Extrae de la respuesta de st_folium la zona visible: un diccionario con
+    lat_min, lat_max, lon_min, lon_max, zoom y centro, o None si el mapa aún
+    no ha devuelto sus límites.
+    """
+    limites = (respuesta or {}).get('bounds') or {}
+    suroeste, noreste = limites.get('_southWest') or {}, limites.get('_northEast') or {}
+    if None in (suroeste.get('lat'), suroeste.get('lng'), noreste.get('lat'), noreste.get('lng')):
+        return None
+    centro = respuesta.get('center') or {}
+    return {
+        'lat_min': suroeste['lat'], 'lat_max': noreste['lat'],
+        'lon_min': suroeste['lng'], 'lon_max': noreste['lng'],
+        'zoom': int(respuesta.get('zoom') or 8),
+        'centro': [centro['lat'], centro['lng']] if 'lat' in centro else None,
+    }
+
+
+def agregar_rejilla(df, posiciones, zoom, max_grupos=MAX_PUNTOS_VISTA):
+    """
+    Recuento de centros por celda de una rejilla cuyo tamaño en grados
+    equivale a unos PIXELES_CELDA píxeles al nivel de zoom dado (o más, si
+    así salieran más de max_grupos celdas).
+
+    Devuelve (latitudes, longitudes, recuentos, etiquetas), con la posición
+    de cada grupo en la media de sus centros.
+    """
+    tamano = 360.0 / 2 ** zoom * PIXELES_CELDA / 256
+    lat = df['latitude'].to_numpy()[posiciones]
+    lon = df['longitude'].to_numpy()[posiciones]
+    while True:
+        celdas = np.floor(lat / tamano).astype(np.int64) * (1 << 32) + np.floor(lon / tamano).astype(np.int64)
+        _, grupo, recuentos = np.unique(celdas, return_inverse=True, return_counts=True)
+        # Si la caja es muy grande para el zoom, se agranda la celda
+        if len(recuentos) <= max_grupos:
+            break
+        tamano *= 2
+    lat_media = np.bincount(grupo, weights=lat) / recuentos
+    lon_media = np.bincount(grupo, weights=lon) / recuentos
+    etiquetas = [f"{n} centros" for n in recuentos.tolist()]
+    return lat_media, lon_media, recuentos, etiquetas
+
+
+def agregar_concello(df, posiciones):
+    """
+    Recuento de centros por concello, situado en la media de sus centros.
+
+    Devuelve (latitudes, longitudes, recuentos, etiquetas).
+    """
+    concellos = df['Concello'].astype('category').iloc[posiciones]
+    codigos = concellos.cat.codes.to_numpy()
+    validos = codigos >= 0
+    codigos = codigos[validos]
+    lat = df['latitude'].to_numpy()[posiciones][validos]
+    lon = df['longitude'].to_numpy()[posiciones][validos]
+    n_categorias = len(concellos.cat.categories)
+    recuentos = np.bincount(codigos, minlength=n_categorias)
+    presentes = np.flatnonzero(recuentos)
+    recuentos = recuentos[presentes]
+    lat_media = np.bincount(codigos, weights=lat, minlength=n_categorias)[presentes] / recuentos
+    lon_media = np.bincount(codigos, weights=lon, minlength=n_categorias)[presentes] / recuentos
+    nombres = concellos.cat.categories[presentes].astype(str).tolist()
+    etiquetas = [f"<b>{nombre}</b><br>{n} centros" for nombre, n in zip(nombres, recuentos.tolist())]
+    return lat_media, lon_media, recuentos, etiquetas
+
+
+def capa_agregada(lat, lon, recuentos, etiquetas):
+    """
+    Un CircleMarker por grupo, con radio creciente con el número de centros.
+    """
+    capa = folium.FeatureGroup(name="Centros")
+    radios = 6 + 4 * np.log10(np.maximum(recuentos, 1))
+    for la, lo, n, radio, etiqueta in zip(lat, lon, recuentos, radios.tolist(), etiquetas):
+        folium.CircleMarker(
+            location=[la, lo], radius=radio, weight=1, fill=True, fill_opacity=0.6,
+            tooltip=etiqueta, popup=f"{n} centros",
+        ).add_to(capa)
+    return capa
+
+
+def capa_puntos(puntos):
+    """
+    Un CircleMarker por centro, para los pocos centros de la zona visible.
+    """
+    capa = folium.FeatureGroup(name="Centros")
+    for lat, lon, tooltip in puntos:
+        folium.CircleMarker(location=[lat, lon], radius=5, weight=1, fill=True, fill_opacity=0.7, tooltip=tooltip).add_to(capa)
+    return capa
+
+
+def datos_vista(df, posiciones, zoom, agrupar=AGRUPAR_REJILLA):
+    """
+    Datos de la capa de los centros visibles: ('puntos', puntos) con zoom de
+    detalle y pocos centros, y ('grupos', (latitudes, longitudes, recuentos,
+    etiquetas)) con los recuentos agregados en otro caso.
+    """
+    if zoom >= ZOOM_DETALLE and len(posiciones) <= MAX_PUNTOS_VISTA:
+        return 'puntos', puntos_mapa(df.iloc[posiciones])
+    if agrupar == AGRUPAR_CONCELLO:
+        grupos = agregar_concello(df, posiciones)
+    else:
+        grupos = agregar_rejilla(df, posiciones, zoom)
+    return 'grupos', tuple(tuple(np.asarray(valores).tolist()) for valores in grupos)
+
+
+def capa_desde_datos_vista(datos):
+    """
+    Crea una capa nueva a partir del resultado de datos_vista.
+    """
+    tipo, valores = datos
+    return capa_puntos(valores) if tipo == 'puntos' else capa_agregada(*valores)
+
+
+def mapa_base():
+    """
+    Mapa vacío del modo de zona visible. Se crea de nuevo en cada ejecución
+    (st_folium le añade la capa dinámica), pero su HTML es siempre el mismo,
+    así que st_folium no lo vuelve a montar: los centros llegan como capa
+    dinámica (feature_group_to_add) y la vista se conserva entre ejecuciones.
+    """
+    return folium.Map(location=SANTIAGO, zoom_start=8, prefer_canvas=True)
+
+
+def _firma(*partes):
+    """
+    Clave corta que identifica un conjunto de posiciones y opciones del mapa.
+    """
+    return hash_contenido(b''.join(
+        p.tobytes() if isinstance(p, np.ndarray) else repr(p).encode('utf-8') for p in partes
+    ))
+
+
+def tamano_html(objeto):
+    """
+    Bytes del HTML de un mapa, o de un mapa base con la capa dada: una
+    estimación de lo que st_folium envía al navegador. Cuesta tanto como
+    renderizar el mapa, por lo que solo se calcula si se está midiendo.
+    """
+    if not isinstance(objeto, folium.Map):
+        m = mapa_base()
+        objeto.add_to(m)
+        objeto = m
+    return len(objeto.get_root().render().encode('utf-8'))
+
+
+@st.cache_resource(show_spinner=False, max_entries=MAX_MAPAS_CACHE)
+def _datos_cacheados(nombre, firma, _calcular):
+    """
+    Datos de un mapa o de una capa (ver datos_mapa y datos_vista),
+    compartidos por todas las sesiones del proceso. Los bytes del HTML se
+    guardan en la entrada la primera vez que se miden.
+    """
+    return {'datos': _calcular(), 'bytes': None}
+
+
+def _reutilizar(nombre, firma, calcular, construir, medir_bytes=False):
+    """
+    Construye un objeto de folium nuevo con construir(datos), donde los datos
+    se calculan con calcular() solo si no están ya en la caché para esta
+    firma. Así no se rehacen los tooltips y agregados en cada ejecución del
+    script si el conjunto filtrado es el mismo. Solo se cachean los datos:
+    st_folium modifica los objetos de folium que recibe, así que no se pueden
+    compartir entre sesiones. La caché es del proceso y tiene un tamaño máximo.
+
+    Devuelve una tupla (objeto, bytes), con bytes=None si no se ha medido.
+    """
+    entrada = _datos_cacheados(nombre, firma, calcular)
+    if medir_bytes and entrada['bytes'] is None:
+        entrada['bytes'] = tamano_html(construir(entrada['datos']))
+    return construir(entrada['datos']), entrada['bytes']
+
+
+def mostrar_mapa(df, posiciones, modo, clave, agrupar=AGRUPAR_REJILLA, origen=None,
+                 key="mapa", width=700, height=500, traza=None):
+    """
+    Dibuja con st_folium los centros de df en las posiciones indicadas.
+
+    clave identifica el conjunto de datos (ver datos.clave_datos) y origen es
+    una tupla opcional (lat, lon, etiqueta) que se marca en rojo. En el modo
+    de zona visible se consultan con el índice espacial solo los centros
+    dentro de los límites devueltos por el mapa en la ejecución anterior; en
+    los demás modos, mover el mapa no vuelve a ejecutar el script.
+
+    Si se pasa una traza (ver metricas.py), se miden la construcción del mapa
+    y st_folium y, si la traza está activa, los bytes del mapa.
+    """
+    posiciones = np.asarray(posiciones, dtype=np.int64)
+    medir_bytes = traza is not None and traza.activa
+
+    if modo != MODO_VISTA:
+        def construir(datos):
+            m = mapa_desde_datos(datos)
+            if origen is not None:
+                marcar_origen(m, *origen)
+            return m
+        with medir(traza, 'mapa'):
+            m, tamano = _reutilizar(
+                f"_{key}_objeto", _firma(clave, modo, posiciones),
+                lambda: datos_mapa(df.iloc[posiciones], modo), construir, medir_bytes,
+            )
+        if tamano is not None:
+            traza.anotar('mapa_bytes', tamano)
+        with medir(traza, 'st_folium'):
+            return st_folium(m, key=key, width=width, height=height, returned_objects=[])
+
+    vista = vista_mapa(st.session_state.get(f"{key}_vista"))
+    if vista is None:
+        # Primera ejecución: la vista por defecto del mapa base, centrada en
+        # los centros filtrados
+        lat = df['latitude'].to_numpy()[posiciones]
+        lon = df['longitude'].to_numpy()[posiciones]
+        centro = [float(lat.mean()), float(lon.mean())] if len(posiciones) else SANTIAGO
+        ancho_lat, ancho_lon = 180.0 * height / 256 / 2 ** 8, 360.0 * width / 256 / 2 ** 8
+        vista = {
+            'lat_min': centro[0] - ancho_lat / 2, 'lat_max': centro[0] + ancho_lat / 2,
+            'lon_min': centro[1] - ancho_lon / 2, 'lon_max': centro[1] + ancho_lon / 2,
+            'zoom': 8, 'centro': centro,
+        }
+
+    def calcular():
+        # Centros de la caja visible que además cumplen los filtros
+        en_caja = indice_espacial(clave, df).en_caja(vista['lat_min'], vista['lat_max'], vista['lon_min'], vista['lon_max'])
+        filtrados = np.zeros(len(df), dtype=bool)
+        filtrados[posiciones] = True
+        return datos_vista(df, en_caja[filtrados[en_caja]], vista['zoom'], agrupar)
+
+    def construir(datos):
+        capa = capa_desde_datos_vista(datos)
+        if origen is not None:
+            marcar_origen(capa, *origen)
+        return capa
+
+    caja = tuple(round(vista[c], 3) for c in ('lat_min', 'lat_max', 'lon_min', 'lon_max'))
+    with medir(traza, 'mapa'):
+        capa, tamano = _reutilizar(
+            f"_{key}_capa", _firma(clave, agrupar, caja, vista['zoom'], posiciones), calcular, construir, medir_bytes,
+        )
+    if tamano is not None:
+        traza.anotar('mapa_bytes', tamano)
+    with medir(traza, 'st_folium'):
+        return st_folium(
+            mapa_base(), key=f"{key}_vista", width=width, height=height,
+            center=vista['centro'], zoom=vista['zoom'], feature_group_to_add=capa,
+            returned_objects=['bounds', 'zoom', 'center'],
+        )
+
+
+class VistaPreviaCarga:
+    """
+    Progreso de una carga por bloques (ver datos.limpiar_por_bloques): se
+    llama con (almacen, df) tras cada bloque y dibuja en el contenedor (un
+    st.empty) el recuento y un mapa estático con una muestra de los centros.
+    """
+
+    def __init__(self, contenedor, intervalo=INTERVALO_VISTA_PREVIA, height=500):
+        self.contenedor = contenedor
+        self.intervalo = intervalo
+        self.height = height
+        self.ultima = None
+        self.muestras = []
+
+    def __call__(self, almacen, df):
+        # Unos pocos centros de cada bloque; si se acumulan demasiados, se
+        # descarta uno de cada dos
+        self.muestras.append(df.iloc[::max(1, len(df) // PUNTOS_POR_BLOQUE)])
+        if sum(len(m) for m in self.muestras) > MAX_PUNTOS_VISTA_PREVIA:
+            self.muestras = [m.iloc[::2] for m in self.muestras]
+
+        ahora = time.monotonic()
+        if self.ultima is not None and ahora - self.ultima < self.intervalo:
+            return
+        self.ultima = ahora
+        with self.contenedor.container():
+            st.caption(f"Cargando el archivo... {len(almacen):,} centros válidos leídos, {almacen.omitidas:,} filas omitidas.")
+            st.iframe(self.mapa(pd.concat(self.muestras)).get_root().render(), height=self.height)
+
+    @staticmethod
+    def mapa(muestra):
+        """
+        Mapa de la muestra, solo con puntos: el HTML se incrusta tal cual en
+        un iframe, así que no lleva textos del archivo subido.
+        """
+        m = folium.Map(location=SANTIAGO, zoom_start=7, prefer_canvas=True)
+        if not muestra.empty:
+            puntos = np.column_stack([muestra['longitude'].to_numpy(), muestra['latitude'].to_numpy()]).tolist()
+            folium.GeoJson(
+                {'type': 'MultiPoint', 'coordinates': puntos},
+                marker=folium.CircleMarker(radius=3, weight=0, fill=True, fill_opacity=0.6),
+            ).add_to(m)
+        return m
+
+    def terminar(self):
+        self.contenedor.empty()
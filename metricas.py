@@ -0,0 +1,221 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+import streamlit as st
+
+# --- Métricas de cada ejecución del script ---
+# Cada ejecución (rerun) de una página crea una Traza que mide lo que tarda
+# cada etapa. Al terminar, la traza se acumula en un registro compartido por
+# todas las sesiones del proceso y, si están configurados, se exporta:
+#   CENTROS_METRICAS_JSONL  fichero al que se añade una línea JSON por ejecución
+#   CENTROS_METRICAS_PROM   fichero de texto en formato Prometheus (para el
+#                           textfile collector de node_exporter), reescrito
+#                           en cada ejecución
+# El panel de depuración de la barra lateral se muestra con
+# CENTROS_DEPURACION=1 o con ?depuracion=1 en la URL.
+RUTA_JSONL = os.environ.get("CENTROS_METRICAS_JSONL")
+RUTA_PROMETHEUS = os.environ.get("CENTROS_METRICAS_PROM")
+DEPURACION = os.environ.get("CENTROS_DEPURACION") == "1"
+
+# Límites (en segundos) de los histogramas de tiempos
+LIMITES_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Límites (en bytes) del histograma del tamaño del mapa enviado al navegador
+LIMITES_BYTES = (1e4, 1e5, 1e6, 5e6, 1e7, 5e7, 1e8)
+
+
+class Histograma:
+    """
+    Histograma acumulado al estilo de Prometheus: recuento por límite, suma y total.
+    """
+
+    def __init__(self, limites):
+        self.limites = limites
+        self.cuentas = [0] * len(limites)
+        self.suma = 0.0
+        self.n = 0
+
+    def observar(self, valor):
+        for i, limite in enumerate(self.limites):
+            if valor <= limite:
+                self.cuentas[i] += 1
+        self.suma += valor
+        self.n += 1
+
+
+def _etiquetas(etiquetas):
+    if not etiquetas:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in sorted(etiquetas.items())) + '}'
+
+
+class RegistroMetricas:
+    """
+    Contadores, medidas e histogramas del proceso, seguros para usar desde
+    varios hilos (sesiones).
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.contadores = {}
+        self.medidas = {}
+        self.histogramas = {}
+
+    def incrementar(self, nombre, valor=1, **etiquetas):
+        clave = (nombre, _etiquetas(etiquetas))
+        with self.lock:
+            self.contadores[clave] = self.contadores.get(clave, 0) + valor
+
+    def fijar(self, nombre, valor, **etiquetas):
+        with self.lock:
+            self.medidas[(nombre, _etiquetas(etiquetas))] = valor
+
+    def observar(self, nombre, valor, limites=LIMITES_SEGUNDOS, **etiquetas):
+        clave = (nombre, _etiquetas(etiquetas))
+        with self.lock:
+            if clave not in self.histogramas:
+                self.histogramas[clave] = Histograma(limites)
+            self.histogramas[clave].observar(valor)
+
+    def a_prometheus(self):
+        """
+        Devuelve las métricas en el formato de texto de Prometheus.
+        """
+        lineas = []
+        with self.lock:
+            for tipo, valores in (('counter', self.contadores), ('gauge', self.medidas)):
+                for nombre in sorted({n for n, _ in valores}):
+                    lineas.append(f'# TYPE {nombre} {tipo}')
+                    lineas += [f'{n}{e} {v}' for (n, e), v in sorted(valores.items()) if n == nombre]
+            for nombre in sorted({n for n, _ in self.histogramas}):
+                lineas.append(f'# TYPE {nombre} histogram')
+                for (n, e), h in sorted(self.histogramas.items()):
+                    if n != nombre:
+                        continue
+                    base = e[1:-1] + ',' if e else ''
+                    for limite, cuenta in zip(h.limites, h.cuentas):
+                        lineas.append(f'{n}_bucket{{{base}le="{limite:g}"}} {cuenta}')
+                    lineas.append(f'{n}_bucket{{{base}le="+Inf"}} {h.n}')
+                    lineas.append(f'{n}_sum{e} {h.suma}')
+                    lineas.append(f'{n}_count{e} {h.n}')
+        return '\n'.join(lineas) + '\n'
+
+
+@st.cache_resource
+def registro_metricas():
+    """
+    Registro de métricas compartido por todas las sesiones del proceso.
+    """
+    return RegistroMetricas()
+
+
+def depuracion_activa():
+    """
+    Indica si se debe mostrar el panel de depuración en esta sesión.
+    """
+    return DEPURACION or st.query_params.get('depuracion') == '1'
+
+
+class Traza:
+    """
+    Tiempos de las etapas de una ejecución del script de una página.
+
+    Las medidas costosas (como el tamaño del mapa) solo se hacen si la traza
+    está activa, es decir, si se exporta o se muestra en el panel.
+    """
+
+    def __init__(self, pagina, registro=None, activa=None):
+        self.pagina = pagina
+        self.registro = registro
+        self.activa = activa if activa is not None else bool(RUTA_JSONL or RUTA_PROMETHEUS or depuracion_activa())
+        self.inicio = time.perf_counter()
+        self.etapas = {}
+        self.valores = {}
+
+    @contextmanager
+    def etapa(self, nombre):
+        """
+        Mide el bloque con el nombre dado. Si se repite, los tiempos se suman.
+        """
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.etapas[nombre] = self.etapas.get(nombre, 0.0) + time.perf_counter() - inicio
+
+    def transcurrido(self):
+        """
+        Segundos desde el inicio de la ejecución.
+        """
+        return time.perf_counter() - self.inicio
+
+    def anotar(self, nombre, valor):
+        """
+        Guarda un valor de la ejecución (filas procesadas, bytes del mapa...).
+        """
+        self.valores[nombre] = valor
+
+    def terminar(self):
+        """
+        Cierra la traza: la acumula en el registro y la exporta si procede.
+        Devuelve la duración total de la ejecución en segundos.
+        """
+        total = self.transcurrido()
+        registro = self.registro
+        if registro is not None:
+            registro.observar('centros_rerun_segundos', total, pagina=self.pagina)
+            registro.incrementar('centros_reruns_total', pagina=self.pagina)
+            for nombre, segundos in self.etapas.items():
+                registro.observar('centros_etapa_segundos', segundos, pagina=self.pagina, etapa=nombre)
+            if 'filas' in self.valores:
+                registro.incrementar('centros_filas_procesadas_total', self.valores['filas'], pagina=self.pagina)
+            if 'mapa_bytes' in self.valores:
+                registro.observar('centros_mapa_bytes', self.valores['mapa_bytes'], limites=LIMITES_BYTES, pagina=self.pagina)
+            if 'llm_segundos' in self.valores:
+                registro.observar('centros_llm_respuesta_segundos', self.valores['llm_segundos'], pagina=self.pagina)
+            if RUTA_PROMETHEUS:
+                _escribir_atomico(RUTA_PROMETHEUS, registro.a_prometheus())
+        if RUTA_JSONL:
+            linea = json.dumps({
+                'instante': time.time(), 'pagina': self.pagina, 'rerun_segundos': total,
+                'etapas': self.etapas, **self.valores,
+            }, default=float)
+            with _LOCK_JSONL, open(RUTA_JSONL, 'a', encoding='utf-8') as f:
+                f.write(linea + '\n')
+        self.total = total
+        return total
+
+
+_LOCK_JSONL = threading.Lock()
+
+
+def _escribir_atomico(ruta, texto):
+    temporal = f"{ruta}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temporal, 'w', encoding='utf-8') as f:
+        f.write(texto)
+    os.replace(temporal, ruta)
+
+
+def medir(traza, nombre):
+    """
+    traza.etapa(nombre), o un contexto vacío si no hay traza.
+    """
+    return traza.etapa(nombre) if traza is not None else nullcontext()
+
+
+def mostrar_panel(traza):
+    """
+    Muestra en la barra lateral los tiempos y valores de la última ejecución.
+    """
+    if not depuracion_activa():
+        return
+    with st.sidebar.expander("🔧 Depuración", expanded=True):
+        st.caption(f"Ejecución: {traza.total * 1000:.1f} ms")
+        st.table({
+            'etapa': list(traza.etapas),
+            'ms': [round(segundos * 1000, 2) for segundos in traza.etapas.values()],
+        })
+        if traza.valores:
+            st.json({nombre: valor for nombre, valor in traza.valores.items()})
@@ -0,0 +1,55 @@
+import argparse
+import json
+import random
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Servidor local que imita al modelo para probar el chatbot sin la API de
+# Gemini. Responde a POST {"prompt": ...} con {"text": <respuesta>}, donde la
+# respuesta es siempre la indicada con --respuesta (por defecto, {}). Las
+# consultas que llegan aquí son las que el parser local no resuelve, así que
+# una respuesta con un árbol de filtros permite probar ese camino y la caché.
+# Permite simular latencia y errores para comprobar los tiempos máximos y los
+# reintentos:
+#
+#   python modelo_falso.py --puerto 8765 --retardo 3 --errores 0.3 \
+#       --respuesta '{"filtro": {"campo": "provincia", "en": ["Lugo"]}}'
+#   LLM_URL=http://localhost:8765 streamlit run app-bot.py
+
+
+class ModeloFalso(BaseHTTPRequestHandler):
+    retardo = 0.0
+    errores = 0.0
+    respuesta = '{}'
+
+    def do_POST(self):
+        longitud = int(self.headers.get('Content-Length', 0))
+        self.rfile.read(longitud)
+
+        time.sleep(self.retardo)
+        if random.random() < self.errores:
+            self.send_error(503, "Error simulado")
+            return
+
+        cuerpo = json.dumps({"text": self.respuesta}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Servidor local que imita al modelo de filtros.")
+    parser.add_argument('--puerto', type=int, default=8765)
+    parser.add_argument('--retardo', type=float, default=0.0, help="Segundos de espera antes de responder")
+    parser.add_argument('--errores', type=float, default=0.0, help="Proporción de peticiones que fallan con 503")
+    parser.add_argument('--respuesta', type=json.loads, default={},
+                        help='JSON que se devuelve a todas las consultas, p. ej. \'{"filtro": {"campo": "distancia", "max": 50}}\'')
+    args = parser.parse_args()
+
+    ModeloFalso.retardo = args.retardo
+    ModeloFalso.errores = args.errores
+    ModeloFalso.respuesta = json.dumps(args.respuesta)
+    print(f"Modelo falso escuchando en http://localhost:{args.puerto}")
+    ThreadingHTTPServer(('', args.puerto), ModeloFalso).serve_forever()
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# Los módulos de la aplicación están en la raíz del repositorio, sin paquete
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+CSV_CENTROS = os.path.join(RAIZ, 'centros.csv')
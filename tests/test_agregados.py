@@ -0,0 +1,33 @@
+from agregados import LIMITES_DISTANCIA_KM, CuboAgregados
+from conftest import CSV_CENTROS
+from datos import leer_csv, limpiar_centros
+
+
+def _centros():
+    df, _ = limpiar_centros(leer_csv(CSV_CENTROS))
+    return df
+
+
+def test_resumen_en_el_maximo_del_slider():
+    df = _centros()
+    cubo = CuboAgregados.desde_dataframe(df)
+    for medida, columna in (('distancia', 'Distancia_Santiago_km'), ('tiempo', 'Tiempo_Santiago_min')):
+        # El slider empieza en el máximo de los datos
+        resumen = cubo.resumen(medida, float(df[columna].max()))
+        assert resumen['n'].sum() == len(df)
+
+
+def test_resumen_con_distancias_por_encima_del_ultimo_limite():
+    df = _centros()
+    # Datos de ámbito estatal: la mayoría de centros a más de 200 km
+    df = df.assign(Distancia_Santiago_km=df['Distancia_Santiago_km'] * 5)
+    cubo = CuboAgregados.desde_dataframe(df)
+    maximo = float(df['Distancia_Santiago_km'].max())
+    resumen = cubo.resumen('distancia', maximo)
+    assert resumen['n'].sum() == len(df)
+    assert (resumen['mediana'] <= maximo).all()
+
+    # Un límite exacto sigue sin incluir los centros por encima
+    limite = LIMITES_DISTANCIA_KM[-1]
+    esperado = df[df['Distancia_Santiago_km'] <= limite]['Provincia'].astype(str).value_counts()
+    assert cubo.resumen('distancia', limite)['n'].to_dict() == esperado.to_dict()
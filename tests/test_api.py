@@ -0,0 +1,93 @@
+import http.client
+import json
+import threading
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pytest
+
+from api import ServicioCentros, crear_servidor
+from conftest import CSV_CENTROS
+
+
+@pytest.fixture(scope='module')
+def servicio():
+    return ServicioCentros.desde_ruta(CSV_CENTROS)
+
+
+@pytest.fixture(scope='module')
+def puerto(servicio):
+    servidor = crear_servidor(servicio, 0, '127.0.0.1')
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    yield servidor.server_address[1]
+    servidor.shutdown()
+    servidor.server_close()
+
+
+def _post(puerto, ruta, cuerpo):
+    conexion = http.client.HTTPConnection('127.0.0.1', puerto, timeout=10)
+    try:
+        datos = cuerpo if isinstance(cuerpo, bytes) else json.dumps(cuerpo).encode('utf-8')
+        conexion.request('POST', ruta, body=datos, headers={'Content-Type': 'application/json'})
+        respuesta = conexion.getresponse()
+        return respuesta.status, json.loads(respuesta.read())
+    finally:
+        conexion.close()
+
+
+@pytest.mark.parametrize('cuerpo', [
+    b'{"limite": Infinity}',
+    b'{"max_distancia": NaN}',
+    {'columnas': [['x']]},
+    {'columnas': 'Nome'},
+    {'origen': {'lat': 42.9, 'lon': -8.5, 'k': 'diez'}},
+    {'formato': ['json']},
+    {'filtro': [1]},
+    {'filtro': {'campo': 'distancia', 'max': [1]}},
+])
+def test_consulta_no_valida(puerto, cuerpo):
+    estado, respuesta = _post(puerto, '/centros', cuerpo)
+    assert estado == 400
+    assert 'error' in respuesta
+
+
+def test_error_inesperado(puerto, servicio, monkeypatch):
+    def fallar(consulta):
+        raise RuntimeError("fallo interno")
+    monkeypatch.setattr(servicio, 'posiciones', fallar)
+    estado, respuesta = _post(puerto, '/centros', {'max_distancia': 20})
+    assert estado == 500
+    assert 'error' in respuesta
+
+
+def test_mas_cercanos_con_filtro(servicio):
+    # Los k más cercanos de entre los que cumplen el filtro, no los k más
+    # cercanos filtrados después
+    consulta = {'max_distancia': 60, 'origen': {'lat': 42.24, 'lon': -8.72, 'k': 10}}
+    n, df = servicio.consultar(consulta)
+    assert n == 10
+    assert (df['Distancia_Santiago_km'] <= 60).all()
+    _, todos = servicio.consultar({'max_distancia': 60, 'origen': {'lat': 42.24, 'lon': -8.72, 'radio_km': 1000}})
+    assert df['Código'].tolist() == todos['Código'].tolist()[:10]
+
+
+def test_lote(puerto, servicio):
+    consultas = [{'max_distancia': 20}, {'origen': {'lat': 42.88, 'lon': -8.54, 'k': 3}}]
+    estado, respuesta = _post(puerto, '/consultas', {'consultas': consultas})
+    assert estado == 200
+    assert [r['n'] for r in respuesta['resultados']] == [servicio.consultar(c)[0] for c in consultas]
+    assert len(respuesta['resultados'][1]['centros']) == 3
+
+
+def test_formatos(servicio):
+    consulta = {'max_distancia': 30, 'origen': {'lat': 42.88, 'lon': -8.54, 'radio_km': 20}}
+    n, df = servicio.consultar(consulta)
+    centros = json.loads(servicio.responder([consulta], 'json'))['resultados'][0]
+    geojson = json.loads(servicio.responder([consulta], 'geojson'))['resultados'][0]
+    tabla = pa.ipc.open_stream(servicio.responder([consulta, {}], 'arrow')).read_all()
+    assert centros['n'] == geojson['n'] == n
+    assert [c['Código'] for c in centros['centros']] == df['Código'].tolist()
+    assert [f['properties']['Código'] for f in geojson['features']] == df['Código'].tolist()
+    assert geojson['features'][0]['geometry']['coordinates'] == [df['longitude'].iloc[0], df['latitude'].iloc[0]]
+    assert tabla.filter(pc.equal(tabla['consulta'], 0))['Código'].to_pylist() == df['Código'].tolist()
+    assert tabla.num_rows == n + len(servicio.df)
@@ -0,0 +1,23 @@
+import numpy as np
+import pandas as pd
+
+from calidad import intercambiadas
+from datos import DATOS_EJEMPLO, limpiar_centros
+
+
+def test_intercambiadas():
+    x = np.array([42.88, -8.54, -9.60, 150.0, 42.88])
+    y = np.array([-8.54, 42.88, 42.50, 42.0, -9.60])
+    # Dentro de la caja, intercambiada dentro de la caja, intercambiada justo
+    # fuera de la caja, x que no es una latitud, sin intercambiar fuera de la caja
+    assert intercambiadas(x, y).tolist() == [False, True, True, True, False]
+
+
+def test_intercambiada_fuera_de_galicia_se_corrige():
+    df = pd.DataFrame(DATOS_EJEMPLO).astype({'Código': str})
+    # Centro A con las coordenadas intercambiadas y la longitud al oeste de la caja
+    df.loc[0, ['COORDENADA_X', 'COORDENADA_Y']] = [-9.60, 42.90]
+    limpio, informe = limpiar_centros(df)
+    assert limpio.loc[0, ['latitude', 'longitude']].tolist() == [42.90, -9.60]
+    assert informe.intercambiadas == 2
+    assert informe.recuento('fuera_de_galicia') == 1
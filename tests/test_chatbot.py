@@ -0,0 +1,110 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from chatbot import CacheTTL, ClienteLLM, filtros_locales, parsear_consulta
+from filtros import filtro_desde_respuesta
+
+CONSULTA = "centros cerca del mar"
+MAL_FORMADA = {'valor': 'cincuenta', 'unidad': 'km'}
+
+
+@pytest.mark.parametrize('consulta, esperado', [
+    ("a 50 km", {'valor': 50, 'unidad': 'km'}),
+    ("A menos de 40 minutos.", {'valor': 40, 'unidad': 'minutos'}),
+    ("menos de 12,5 kilómetros", {'valor': 12.5, 'unidad': 'km'}),
+    ("1,5 horas", {'valor': 90, 'unidad': 'minutos'}),
+    ("Muestra los centros a 50 km de Santiago.", {'valor': 50, 'unidad': 'km'}),
+    ("Quiero ver los centros a 45 minutos de Santiago.", {'valor': 45, 'unidad': 'minutos'}),
+    ("centros a 50 km", {'valor': 50, 'unidad': 'km'}),
+    ("Muéstrame centros a menos de 2 h de Santiago de Compostela", {'valor': 120, 'unidad': 'minutos'}),
+])
+def test_parser_local(consulta, esperado):
+    assert parsear_consulta(consulta) == esperado
+
+
+@pytest.mark.parametrize('consulta', [
+    "Centros públicos de Lugo u Ourense a menos de 60 minutos.",
+    "IES entre 20 y 50 km que no estén en Vigo",
+    "a más de 30 km",
+    "1,5 horas de Vigo",
+    "a 50 km y 30 minutos",
+    "centros a más de 30 km de Santiago",
+    "Muestra los centros a 50 km de Lugo.",
+    "centros entre 20 y 50 km",
+    "Filtra por 100.",
+])
+def test_parser_local_deja_al_modelo_el_resto(consulta):
+    assert parsear_consulta(consulta) is None
+
+
+def test_cliente_no_cachea_respuestas_no_validas():
+    cache = CacheTTL()
+    cliente = ClienteLLM(lambda query: MAL_FORMADA, reintentos=0)
+    # La caché se actualiza antes de que termine el futuro
+    assert cliente.enviar(CONSULTA, cache, validar=filtro_desde_respuesta).result(timeout=5) == MAL_FORMADA
+    assert filtros_locales(CONSULTA, cache) is None
+
+    cliente = ClienteLLM(lambda query: {'valor': 50, 'unidad': 'km'}, reintentos=0)
+    cliente.enviar(CONSULTA, cache, validar=filtro_desde_respuesta).result(timeout=5)
+    # Las consultas repetidas se resuelven con la caché, sin llamar al modelo
+    assert filtros_locales(CONSULTA.upper() + ".", cache) == {'valor': 50, 'unidad': 'km'}
+
+
+def test_llamadas_lentas_respetan_la_concurrencia():
+    activas, maximo, lock = [0], [0], threading.Lock()
+    liberar = threading.Event()
+
+    def modelo_lento(query):
+        with lock:
+            activas[0] += 1
+            maximo[0] = max(maximo[0], activas[0])
+        liberar.wait(5)
+        with lock:
+            activas[0] -= 1
+        return {}
+
+    cliente = ClienteLLM(modelo_lento, timeout=0.2, concurrencia=2, reintentos=0)
+    futuros = [cliente.enviar(f"consulta {i}") for i in range(6)]
+    for futuro in futuros[:2]:
+        with pytest.raises(TimeoutError):
+            futuro.result(timeout=5)
+    # Las llamadas que agotaron el tiempo siguen en marcha y ocupan su plaza
+    time.sleep(0.3)
+    assert activas[0] == 2 and maximo[0] == 2
+    liberar.set()
+    for futuro in futuros[2:]:
+        futuro.exception(timeout=5)
+    assert maximo[0] == 2
+
+
+def test_corrutinas_lentas_respetan_la_concurrencia():
+    activas, maximo, lock = [0], [0], threading.Lock()
+    liberar = threading.Event()
+
+    def llamada_bloqueante():
+        with lock:
+            activas[0] += 1
+            maximo[0] = max(maximo[0], activas[0])
+        liberar.wait(5)
+        with lock:
+            activas[0] -= 1
+        return {}
+
+    async def modelo_lento(query):
+        return await asyncio.to_thread(llamada_bloqueante)
+
+    cliente = ClienteLLM(modelo_lento, timeout=0.2, concurrencia=2, reintentos=0)
+    futuros = [cliente.enviar(f"consulta {i}") for i in range(6)]
+    for futuro in futuros[:2]:
+        with pytest.raises(TimeoutError):
+            futuro.result(timeout=5)
+    # El hilo de asyncio.to_thread sigue en marcha y su llamada ocupa la plaza
+    time.sleep(0.3)
+    assert activas[0] == 2 and maximo[0] == 2
+    liberar.set()
+    for futuro in futuros[2:]:
+        futuro.exception(timeout=5)
+    assert maximo[0] == 2
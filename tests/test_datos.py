@@ -0,0 +1,81 @@
+import io
+
+import pytest
+
+import datos
+from conftest import CSV_CENTROS
+from datos import cargar_archivo, leer_csv, limpiar_centros, limpiar_por_bloques, snapshot_a_bytes
+
+# Fila de centros.csv sin ningún valor numérico válido: limpiar_centros la elimina
+FILA_INVALIDA = 'X{},Centro,Rúa,Betanzos,A Coruña,15300,981000000,IES,ERROR,ERROR,Pública,Non,Si,ERROR,ERROR\n'
+
+
+def _csv_centros():
+    with open(CSV_CENTROS, 'rb') as f:
+        return f.read()
+
+
+def test_bloque_sin_filas_validas():
+    # Los últimos bloques solo tienen filas inválidas
+    contenido = _csv_centros() + ''.join(FILA_INVALIDA.format(i) for i in range(2000)).encode('utf-8')
+    df, informe = limpiar_por_bloques(io.BytesIO(contenido), tamano_bloque=4096)
+    esperado, informe_esperado = limpiar_centros(leer_csv(io.BytesIO(_csv_centros())))
+    assert len(df) == len(esperado)
+    assert informe.recuento('valores_nulos') == informe_esperado.recuento('valores_nulos') + 2000
+    assert df['Provincia'].dtype == 'category'
+
+
+def test_todos_los_bloques_sin_filas_validas():
+    cabecera = _csv_centros().split(b'\n', 1)[0] + b'\n'
+    contenido = cabecera + ''.join(FILA_INVALIDA.format(i) for i in range(500)).encode('utf-8')
+    df, informe = limpiar_por_bloques(io.BytesIO(contenido), tamano_bloque=4096)
+    assert df.empty
+    assert informe.recuento('valores_nulos') == 500
+
+
+def test_codigos_vacios_no_son_repetidos_entre_bloques():
+    lineas = _csv_centros().decode('utf-8').splitlines(keepends=True)
+    # Se vacía el código de cinco filas repartidas por varios bloques
+    for i in range(1, len(lineas), len(lineas) // 5)[:5]:
+        lineas[i] = ',' + lineas[i].split(',', 1)[1]
+    contenido = ''.join(lineas).encode('utf-8')
+    _, informe = limpiar_por_bloques(io.BytesIO(contenido), tamano_bloque=4096)
+    _, informe_esperado = limpiar_centros(leer_csv(io.BytesIO(contenido)))
+    assert informe.recuento('codigo_duplicado') == informe_esperado.recuento('codigo_duplicado')
+
+
+class _ArchivoSubido:
+    def __init__(self, nombre, contenido):
+        self.name = nombre
+        self._contenido = contenido
+
+    def getvalue(self):
+        return self._contenido
+
+
+def test_carga_pequena_con_filas_mal_formadas(monkeypatch):
+    lineas = _csv_centros().splitlines(keepends=True)
+    # Una fila con dos campos de más y otra con uno de menos
+    lineas.insert(5, b'1,2,3,4,5,6,7,8,9,10,11,12,13,14,15,16,17\n')
+    lineas.insert(9, b'1,2,3\n')
+    contenido = b''.join(lineas)
+
+    df, informe = cargar_archivo(_ArchivoSubido('centros.csv', contenido))
+    assert informe.mal_formadas == 2
+    assert len(df) == len(limpiar_centros(leer_csv(io.BytesIO(_csv_centros())))[0])
+
+    # Por encima del umbral el informe es el mismo
+    monkeypatch.setattr(datos, 'UMBRAL_CARGA_POR_BLOQUES', 0)
+    grande, informe_grande = cargar_archivo(_ArchivoSubido('centros.csv', contenido + b'\n'))
+    assert informe_grande.mal_formadas == 2
+    assert len(grande) == len(df)
+
+
+@pytest.mark.parametrize('formato', ['arrow', 'parquet'])
+def test_snapshot_sin_columnas_obligatorias(formato):
+    df, _ = limpiar_centros(leer_csv(CSV_CENTROS))
+    contenido = snapshot_a_bytes(df.drop(columns=['Distancia_Santiago_km', 'Tiempo_Santiago_min']), formato)
+    with pytest.raises(ValueError, match='Distancia_Santiago_km'):
+        cargar_archivo(_ArchivoSubido(f'centros.{formato}', contenido))
+    completo, _ = cargar_archivo(_ArchivoSubido(f'centros.{formato}', snapshot_a_bytes(df, formato)))
+    assert len(completo) == len(df)
@@ -0,0 +1,50 @@
+import warnings
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from espacial import SANTIAGO, IndiceEspacial, haversine_km
+
+
+@pytest.fixture(scope='module')
+def df():
+    generador = np.random.default_rng(0)
+    return pd.DataFrame({
+        'latitude': generador.uniform(41.8, 43.8, 2000),
+        'longitude': generador.uniform(-9.3, -6.7, 2000),
+    })
+
+
+def test_en_radio_igual_que_fuerza_bruta(df):
+    indice = IndiceEspacial(df)
+    distancias = haversine_km(*SANTIAGO, df['latitude'], df['longitude']).to_numpy()
+    for radio in (0.5, 10, 80, 300):
+        posiciones, _ = indice.en_radio(*SANTIAGO, radio)
+        assert np.array_equal(np.sort(posiciones), np.flatnonzero(distancias <= radio))
+
+
+@pytest.mark.parametrize('radio', [1e6, 1e300, np.inf])
+def test_radio_enorme_devuelve_todos(df, radio):
+    indice = IndiceEspacial(df)
+    with warnings.catch_warnings():
+        warnings.simplefilter('error', RuntimeWarning)
+        posiciones, distancias = indice.en_radio(*SANTIAGO, radio)
+    assert len(posiciones) == len(df)
+    assert np.all(np.diff(distancias) >= 0)
+
+
+def test_mas_cercanos_todos(df):
+    posiciones, _ = IndiceEspacial(df).mas_cercanos(*SANTIAGO, 10 * len(df))
+    assert len(posiciones) == len(df)
+
+
+def test_mas_cercanos_entre_los_marcados(df):
+    generador = np.random.default_rng(1)
+    mascara = generador.random(len(df)) < 0.2
+    distancias = haversine_km(*SANTIAGO, df['latitude'], df['longitude']).to_numpy()
+    marcados = np.flatnonzero(mascara)
+    esperado = marcados[np.argsort(distancias[marcados], kind='stable')]
+    for k in (1, 10, 50, 10 * len(df)):
+        posiciones, _ = IndiceEspacial(df).mas_cercanos(*SANTIAGO, k, mascara=mascara)
+        assert np.array_equal(posiciones, esperado[:k])
@@ -0,0 +1,65 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import CSV_CENTROS
+from datos import leer_csv, limpiar_centros
+from filtros import IndiceFiltros, compilar_filtro, filtro_desde_respuesta, posiciones_filtro
+
+
+@pytest.mark.parametrize('respuesta', [
+    {'valor': 'cincuenta', 'unidad': 'km'},
+    {'valor': 50, 'unidad': 'leguas'},
+    {'filtro': {'campo': 'color', 'igual': 'azul'}},
+    {'filtro': 5},
+    {'filtro': {'campo': 'distancia', 'max': [1]}},
+    {'filtro': {'campo': 'tiempo', 'min': {'valor': 10}}},
+    {'filtro': {'campo': 'provincia', 'en': [['Lugo']]}},
+    {'valor': [50], 'unidad': 'km'},
+    {'valor': 50, 'unidad': ['km']},
+    5,
+    'filtro',
+    ['filtro'],
+])
+def test_respuesta_mal_formada(respuesta):
+    with pytest.raises(ValueError):
+        filtro_desde_respuesta(respuesta)
+
+
+def test_respuesta_simple():
+    assert filtro_desde_respuesta({'valor': 50, 'unidad': 'km'}) == {'campo': 'distancia', 'max': 50}
+    assert filtro_desde_respuesta({'valor': '40', 'unidad': 'minutos'}) == {'campo': 'tiempo', 'max': '40'}
+    assert filtro_desde_respuesta({}) is None
+
+
+def test_posiciones_con_y_sin_indice():
+    df, _ = limpiar_centros(leer_csv(CSV_CENTROS))
+    indice = IndiceFiltros(df)
+    for nodo in ({'campo': 'distancia', 'max': 50}, {'campo': 'tiempo', 'max': 30}):
+        mascara = compilar_filtro(nodo)(df)
+        assert np.array_equal(posiciones_filtro(df, nodo, indice), np.flatnonzero(mascara))
+    nodo = {'y': [{'campo': 'provincia', 'en': ['lugo']}, {'no': {'campo': 'tipo', 'igual': 'IES'}}]}
+    esperado = (df['Provincia'] == 'Lugo') & (df['Tipo de centro'] != 'IES')
+    assert np.array_equal(posiciones_filtro(df, nodo, indice), np.flatnonzero(esperado))
+
+
+def test_filtrar_igual_que_fuerza_bruta():
+    generador = np.random.default_rng(0)
+    df = pd.DataFrame({
+        'Distancia_Santiago_km': generador.integers(0, 50, 500).astype(float),
+        'Tiempo_Santiago_min': generador.integers(0, 60, 500).astype(float),
+    })
+    indice = IndiceFiltros(df)
+    distancias, tiempos = df['Distancia_Santiago_km'].to_numpy(), df['Tiempo_Santiago_min'].to_numpy()
+    # Incluye límites por debajo del mínimo (prefijo vacío) y por encima del máximo (todas las filas)
+    limites_distancia = [None, -1, 100] + generador.uniform(-5, 55, 20).tolist()
+    limites_tiempo = [None, -1, 100] + generador.uniform(-5, 65, 20).tolist()
+    for max_distancia in limites_distancia:
+        for max_tiempo in limites_tiempo:
+            esperado = np.ones(len(df), dtype=bool)
+            if max_distancia is not None:
+                esperado &= distancias <= max_distancia
+            if max_tiempo is not None:
+                esperado &= tiempos <= max_tiempo
+            posiciones = indice.filtrar(max_distancia=max_distancia, max_tiempo=max_tiempo)
+            assert np.array_equal(posiciones, np.flatnonzero(esperado))
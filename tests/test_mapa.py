@@ -0,0 +1,32 @@
+import numpy as np
+import pandas as pd
+
+from datos import cargar_ejemplo
+from mapa import MODO_CLUSTER, _reutilizar, datos_mapa, mapa_desde_datos, puntos_mapa, tooltips
+
+
+def test_cada_ejecucion_dibuja_un_mapa_nuevo():
+    df, _ = cargar_ejemplo()
+    llamadas = []
+
+    def calcular():
+        llamadas.append(1)
+        return datos_mapa(df, MODO_CLUSTER)
+
+    primero, _ = _reutilizar('_prueba_mapa', 'firma', calcular, mapa_desde_datos)
+    primero.get_root().render()
+    segundo, tamano = _reutilizar('_prueba_mapa', 'firma', calcular, mapa_desde_datos, medir_bytes=True)
+    # Los datos se calculan una vez; los objetos de folium no se comparten
+    assert len(llamadas) == 1
+    assert primero is not segundo
+    assert tamano > 0
+    assert datos_mapa(df, MODO_CLUSTER)[2] == puntos_mapa(df)
+    assert np.isclose(segundo.location[0], df['latitude'].mean())
+
+
+def test_tooltips_sin_distancia_ni_tiempo():
+    df = pd.DataFrame({'Nome': ['A', 'B'], 'Distancia_Santiago_km': [12.34, np.nan], 'Tiempo_Santiago_min': [np.nan, 20.0]})
+    assert tooltips(df).tolist() == [
+        '<b>A</b><br>Distancia: 12.3 km<br>Tiempo: ? min',
+        '<b>B</b><br>Distancia: ? km<br>Tiempo: 20 min',
+    ]
@@ -0,0 +1,36 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from datos import cargar_ejemplo
+from tiempos import MatrizTiempos, datos_desde_origen, guardar_matriz
+
+
+@pytest.fixture
+def ruta(tmp_path):
+    origenes = pd.DataFrame({'nombre': ['Lugo', 'Vigo'], 'latitude': [43.01, 42.24], 'longitude': [-7.56, -8.72]})
+    # El código 'B' está repetido: cuenta su primera columna
+    codigos = ['A', 'B', 'C', 'B']
+    distancias = np.array([[1, 2, 3, 4], [10, 20, 30, 40]], dtype=np.float32)
+    guardar_matriz(str(tmp_path), origenes, codigos, distancias, distancias * 2)
+    return str(tmp_path)
+
+
+def test_desde(ruta):
+    matriz = MatrizTiempos(ruta)
+    assert matriz.nombres() == ['Lugo', 'Vigo']
+    distancias, tiempos = matriz.desde('Vigo', ['C', 'B', 'X', 'A'])
+    np.testing.assert_array_equal(distancias, [30, 20, np.nan, 10])
+    np.testing.assert_array_equal(tiempos, [60, 40, np.nan, 20])
+    assert matriz.contiene(['X', 'C'])
+    assert not matriz.contiene(['X', 'Y'])
+
+
+def test_centros_fuera_de_la_matriz(ruta):
+    df, _ = cargar_ejemplo()
+    df = df.assign(**{'Código': ['A', 'C'] + [f'X{i}' for i in range(len(df) - 2)]})
+    desde_lugo = datos_desde_origen('ejemplo', ruta, 'Lugo', df)
+    assert desde_lugo['Código'].tolist() == ['A', 'C']
+    assert desde_lugo['Distancia_Santiago_km'].tolist() == [1, 3]
+    assert desde_lugo['Tiempo_Santiago_min'].tolist() == [2, 6]
+
@@ -0,0 +1,351 @@
+import argparse
+import heapq
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from datos import con_clave, guardar_snapshot, leer_csv, limpiar_centros
+from espacial import SANTIAGO, IndiceEspacial, haversine_km
+
+# --- Matriz de distancias y tiempos origen → centro ---
+# La matriz se guarda como un directorio con arrays .npy que se mapean en
+# memoria al cargarlos, de forma que consultar un origen no lee el resto:
+#   origenes.json   nombres y coordenadas de los orígenes (una fila por origen)
+#   codigos.npy     'Código' de cada centro (una columna por centro)
+#   distancias.npy  float32 [origen, centro] en km
+#   tiempos.npy     float32 [origen, centro] en minutos
+ARCHIVO_ORIGENES = 'origenes.json'
+ARCHIVO_CODIGOS = 'codigos.npy'
+ARCHIVO_DISTANCIAS = 'distancias.npy'
+ARCHIVO_TIEMPOS = 'tiempos.npy'
+
+# Valores por defecto del enrutador estimado cuando no se pueden calibrar
+FACTOR_RODEO = 1.3  # km por carretera / km en línea recta
+VELOCIDAD_KM_MIN = 1.2  # 72 km/h
+
+# Velocidad para el tramo desde un centro hasta el nodo más cercano del grafo
+VELOCIDAD_ACCESO_KM_MIN = 0.5  # 30 km/h
+
+
+class EnrutadorEstimado:
+    """
+    Sustituto local de un servicio de rutas: distancia en línea recta por un
+    factor de rodeo y tiempo a velocidad media constante.
+    """
+
+    def __init__(self, factor_rodeo=FACTOR_RODEO, velocidad_km_min=VELOCIDAD_KM_MIN):
+        self.factor_rodeo = factor_rodeo
+        self.velocidad_km_min = velocidad_km_min
+
+    @classmethod
+    def calibrar(cls, df):
+        """
+        Ajusta el factor de rodeo y la velocidad con las filas que ya tienen
+        distancia y tiempo a Santiago.
+        """
+        validas = df.dropna(subset=['Distancia_Santiago_km', 'Tiempo_Santiago_min'])
+        recta = haversine_km(SANTIAGO[0], SANTIAGO[1], validas['latitude'].to_numpy(), validas['longitude'].to_numpy())
+        carretera = validas['Distancia_Santiago_km'].to_numpy()
+        minutos = validas['Tiempo_Santiago_min'].to_numpy()
+        # Los centros muy cercanos a Santiago dan cocientes poco fiables
+        lejanos = (recta > 5) & (minutos > 0)
+        if not lejanos.any():
+            return cls()
+        return cls(
+            factor_rodeo=float(np.median(carretera[lejanos] / recta[lejanos])),
+            velocidad_km_min=float(np.median(carretera[lejanos] / minutos[lejanos])),
+        )
+
+    def preparar(self, lat_centros, lon_centros):
+        """
+        No necesita preparar nada sobre los centros.
+        """
+
+    def desde(self, lat, lon, lat_centros, lon_centros):
+        """
+        Devuelve (distancias_km, tiempos_min) desde un origen a todos los centros.
+        """
+        distancias = haversine_km(lat, lon, lat_centros, lon_centros) * self.factor_rodeo
+        return distancias, distancias / self.velocidad_km_min
+
+
+class EnrutadorGrafo:
+    """
+    Rutas sobre un grafo de carreteras leído de un CSV de tramos con las
+    columnas origen_lat, origen_lon, destino_lat, destino_lon, km y minutos.
+    Los tramos se consideran de doble sentido.
+
+    Cada origen y cada centro se une a su nodo más cercano del grafo, y desde
+    el nodo del origen se calcula el camino más rápido a todos los nodos
+    (Dijkstra).
+    """
+
+    def __init__(self, ruta_tramos):
+        tramos = pd.read_csv(ruta_tramos)
+        extremos = np.concatenate([
+            tramos[['origen_lat', 'origen_lon']].to_numpy(),
+            tramos[['destino_lat', 'destino_lon']].to_numpy(),
+        ])
+        nodos, ids = np.unique(extremos, axis=0, return_inverse=True)
+        ids = ids.reshape(-1)
+        self.indice = IndiceEspacial(pd.DataFrame(nodos, columns=['latitude', 'longitude']))
+        self.centros = None
+
+        self.vecinos = [[] for _ in range(len(nodos))]
+        n_tramos = len(tramos)
+        for a, b, km, minutos in zip(ids[:n_tramos], ids[n_tramos:], tramos['km'], tramos['minutos']):
+            self.vecinos[a].append((b, float(km), float(minutos)))
+            self.vecinos[b].append((a, float(km), float(minutos)))
+
+    def _nodo_mas_cercano(self, lat, lon):
+        posiciones, distancias = self.indice.mas_cercanos(lat, lon, 1)
+        return posiciones[0], distancias[0]
+
+    def preparar(self, lat_centros, lon_centros):
+        """
+        Une cada centro a su nodo más cercano. Se hace una vez por bloque de
+        orígenes en lugar de una vez por origen.
+        """
+        nodos, accesos = np.zeros(len(lat_centros), dtype=np.int64), np.zeros(len(lat_centros))
+        for i, (lat, lon) in enumerate(zip(lat_centros, lon_centros)):
+            nodos[i], accesos[i] = self._nodo_mas_cercano(lat, lon)
+        self.centros = (nodos, accesos)
+
+    def _dijkstra(self, inicio):
+        """
+        Minutos y km del camino más rápido desde el nodo inicio a cada nodo.
+        """
+        minutos = np.full(len(self.vecinos), np.inf)
+        km = np.full(len(self.vecinos), np.inf)
+        minutos[inicio], km[inicio] = 0.0, 0.0
+        pendientes = [(0.0, inicio)]
+        while pendientes:
+            t, nodo = heapq.heappop(pendientes)
+            if t > minutos[nodo]:
+                continue
+            for vecino, tramo_km, tramo_min in self.vecinos[nodo]:
+                nuevo = t + tramo_min
+                if nuevo < minutos[vecino]:
+                    minutos[vecino] = nuevo
+                    km[vecino] = km[nodo] + tramo_km
+                    heapq.heappush(pendientes, (nuevo, vecino))
+        return km, minutos
+
+    def desde(self, lat, lon, lat_centros, lon_centros):
+        """
+        Devuelve (distancias_km, tiempos_min) desde un origen a todos los centros.
+        Los centros no conectados con el origen quedan como NaN.
+        """
+        if self.centros is None:
+            self.preparar(lat_centros, lon_centros)
+        nodos_centros, accesos = self.centros
+
+        nodo_origen, acceso_origen = self._nodo_mas_cercano(lat, lon)
+        km, minutos = self._dijkstra(nodo_origen)
+
+        acceso = acceso_origen + accesos
+        distancias = km[nodos_centros] + acceso
+        tiempos = minutos[nodos_centros] + acceso / VELOCIDAD_ACCESO_KM_MIN
+        distancias[~np.isfinite(distancias)] = np.nan
+        tiempos[~np.isfinite(tiempos)] = np.nan
+        return distancias, tiempos
+
+
+def _calcular_bloque(enrutador, origenes, lat_centros, lon_centros):
+    """
+    Calcula las filas de la matriz de un bloque de orígenes (en un proceso del pool).
+    """
+    enrutador.preparar(lat_centros, lon_centros)
+    filas = [enrutador.desde(lat, lon, lat_centros, lon_centros) for lat, lon in origenes]
+    distancias = np.array([d for d, _ in filas], dtype=np.float32).reshape(len(filas), len(lat_centros))
+    tiempos = np.array([t for _, t in filas], dtype=np.float32).reshape(len(filas), len(lat_centros))
+    return distancias, tiempos
+
+
+def origenes_concellos(df):
+    """
+    Un origen por Concello, situado en la posición media de sus centros como
+    aproximación a la capitalidad municipal.
+    """
+    centroides = df.groupby('Concello', observed=True)[['latitude', 'longitude']].mean()
+    return pd.DataFrame({
+        'nombre': centroides.index.astype(str),
+        'latitude': centroides['latitude'].to_numpy(),
+        'longitude': centroides['longitude'].to_numpy(),
+    })
+
+
+def calcular_matriz(df, origenes, enrutador, procesos=None, bloque=16):
+    """
+    Calcula las matrices de distancias y tiempos de todos los orígenes a todos
+    los centros de df, repartiendo los orígenes en bloques entre un pool de
+    procesos. Devuelve (distancias, tiempos) como arrays float32.
+    """
+    lat_centros = df['latitude'].to_numpy(dtype='float64')
+    lon_centros = df['longitude'].to_numpy(dtype='float64')
+    puntos = list(zip(origenes['latitude'], origenes['longitude']))
+    bloques = [puntos[i:i + bloque] for i in range(0, len(puntos), bloque)]
+
+    with ProcessPoolExecutor(max_workers=procesos) as pool:
+        resultados = list(pool.map(
+            _calcular_bloque,
+            [enrutador] * len(bloques), bloques,
+            [lat_centros] * len(bloques), [lon_centros] * len(bloques),
+        ))
+
+    if not resultados:
+        vacia = np.empty((0, len(df)), dtype=np.float32)
+        return vacia, vacia.copy()
+    return np.vstack([d for d, _ in resultados]), np.vstack([t for _, t in resultados])
+
+
+def guardar_matriz(ruta, origenes, codigos, distancias, tiempos):
+    """
+    Guarda la matriz en el directorio ruta (ver el formato más arriba).
+    """
+    os.makedirs(ruta, exist_ok=True)
+    with open(os.path.join(ruta, ARCHIVO_ORIGENES), 'w', encoding='utf-8') as f:
+        json.dump(origenes.to_dict(orient='list'), f, ensure_ascii=False)
+    np.save(os.path.join(ruta, ARCHIVO_CODIGOS), np.asarray(codigos, dtype=str))
+    np.save(os.path.join(ruta, ARCHIVO_DISTANCIAS), distancias.astype(np.float32))
+    np.save(os.path.join(ruta, ARCHIVO_TIEMPOS), tiempos.astype(np.float32))
+
+
+class MatrizTiempos:
+    """
+    Consulta de una matriz guardada con guardar_matriz. Los arrays se mapean en
+    memoria y cada origen se consulta en tiempo constante por su nombre.
+    """
+
+    def __init__(self, ruta):
+        with open(os.path.join(ruta, ARCHIVO_ORIGENES), encoding='utf-8') as f:
+            self.origenes = pd.DataFrame(json.load(f))
+        self.posicion_origen = {nombre: i for i, nombre in enumerate(self.origenes['nombre'])}
+        # Los códigos pueden repetirse en el CSV: se usa la primera columna de cada uno
+        codigos = pd.Index(np.load(os.path.join(ruta, ARCHIVO_CODIGOS)))
+        primeros = ~codigos.duplicated()
+        self.codigos = codigos[primeros]
+        self.columnas = np.flatnonzero(primeros)
+        self.distancias = np.load(os.path.join(ruta, ARCHIVO_DISTANCIAS), mmap_mode='r')
+        self.tiempos = np.load(os.path.join(ruta, ARCHIVO_TIEMPOS), mmap_mode='r')
+
+    def nombres(self):
+        return list(self.posicion_origen)
+
+    def contiene(self, codigos):
+        """
+        Indica si alguno de los códigos está en la matriz.
+        """
+        return bool((self.codigos.get_indexer(pd.Index(codigos).astype(str)) >= 0).any())
+
+    def desde(self, origen, codigos):
+        """
+        Devuelve (distancias_km, tiempos_min) desde el origen a los centros con
+        los códigos indicados. Los centros que no están en la matriz son NaN.
+        """
+        fila = self.posicion_origen[origen]
+        posiciones = self.codigos.get_indexer(pd.Index(codigos).astype(str))
+        encontrados = posiciones >= 0
+        columnas = self.columnas[posiciones]
+        distancias = np.full(len(columnas), np.nan)
+        tiempos = np.full(len(columnas), np.nan)
+        distancias[encontrados] = self.distancias[fila, columnas[encontrados]]
+        tiempos[encontrados] = self.tiempos[fila, columnas[encontrados]]
+        return distancias, tiempos
+
+
+@st.cache_resource(show_spinner="Cargando la matriz de tiempos...")
+def cargar_matriz(ruta):
+    """
+    Abre una matriz de tiempos una sola vez por proceso.
+    """
+    return MatrizTiempos(ruta)
+
+
+@st.cache_resource(show_spinner=False, max_entries=32)
+def columnas_desde_origen(clave, ruta, origen, _codigos):
+    """
+    Posiciones de los centros que tienen distancia y tiempo desde el origen
+    (que están en la matriz y conectados con él), con esas distancias y
+    tiempos. Solo se cachean estos arrays, de solo lectura, y no una copia de
+    los datos por origen.
+    """
+    distancias, tiempos = cargar_matriz(ruta).desde(origen, _codigos)
+    validos = np.flatnonzero(~(np.isnan(distancias) | np.isnan(tiempos)))
+    columnas = (validos, distancias[validos].round(1), tiempos[validos].round(0))
+    for array in columnas:
+        array.flags.writeable = False
+    return columnas
+
+
+def datos_desde_origen(clave, ruta, origen, df):
+    """
+    Devuelve una vista de los datos en la que las columnas de distancia y
+    tiempo a Santiago se sustituyen por las del origen indicado en la matriz.
+    Los centros sin distancia o tiempo desde el origen se excluyen, como los
+    que no tienen distancia o tiempo a Santiago al limpiar los datos.
+
+    La vista se crea en cada ejecución a partir de los arrays cacheados de
+    columnas_desde_origen y no se guarda: la caché no crece con copias del
+    DataFrame compartido.
+    """
+    validos, distancias, tiempos = columnas_desde_origen(clave, ruta, origen, df['Código'])
+    vista = df.take(validos) if len(validos) < len(df) else df
+    vista = vista.assign(Distancia_Santiago_km=distancias, Tiempo_Santiago_min=tiempos)
+    return con_clave(vista, f"{clave}|{ruta}|{origen}")
+
+
+def rellenar_santiago(df, enrutador):
+    """
+    Rellena las distancias y tiempos a Santiago que faltan (valores 'ERROR' o
+    vacíos) con los del enrutador. Devuelve el número de filas rellenadas.
+    """
+    faltan = (df['Distancia_Santiago_km'].isna() | df['Tiempo_Santiago_min'].isna()).to_numpy()
+    if faltan.any():
+        lat_centros, lon_centros = df['latitude'].to_numpy()[faltan], df['longitude'].to_numpy()[faltan]
+        enrutador.preparar(lat_centros, lon_centros)
+        distancias, tiempos = enrutador.desde(SANTIAGO[0], SANTIAGO[1], lat_centros, lon_centros)
+        df.loc[faltan, 'Distancia_Santiago_km'] = np.round(distancias, 1)
+        df.loc[faltan, 'Tiempo_Santiago_min'] = np.round(tiempos, 0)
+    return int(faltan.sum())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precalcula la matriz de distancias y tiempos origen → centro.")
+    parser.add_argument('centros', help="CSV de centros")
+    parser.add_argument('salida', help="Directorio donde guardar la matriz")
+    parser.add_argument('--origenes', help="CSV de orígenes (nombre, latitude, longitude). Por defecto, un origen por Concello")
+    parser.add_argument('--grafo', help="CSV de tramos de carretera. Por defecto se usa el enrutador estimado")
+    parser.add_argument('--procesos', type=int, default=None, help="Número de procesos del pool")
+    parser.add_argument('--rellenar', help="Guarda aquí (CSV, .arrow o .parquet) los centros con las distancias y tiempos a Santiago que faltaban rellenados")
+    args = parser.parse_args()
+
+    # Solo se descartan las filas sin coordenadas: las que no tienen distancia
+    # o tiempo a Santiago se calculan con el enrutador
+    df, _ = limpiar_centros(leer_csv(args.centros), obligatorias=['COORDENADA_X', 'COORDENADA_Y'])
+    # Las coordenadas (0, 0) u otras fuera de rango no se pueden enrutar
+    validas = df['latitude'].between(-90, 90) & df['longitude'].between(-180, 180) & ((df['latitude'] != 0) | (df['longitude'] != 0))
+    df = df[validas].copy()
+
+    enrutador = EnrutadorGrafo(args.grafo) if args.grafo else EnrutadorEstimado.calibrar(df)
+    origenes = pd.read_csv(args.origenes) if args.origenes else origenes_concellos(df)
+
+    distancias, tiempos = calcular_matriz(df, origenes, enrutador, procesos=args.procesos)
+    guardar_matriz(args.salida, origenes, df['Código'].astype(str), distancias, tiempos)
+    print(f"Matriz guardada en {args.salida}: {len(origenes)} orígenes × {len(df)} centros.")
+
+    if args.rellenar:
+        rellenadas = rellenar_santiago(df, enrutador)
+        if args.rellenar.lower().endswith(('.arrow', '.feather', '.parquet')):
+            guardar_snapshot(df.dropna(subset=['Distancia_Santiago_km', 'Tiempo_Santiago_min']), args.rellenar)
+        else:
+            df.rename(columns={'latitude': 'COORDENADA_X', 'longitude': 'COORDENADA_Y'}).to_csv(args.rellenar, index=False)
+        print(f"Se han rellenado {rellenadas} distancias y tiempos a Santiago en {args.rellenar}.")
+
+
+if __name__ == '__main__':
+    main()